@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Fetcha - Database benchmark
+Compares PriceTrackerDB hot-path throughput with the old connection-per-call
+behaviour (rollback journal, default pragmas) and the pooled WAL connections
+with the user cache, after asserting that the hot queries are served by their indexes.
+
+Usage:
+    python benchmark_db.py [--users 1000] [--products 3] [--seconds 3]
+"""
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from telegram_price_tracker_mvp import PriceTrackerDB, UserCache
+
+
+class PerCallConnectionDB(PriceTrackerDB):
+    """Pre-pooling behaviour: a fresh default connection for every call, no user cache"""
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.user_cache = UserCache(max_size=0)
+        self._user_invalidations = []
+        self.init_database()
+    
+    @contextmanager
+    def _writer(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    _reader = _writer
+    
+    def close(self):
+        pass
+
+
+# (name, call, SQL fragment, index the plan must use) for each hot access path.
+# The statements are captured from the real PriceTrackerDB methods, so the
+# checks always cover the SQL that ships; the fragment picks the statement.
+QUERY_PLAN_EXPECTATIONS = [
+    ('get_tracked_products', lambda db: db.get_tracked_products(1),
+     'FROM tracked_products', 'idx_tracked_products_user_active'),
+    ('get_active_products_page', lambda db: db.get_active_products_page(0, 1000, True, 1),
+     'FROM tracked_products AS p', 'COVERING INDEX idx_tracked_products_canonical'),
+    ('claim_due_urls', lambda db: db.claim_due_urls('plans', datetime(2000, 1, 1), 100, datetime(2000, 1, 1)),
+     'UPDATE tracked_products', 'COVERING INDEX idx_tracked_products_due'),
+    ('claim_url_lease', lambda db: db.claim_url_lease('plans', 'https://shop0.example.com/p/1', datetime(2000, 1, 1)),
+     'UPDATE tracked_products', 'idx_tracked_products_canonical'),
+    ('get_products_for_url', lambda db: db.get_products_for_url('https://shop0.example.com/p/1'),
+     'FROM tracked_products p', 'idx_tracked_products_canonical'),
+    ('update_product_prices', lambda db: db.update_product_price(1, 100.0),
+     'UPDATE price_history', 'COVERING INDEX idx_price_history_product'),
+    ('get_price_history_versions', lambda db: db.get_price_history_versions([1]),
+     'FROM price_history', 'idx_price_history_product'),
+    ('get_price_history', lambda db: db.get_price_history(1, 30),
+     'ORDER BY checked_at', 'idx_price_history_product'),
+    ('rollup_price_history', lambda db: db.rollup_price_history(1),
+     'FROM price_history', 'idx_price_history_unrolled'),
+    ('iter_price_history (user)', lambda db: list(db.iter_price_history(1)),
+     'FROM price_history', 'idx_price_history_product'),
+    ('iter_price_history (all)', lambda db: list(db.iter_price_history()),
+     'FROM price_history', 'INTEGER PRIMARY KEY'),
+]
+
+
+@contextmanager
+def traced_statements(db: PriceTrackerDB):
+    """Collect every statement db's connections run, with parameters bound"""
+    statements = []
+    connections = [db._write_conn, *db._all_readers]
+    for conn in connections:
+        conn.set_trace_callback(statements.append)
+    try:
+        yield statements
+    finally:
+        for conn in connections:
+            conn.set_trace_callback(None)
+
+
+def query_plans(db: PriceTrackerDB) -> list:
+    """(name, expected index, plan) for every QUERY_PLAN_EXPECTATIONS entry"""
+    plans = []
+    for name, call, fragment, expected in QUERY_PLAN_EXPECTATIONS:
+        with traced_statements(db) as statements:
+            call(db)
+        sql = next((statement for statement in statements if fragment in statement), None)
+        assert sql is not None, f"{name} ran no statement containing {fragment!r}"
+        plans.append((name, expected, ' | '.join(db.explain_query_plan(sql))))
+    return plans
+
+
+def check_query_plans(db: PriceTrackerDB):
+    """Assert that every hot query uses its index and needs no temp b-tree sort"""
+    for name, expected, plan in query_plans(db):
+        assert expected in plan, f"Expected {expected} in the {name} query plan: {plan}"
+        assert 'TEMP B-TREE' not in plan, f"Unexpected sort in the {name} query plan: {plan}"
+        print(f"plan ok ({name}): {plan}")
+
+
+def seed(db: PriceTrackerDB, users: int, products_per_user: int) -> list:
+    """Create users and products; returns the product ids"""
+    product_ids = []
+    for telegram_id in range(1, users + 1):
+        db.add_user(telegram_id, f"user{telegram_id}", "Bench", 'australia')
+        for n in range(products_per_user):
+            product_ids.append(db.add_tracked_product(
+                telegram_id, f"https://shop{n}.example.com/p/{telegram_id}", f"Product {n}", 100.0
+            ))
+    return product_ids
+
+
+def measure(operation, seconds: float) -> float:
+    """Run operation repeatedly for the given time; returns ops/sec"""
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        operation()
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def run_suite(db: PriceTrackerDB, users: int, product_ids: list, seconds: float) -> dict:
+    rng = random.Random(42)
+    return {
+        'get_user': measure(lambda: db.get_user(rng.randint(1, users)), seconds),
+        'get_tracked_products': measure(lambda: db.get_tracked_products(rng.randint(1, users)), seconds),
+        'update_product_price': measure(
+            lambda: db.update_product_price(rng.choice(product_ids), rng.uniform(50, 150)), seconds
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PriceTrackerDB connection handling")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=3, help="Tracked products per user")
+    parser.add_argument('--seconds', type=float, default=3.0, help="Duration of each measurement")
+    args = parser.parse_args()
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, db_class in (('before (connect per call)', PerCallConnectionDB),
+                                ('after (pooled WAL)', PriceTrackerDB)):
+            db = db_class(Path(tmp) / f"{db_class.__name__}.db")
+            product_ids = seed(db, args.users, args.products)
+            if db_class is PriceTrackerDB:
+                check_query_plans(db)
+            results[label] = run_suite(db, args.users, product_ids, args.seconds)
+            print(f"{label} user cache: {db.user_cache.stats()}")
+            db.close()
+    
+    before, after = results.values()
+    print(f"{'operation':<24}{'before ops/s':>14}{'after ops/s':>14}{'speedup':>10}")
+    for operation in before:
+        speedup = after[operation] / before[operation] if before[operation] else 0.0
+        print(f"{operation:<24}{before[operation]:>14.0f}{after[operation]:>14.0f}{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
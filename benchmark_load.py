@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Fetcha - Offline load benchmark
+Drives the PriceTrackerBot handlers with synthetic Telegram updates against
+an in-process fake Bot API, and runs a full price check cycle against fake
+product pages and a stub universal extractor. Nothing leaves the machine.
+
+For each size (users = products) it reports handler throughput (updates/s),
+p50/p95/p99 handler latency, check-cycle duration and the number of SQLite
+statements each phase ran. With --baseline the run fails (exit code 1) when
+a result is worse than the baseline by more than --tolerance.
+
+Usage:
+    python benchmark_load.py [--sizes 1000 10000 100000] [--updates 2000]
+                             [--extract-latency 0.05] [--extract-failure-rate 0.05]
+                             [--json results.json] [--baseline results.json]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+
+import httpx
+
+# Configured before the bot module is imported: extraction jobs run in threads
+# (so they see the stub below, which sleeps rather than computes) and per-host
+# politeness does not dominate the cycle
+os.environ.setdefault('FETCHA_EXTRACTION_POOL', 'thread')
+os.environ.setdefault('FETCHA_EXTRACTION_WORKERS', '8')
+os.environ.setdefault('FETCHA_DOMAIN_RATE', '1000')
+os.environ.setdefault('FETCHA_DOMAIN_BURST', '10')
+os.environ.setdefault('FETCHA_CHECK_PROGRESS_INTERVAL', '3600')
+
+
+class StubExtractionTester:
+    """Stands in for test_universal_parser_approach.UniversalExtractionTester
+    
+    Blocks for latency seconds, fails at failure_rate and otherwise reads the
+    same price the fake product page shows.
+    """
+    
+    latency = 0.05
+    failure_rate = 0.05
+    calls = 0
+    _calls_lock = threading.Lock()
+    
+    def __init__(self, target_url: str):
+        self.target_url = target_url
+    
+    def run_intelligent_extraction_test(self) -> bool:
+        with self._calls_lock:
+            StubExtractionTester.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return False
+        self._dedicated_parser_results = {
+            'product_name': page_product_name(self.target_url),
+            'price': page_price(self.target_url),
+        }
+        return True
+
+
+sys.modules['test_universal_parser_approach'] = types.SimpleNamespace(UniversalExtractionTester=StubExtractionTester)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+from telegram_price_tracker_mvp import (  # noqa: E402
+    AsyncPriceTrackerDB, HttpFetcher, PriceChecker, PriceTrackerBot, PriceTrackerDB
+)
+
+
+def page_price(url: str) -> float:
+    """Deterministic price shown by the fake page for a URL"""
+    digest = hashlib.sha1(url.encode()).digest()
+    return round(10 + int.from_bytes(digest[:4], 'big') % 99000 / 100, 2)
+
+
+def page_product_name(url: str) -> str:
+    return f"Bench product {url.rsplit('/', 1)[-1]}"
+
+
+def product_url(n: int, hosts: int) -> str:
+    return f"https://shop{n % hosts}.example.com/p/{n}"
+
+
+class FakeBotAPI(BaseRequest):
+    """In-process Telegram Bot API: answers every method with a plausible result"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        
+        params = request_data.parameters if request_data is not None else {}
+        if api_method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fetcha', 'username': 'fetcha_bench_bot'}
+        elif api_method in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class FakeHttpFetcher(HttpFetcher):
+    """HttpFetcher whose client serves fake product pages (with ETags) in-process"""
+    
+    def __init__(self, latency: float, not_modified_rate: float):
+        super().__init__()
+        self.latency = latency
+        self.not_modified_rate = not_modified_rate
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=httpx.MockTransport(self._serve))
+        return self._client
+    
+    async def resolve(self, host: str, port: int) -> list:
+        return ['93.184.216.34']  # A public address for every fake shop, without DNS lookups
+    
+    async def _serve(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        url = str(request.url)
+        price = page_price(url)
+        etag = f'"{price}"'
+        if request.headers.get('If-None-Match') == etag and random.random() < self.not_modified_rate:
+            return httpx.Response(304)
+        
+        name = page_product_name(url)
+        html = (
+            '<html><head><script type="application/ld+json">'
+            + json.dumps({'@type': 'Product', 'name': name, 'offers': {'price': f"{price:.2f}"}})
+            + f'</script></head><body><h1>{name}</h1><span class="price">${price:.2f}</span></body></html>'
+        )
+        return httpx.Response(200, text=html, headers={'ETag': etag})
+
+
+class StatementCounter:
+    """Counts SQL statements run on a PriceTrackerDB's connections"""
+    
+    def __init__(self, db: PriceTrackerDB):
+        self.counts = {'reads': 0, 'writes': 0}
+        self._last = dict(self.counts)
+        self._lock = threading.Lock()
+        db._write_conn.set_trace_callback(lambda _: self._count('writes'))
+        for conn in db._all_readers:
+            conn.set_trace_callback(lambda _: self._count('reads'))
+    
+    def _count(self, kind: str):
+        with self._lock:
+            self.counts[kind] += 1
+    
+    def lap(self) -> dict:
+        """Statements since the previous lap"""
+        with self._lock:
+            counts = dict(self.counts)
+        lap = {kind: counts[kind] - self._last[kind] for kind in counts}
+        self._last = counts
+        return lap
+
+
+def seed(db: PriceTrackerDB, size: int, hosts: int, change_rate: float):
+    """size users with one product each; change_rate of them priced off the page"""
+    rng = random.Random(size)
+    with db.write_batch():
+        for n in range(1, size + 1):
+            db.add_user(n, f"user{n}", "Bench", 'australia')
+            url = product_url(n, hosts)
+            price = page_price(url)
+            if rng.random() < change_rate:
+                price = round(price * 1.1, 2)
+            db.add_tracked_product(n, url, page_product_name(url), price)
+
+
+def synthetic_updates(count: int, users: int, hosts: int, bot_user: dict) -> list:
+    """A mix of commands, URL messages, feedback and button presses as Bot API JSON"""
+    rng = random.Random(count)
+    update_ids = itertools.count(1)
+    next_product = itertools.count(users + 1)
+    
+    def message(user_id: int, text: str) -> dict:
+        data = {
+            'message_id': next(update_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench',
+                     'username': f"user{user_id}", 'language_code': 'en'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': data['message_id'], 'message': data}
+    
+    def callback(user_id: int, data: str) -> dict:
+        update_id = next(update_ids)
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'data': data,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'from': bot_user,
+                        'chat': {'id': user_id, 'type': 'private'}, 'text': 'menu'},
+        }}
+    
+    mix = [
+        (20, lambda u: [message(u, '/start')]),
+        (20, lambda u: [message(u, '/list')]),
+        (10, lambda u: [message(u, '/help')]),
+        (15, lambda u: [message(u, product_url(next(next_product), hosts))]),
+        (10, lambda u: [callback(u, 'feedback_feature'), message(u, 'Please add CSV export')]),
+        (10, lambda u: [callback(u, 'feedback_platform')]),
+        (10, lambda u: [callback(u, f"region_{rng.choice(['usa', 'india', 'australia'])}")]),
+        (5, lambda u: [callback(u, f"delete_{u}")]),
+    ]
+    weights = [weight for weight, _ in mix]
+    
+    updates = []
+    while len(updates) < count:
+        _, make = rng.choices(mix, weights)[0]
+        updates.extend(make(rng.randint(1, users)))
+    return updates[:count]
+
+
+def percentile(latencies: list, p: int) -> float:
+    return statistics.quantiles(latencies, n=100)[p - 1] if len(latencies) > 1 else latencies[0]
+
+
+async def run_handlers(bot: PriceTrackerBot, api: FakeBotAPI, size: int, hosts: int,
+                       updates: int, concurrency: int) -> dict:
+    """Feed synthetic updates through the bot's handlers; latency per update"""
+    application = Application.builder().token('1:BENCH').request(api).get_updates_request(api).build()
+    bot.add_handlers(application)
+    await application.initialize()
+    
+    bot_user = {'id': 1, 'is_bot': True, 'first_name': 'Fetcha'}
+    stream = [Update.de_json(data, application.bot)
+              for data in synthetic_updates(updates, size, hosts, bot_user)]
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+    
+    async def handle(update: Update):
+        async with slots:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(update) for update in stream))
+    elapsed = time.perf_counter() - started
+    await application.shutdown()
+    
+    return {
+        'updates': len(stream),
+        'updates_per_sec': len(stream) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+async def run_check_cycle(checker: PriceChecker) -> dict:
+    """One full check cycle over every tracked product"""
+    extractions = StubExtractionTester.calls
+    started = time.perf_counter()
+    await checker.run_full_cycle()
+    elapsed = time.perf_counter() - started
+    return {
+        'cycle_seconds': elapsed,
+        'extractions': StubExtractionTester.calls - extractions,
+    }
+
+
+async def run_size(size: int, args, tmp: str) -> dict:
+    db = PriceTrackerDB(Path(tmp) / f"load_{size}.db")
+    seed(db, size, args.hosts, args.change_rate)
+    counter = StatementCounter(db)
+    async_db = AsyncPriceTrackerDB(db)
+    api = FakeBotAPI(args.api_latency)
+    
+    bot = PriceTrackerBot('1:BENCH', run_checker=False, db=async_db)
+    bot.http = FakeHttpFetcher(args.page_latency, 0.0)  # /track reads structured data from the page first
+    handlers = await run_handlers(bot, api, size, args.hosts, args.updates, args.concurrency)
+    handlers['db'] = counter.lap()
+    
+    checker = PriceChecker(async_db, bot.extraction_pool, FakeHttpFetcher(args.page_latency, args.not_modified_rate))
+    cycle = await run_check_cycle(checker)
+    cycle['products_per_sec'] = size / cycle['cycle_seconds']
+    cycle['db'] = counter.lap()
+    
+    await checker.http.aclose()
+    bot.extraction_pool.shutdown()
+    await bot.http.aclose()
+    await async_db.close()
+    return {'size': size, 'handlers': handlers, 'cycle': cycle, 'bot_api_calls': api.calls}
+
+
+def find_regressions(results: list, baseline: list, tolerance: float) -> list:
+    """Results worse than the baseline run of the same size by more than tolerance"""
+    checks = [  # (section, metric, higher is better)
+        ('handlers', 'updates_per_sec', True),
+        ('handlers', 'p95_ms', False),
+        ('handlers', 'p99_ms', False),
+        ('cycle', 'cycle_seconds', False),
+    ]
+    previous = {run['size']: run for run in baseline}
+    regressions = []
+    for run in results:
+        base = previous.get(run['size'])
+        if base is None:
+            continue
+        for section, metric, higher_is_better in checks:
+            now, then = run[section][metric], base[section][metric]
+            worse = now < then * (1 - tolerance) if higher_is_better else now > then * (1 + tolerance)
+            if worse:
+                regressions.append(f"size {run['size']}: {metric} {then:.1f} -> {now:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the Fetcha bot")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Users (one tracked product each) per run")
+    parser.add_argument('--updates', type=int, default=2000, help="Synthetic updates per run")
+    parser.add_argument('--concurrency', type=int, default=64, help="Updates handled at once")
+    parser.add_argument('--hosts', type=int, default=500, help="Distinct shop hosts")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="Fake Bot API seconds per call")
+    parser.add_argument('--page-latency', type=float, default=0.01, help="Fake product page seconds per fetch")
+    parser.add_argument('--extract-latency', type=float, default=0.05, help="Stub extractor seconds per job")
+    parser.add_argument('--extract-failure-rate', type=float, default=0.05)
+    parser.add_argument('--not-modified-rate', type=float, default=0.0,
+                        help="Share of revalidated pages answered 304")
+    parser.add_argument('--change-rate', type=float, default=0.1, help="Share of products whose price changed")
+    parser.add_argument('--json', help="Write results to this file")
+    parser.add_argument('--baseline', help="Fail if results regress against this --json file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed regression (fraction)")
+    args = parser.parse_args()
+    
+    logging.getLogger('telegram_price_tracker_mvp').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    StubExtractionTester.latency = args.extract_latency
+    StubExtractionTester.failure_rate = args.extract_failure_rate
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            results.append(asyncio.run(run_size(size, args, tmp)))
+    
+    print(f"{'size':>8}{'updates/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'db/update':>11}{'cycle s':>9}{'products/s':>12}{'db/product':>12}")
+    for run in results:
+        handlers, cycle = run['handlers'], run['cycle']
+        handler_ops = sum(handlers['db'].values()) / handlers['updates']
+        cycle_ops = sum(cycle['db'].values()) / run['size']
+        print(f"{run['size']:>8}{handlers['updates_per_sec']:>11.0f}{handlers['p50_ms']:>9.1f}"
+              f"{handlers['p95_ms']:>9.1f}{handlers['p99_ms']:>9.1f}{handler_ops:>11.1f}"
+              f"{cycle['cycle_seconds']:>9.1f}{cycle['products_per_sec']:>12.0f}{cycle_ops:>12.1f}")
+    
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    
+    if args.baseline:
+        regressions = find_regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,21 +13,48 @@ MVP Features:
 Usage:
 1. Set TELEGRAM_BOT_TOKEN environment variable
 2. Run: python telegram_price_tracker_mvp.py
+   (or run the front-end and checkers separately:
+    python telegram_price_tracker_mvp.py bot
+    python telegram_price_tracker_mvp.py checker)
 """
 
 import os
+import re
 import sys
+import signal
+import socket
+import argparse
 import json
 import time
 import logging
 import asyncio
 import sqlite3
+import threading
+import queue
+import heapq
+import hashlib
+import ipaddress
+import random
+import io
+import csv
+import tempfile
+import cProfile
+import pstats
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from concurrent.futures import Executor, Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import httpx
+import httpcore
 
 # Telegram imports
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -44,294 +71,3630 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Add parent directory to path for scraper import
-sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+# Add parent directory to path for scraper import
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+# Try to import scraper - if not available (cloud deployment), scraping will be disabled
+try:
+    from test_universal_parser_approach import UniversalExtractionTester
+    SCRAPER_AVAILABLE = True
+    logger.info("Scraper module loaded successfully")
+except ImportError:
+    SCRAPER_AVAILABLE = False
+    logger.warning("Scraper module not available - only pages with structured price data can be tracked. "
+                   "This is normal for cloud deployment.")
+
+# HTTP/2 support for httpx needs the optional h2 package (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+    logger.warning("h2 not installed - shared HTTP client will use HTTP/1.1")
+
+# Webhook mode serves updates from PTB's embedded tornado server (python-telegram-bot[webhooks])
+try:
+    import tornado  # noqa: F401
+    WEBHOOK_AVAILABLE = True
+except ImportError:
+    WEBHOOK_AVAILABLE = False
+
+# /history price analytics are computed with NumPy
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy not installed - /history price analytics disabled")
+
+# Database setup
+DB_PATH = Path(__file__).parent / "price_tracker.db"
+DB_READERS = int(os.getenv('FETCHA_DB_READERS', '4'))  # Pooled read-only connections
+DB_BUSY_TIMEOUT = float(os.getenv('FETCHA_DB_BUSY_TIMEOUT', '30'))  # Seconds to wait on a locked database
+DB_CACHE_SIZE_KB = int(os.getenv('FETCHA_DB_CACHE_SIZE_KB', '32768'))  # Page cache per connection
+DB_MMAP_SIZE = int(os.getenv('FETCHA_DB_MMAP_SIZE', str(256 * 1024 * 1024)))  # Memory-mapped I/O (bytes)
+DB_STATEMENT_CACHE = int(os.getenv('FETCHA_DB_STATEMENT_CACHE', '256'))  # Prepared statements kept per connection
+DB_WRITE_BATCH = int(os.getenv('FETCHA_DB_WRITE_BATCH', '256'))  # Max queued writes coalesced into one transaction
+USER_CACHE_SIZE = int(os.getenv('FETCHA_USER_CACHE_SIZE', '10000'))  # Users kept in memory by get_user (0 = off)
+USER_CACHE_TTL = float(os.getenv('FETCHA_USER_CACHE_TTL', '300'))  # Seconds a cached user record is trusted
+
+# Background check engine settings
+CHECK_WORKERS = int(os.getenv('FETCHA_CHECK_WORKERS', '8'))  # Concurrent worker tasks per cycle
+CHECK_MAX_IN_FLIGHT = int(os.getenv('FETCHA_CHECK_MAX_IN_FLIGHT', '8'))  # Global cap on running extractions
+CHECK_PROGRESS_INTERVAL = float(os.getenv('FETCHA_CHECK_PROGRESS_INTERVAL', '60'))  # Progress log interval (seconds)
+CHECK_WRITE_BATCH = int(os.getenv('FETCHA_CHECK_WRITE_BATCH', '500'))  # Price results per write transaction
+CHECK_WRITE_INTERVAL = float(os.getenv('FETCHA_CHECK_WRITE_INTERVAL', '10'))  # Max seconds a result waits to be written
+CHECK_STREAM_PAGE = int(os.getenv('FETCHA_CHECK_STREAM_PAGE', '1000'))  # Active products read per keyset page
+CHECK_STREAM_WINDOW = int(os.getenv('FETCHA_CHECK_STREAM_WINDOW', '2000'))  # URLs a full cycle holds queued or in flight
+CHECK_CYCLE_CHECKPOINT_INTERVAL = float(os.getenv('FETCHA_CHECK_CYCLE_CHECKPOINT_INTERVAL', '30'))  # Seconds between full cycle checkpoints
+CYCLE_COUNTERS = ('total', 'scraped', 'checked', 'changed', 'alerts', 'errors')  # Progress saved with check_cycles
+
+# Adaptive check scheduling (each URL's interval follows its observed price volatility)
+CHECK_SCHEDULER_TICK = float(os.getenv('FETCHA_CHECK_SCHEDULER_TICK', '30'))  # Max seconds between due-queue refills
+CHECK_SCHEDULER_BATCH = int(os.getenv('FETCHA_CHECK_SCHEDULER_BATCH', '500'))  # Due URLs a checker holds (leased) at once
+CHECK_LEASE_SECONDS = float(os.getenv('FETCHA_CHECK_LEASE_SECONDS', '600'))  # Claimed URLs are freed unless renewed in time
+CHECK_FIRST_INTERVAL = float(os.getenv('FETCHA_CHECK_FIRST_INTERVAL', '3600'))  # Seconds before a new product's first check
+CHECK_VOLATILITY_DAYS = float(os.getenv('FETCHA_CHECK_VOLATILITY_DAYS', '14'))  # price_history window used for volatility
+CHECK_CHECKS_PER_CHANGE = float(os.getenv('FETCHA_CHECK_CHECKS_PER_CHANGE', '4'))  # Checks per expected price change
+CHECK_BACKOFF = float(os.getenv('FETCHA_CHECK_BACKOFF', '1.5'))  # Interval growth after a window without changes
+CHECK_JITTER = float(os.getenv('FETCHA_CHECK_JITTER', '0.1'))  # Random +/- fraction that spreads checks over the day
+CHECK_RETRY_BASE = float(os.getenv('FETCHA_CHECK_RETRY_BASE', '120'))  # Seconds before retrying a failed check (doubles per failure)
+CHECK_RETRY_MAX = float(os.getenv('FETCHA_CHECK_RETRY_MAX', str(6 * 3600)))  # Longest retry delay (never above the tier's max interval)
+
+# Per-domain circuit breaker (stops checking a domain whose checks keep failing)
+BREAKER_FAILURES = int(os.getenv('FETCHA_BREAKER_FAILURES', '5'))  # Consecutive failed checks that open a domain's breaker
+BREAKER_COOLDOWN = float(os.getenv('FETCHA_BREAKER_COOLDOWN', '300'))  # Seconds an opened breaker skips the domain
+BREAKER_MAX_COOLDOWN = float(os.getenv('FETCHA_BREAKER_MAX_COOLDOWN', '3600'))  # Cooldown cap (doubles per failed probe)
+BREAKER_PROBES = int(os.getenv('FETCHA_BREAKER_PROBES', '1'))  # Checks let through at once while half-open
+
+# [min, max] check interval in seconds per user tier; a URL gets its best subscriber's bounds.
+# Override as JSON, e.g. {"starter": [1800, 43200]}
+CHECK_INTERVAL_BOUNDS = {
+    'free': [6 * 3600, 48 * 3600],
+    'starter': [3600, 24 * 3600],
+    'professional': [900, 12 * 3600],
+    'business': [900, 6 * 3600],
+}
+CHECK_INTERVAL_BOUNDS.update(json.loads(os.getenv('FETCHA_CHECK_INTERVAL_BOUNDS', '{}')))
+
+# Alert delivery (checkers queue alerts in price_alerts, the bot sends them)
+ALERT_POLL_INTERVAL = float(os.getenv('FETCHA_ALERT_POLL_INTERVAL', '5'))  # Seconds between outbox polls
+ALERT_BATCH = int(os.getenv('FETCHA_ALERT_BATCH', '100'))  # Alerts sent per poll
+ALERT_MAX_ATTEMPTS = int(os.getenv('FETCHA_ALERT_MAX_ATTEMPTS', '3'))  # Failed sends before an alert is dropped
+ALERT_RETRY_DELAY = float(os.getenv('FETCHA_ALERT_RETRY_DELAY', '60'))  # Seconds before a failed alert is retried (doubles per attempt)
+ALERT_MIN_CHANGE_PERCENT = float(os.getenv('FETCHA_ALERT_MIN_CHANGE_PERCENT', '5'))  # Smallest price move that alerts
+ALERT_GLOBAL_RATE = float(os.getenv('FETCHA_ALERT_GLOBAL_RATE', '25'))  # Messages/sec across all chats (Telegram allows ~30)
+ALERT_CHAT_RATE = float(os.getenv('FETCHA_ALERT_CHAT_RATE', '1'))  # Messages/sec to one chat
+ALERT_DIGEST_WINDOW = float(os.getenv('FETCHA_ALERT_DIGEST_WINDOW', '30'))  # Seconds a user's alerts wait to be sent as one digest (0 = at once)
+ALERT_DIGEST_MAX = int(os.getenv('FETCHA_ALERT_DIGEST_MAX', '10'))  # Alerts per digest message
+ALERT_CLAIM_SECONDS = float(os.getenv('FETCHA_ALERT_CLAIM_SECONDS', '120'))  # Claimed alerts are hidden from other bot replicas this long
+
+# Telegram front-end: 'polling' for local development, 'webhook' in production (any number of replicas)
+BOT_MODE = os.getenv('FETCHA_BOT_MODE', 'polling')
+BOT_CONCURRENT_UPDATES = int(os.getenv('FETCHA_BOT_CONCURRENT_UPDATES', '64'))  # Updates handled at once (1 = one by one)
+WEBHOOK_URL = os.getenv('FETCHA_WEBHOOK_URL', '')  # Public HTTPS URL Telegram posts updates to; its path is served
+WEBHOOK_LISTEN = os.getenv('FETCHA_WEBHOOK_LISTEN', '0.0.0.0')  # Interface the embedded HTTP server binds
+WEBHOOK_PORT = int(os.getenv('FETCHA_WEBHOOK_PORT', os.getenv('PORT', '8443')))  # Defaults to the platform's $PORT
+WEBHOOK_SECRET = os.getenv('FETCHA_WEBHOOK_SECRET', '')  # Required; requests without this X-Telegram-Bot-Api-Secret-Token get 403
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('FETCHA_WEBHOOK_MAX_CONNECTIONS', '40'))  # Parallel deliveries Telegram may open (1-100)
+
+# /history analytics
+HISTORY_DAYS = float(os.getenv('FETCHA_HISTORY_DAYS', '90'))  # Days of price history the statistics cover
+HISTORY_MOVING_AVERAGES = (7, 30)  # Moving-average lengths (days)
+HISTORY_SPARKLINE_WIDTH = int(os.getenv('FETCHA_HISTORY_SPARKLINE_WIDTH', '30'))  # Characters in a price sparkline
+HISTORY_CACHE_SIZE = int(os.getenv('FETCHA_HISTORY_CACHE_SIZE', '5000'))  # Products whose statistics are kept in memory
+HISTORY_MAX_PRODUCTS = 10  # Products summarised in one /history message
+SPARKLINE_BLOCKS = '▁▂▃▄▅▆▇█'
+
+# Data export (/export and the 'export' CLI role)
+ADMIN_IDS = {int(i) for i in os.getenv('FETCHA_ADMIN_IDS', '').split(',') if i.strip()}  # Telegram ids that may export everyone's data
+EXPORT_PAGE_SIZE = int(os.getenv('FETCHA_EXPORT_PAGE_SIZE', '1000'))  # Rows read per keyset page
+EXPORT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # Telegram's limit for documents sent by bots
+EXPORT_COLUMNS = {
+    'products': ('id', 'telegram_id', 'url', 'product_name', 'current_price', 'alert_price',
+                 'active', 'created_at', 'last_check'),
+    'history': ('id', 'product_id', 'price', 'checked_at', 'last_seen_at'),
+}
+
+# Price history storage: 'changes' keeps one row per price (extending its last_seen_at
+# while the price holds), 'all' keeps one row per check
+PRICE_HISTORY_MODE = os.getenv('FETCHA_PRICE_HISTORY_MODE', 'changes')
+PRICE_ROLLUP_INTERVAL = float(os.getenv('FETCHA_PRICE_ROLLUP_INTERVAL', '3600'))  # Seconds between rollup/retention runs
+PRICE_ROLLUP_BATCH = int(os.getenv('FETCHA_PRICE_ROLLUP_BATCH', '5000'))  # History rows rolled up per transaction
+PRICE_COMPACT_BATCH = int(os.getenv('FETCHA_PRICE_COMPACT_BATCH', '500'))  # Products compacted per transaction (migration 13)
+PRICE_HISTORY_RETENTION_DAYS = float(os.getenv('FETCHA_PRICE_HISTORY_RETENTION_DAYS', '365'))  # Raw rows (0 = forever)
+PRICE_HOURLY_RETENTION_DAYS = float(os.getenv('FETCHA_PRICE_HOURLY_RETENTION_DAYS', '90'))  # Hourly rollups (0 = forever)
+PRICE_DAILY_RETENTION_DAYS = float(os.getenv('FETCHA_PRICE_DAILY_RETENTION_DAYS', '0'))  # Daily rollups (0 = forever)
+
+# Rollup tables and their bucket size in seconds
+PRICE_ROLLUPS = (('price_history_hourly', 3600), ('price_history_daily', 86400))
+
+# Extraction pool settings (the universal scraper is blocking and takes 30-60s per URL)
+EXTRACTION_POOL_MODE = os.getenv('FETCHA_EXTRACTION_POOL', 'process')  # 'process' or 'thread'
+EXTRACTION_WORKERS = int(os.getenv('FETCHA_EXTRACTION_WORKERS', str(os.cpu_count() or 2)))
+EXTRACTION_TIMEOUT = float(os.getenv('FETCHA_EXTRACTION_TIMEOUT', '120'))  # Per-job timeout (seconds)
+EXTRACTION_MAX_JOBS_PER_WORKER = int(os.getenv('FETCHA_EXTRACTION_MAX_JOBS_PER_WORKER', '50'))  # Recycle after N jobs
+EXTRACTION_INTERACTIVE_SLOTS = int(os.getenv('FETCHA_EXTRACTION_INTERACTIVE_SLOTS', '1'))  # Workers kept free for chat requests
+
+# Shared HTTP client settings
+HTTP_TIMEOUT = float(os.getenv('FETCHA_HTTP_TIMEOUT', '20'))  # Seconds per request
+HTTP_MAX_CONNECTIONS = int(os.getenv('FETCHA_HTTP_MAX_CONNECTIONS', '100'))  # Open connections across all hosts
+HTTP_MAX_KEEPALIVE = int(os.getenv('FETCHA_HTTP_MAX_KEEPALIVE', '50'))  # Idle connections kept for reuse
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('FETCHA_HTTP_KEEPALIVE_EXPIRY', '60'))  # Seconds an idle connection is kept
+HTTP_MAX_REDIRECTS = int(os.getenv('FETCHA_HTTP_MAX_REDIRECTS', '10'))  # Redirects followed for pages users submit
+HTTP_USER_AGENT = os.getenv(
+    'FETCHA_HTTP_USER_AGENT',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/124.0 Safari/537.36'
+)
+
+# Metrics endpoint (Prometheus text format) and on-demand profiling
+METRICS_PORT = int(os.getenv('FETCHA_METRICS_PORT', '0'))  # 0 = no endpoint; give each process its own port
+METRICS_HOST = os.getenv('FETCHA_METRICS_HOST', '127.0.0.1')  # Keep local; the profile route is not authenticated
+METRICS_MAX_DOMAINS = int(os.getenv('FETCHA_METRICS_MAX_DOMAINS', '200'))  # Domain labels before the rest become 'other'
+METRICS_PROFILE_MAX_SECONDS = float(os.getenv('FETCHA_METRICS_PROFILE_MAX_SECONDS', '300'))  # Longest profiling window
+METRICS_PROFILE_DIR = os.getenv('FETCHA_METRICS_PROFILE_DIR', '')  # Also save raw .prof files here (empty = don't)
+
+# Histogram buckets in seconds
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Every exported metric: name -> (type, help)
+METRIC_DESCRIPTIONS = {
+    'fetcha_db_seconds': ('histogram', "PriceTrackerDB call time by method, excluding queueing"),
+    'fetcha_db_batch_seconds': ('histogram', "Time to apply and commit a coalesced write batch"),
+    'fetcha_db_pending_writes': ('gauge', "Writes queued for the database writer thread"),
+    'fetcha_user_cache_hits': ('gauge', "User cache hits since start"),
+    'fetcha_user_cache_misses': ('gauge', "User cache misses since start"),
+    'fetcha_page_fetch_seconds': ('histogram', "Product page fetch time by domain"),
+    'fetcha_page_fetches_total': ('counter', "Product page fetches by domain and status"),
+    'fetcha_check_seconds': ('histogram', "Time to check one URL (fetch and extract) by domain"),
+    'fetcha_checks_total': ('counter', "URL checks by domain and outcome"),
+    'fetcha_extraction_seconds': ('histogram', "Universal extractor job time by priority"),
+    'fetcha_extractions_total': ('counter', "Universal extractor jobs by priority and outcome"),
+    'fetcha_recipe_lookups_total': ('counter', "Extraction recipe lookups by outcome"),
+    'fetcha_extraction_tier_seconds': ('histogram', "Price extraction time by tier (recipe, structured, universal)"),
+    'fetcha_extraction_tier_total': ('counter', "Price extraction attempts by tier and outcome (hit or miss)"),
+    'fetcha_page_fingerprints_total': ('counter', "Fetched pages by fingerprint outcome (unchanged, changed, none)"),
+    'fetcha_telegram_send_seconds': ('histogram', "Alert send_message latency"),
+    'fetcha_telegram_sends_total': ('counter', "Alert send_message calls by outcome"),
+    'fetcha_due_claimed': ('gauge', "URLs this checker holds leases on"),
+    'fetcha_scheduler_queued': ('gauge', "URLs waiting in the domain scheduler"),
+    'fetcha_write_buffer': ('gauge', "Price results buffered for the next write batch"),
+    'fetcha_check_cycle_seconds': ('histogram', "Duration of full check cycles"),
+    'fetcha_breakers_open': ('gauge', "Domains whose circuit breaker is open or half-open"),
+}
+
+# Extraction recipe cache settings
+RECIPE_CACHE_SIZE = int(os.getenv('FETCHA_RECIPE_CACHE_SIZE', '5000'))  # Recipes kept; least recently used are evicted
+RECIPE_MAX_PRICE_RATIO = float(os.getenv('FETCHA_RECIPE_MAX_PRICE_RATIO', '5'))  # Reject recipe prices this far off the last price
+STRUCTURED_DATA_CHUNK = 64 * 1024  # Characters of HTML parsed before looking for a JSON-LD product price
+STRUCTURED_PRODUCT_TYPES = {'Product', 'ProductGroup', 'IndividualProduct', 'ProductModel'}  # schema.org types with offers
+
+# Page fingerprints (a page whose content is unchanged around the same price is not re-extracted)
+FINGERPRINT_SCOPE = os.getenv('FETCHA_FINGERPRINT_SCOPE', 'page')  # 'page', 'price' (the region around the last price) or 'off'
+FINGERPRINT_WINDOW = int(os.getenv('FETCHA_FINGERPRINT_WINDOW', '2000'))  # Characters either side of the price hashed in 'price' scope
+
+# Dynamic noise stripped from a page before it is fingerprinted
+FINGERPRINT_NOISE = [
+    re.compile(r'<script(?![^>]*ld\+json)[^>]*>.*?</script>', re.I | re.S),  # Scripts, but not JSON-LD data
+    re.compile(r'<style[^>]*>.*?</style>', re.I | re.S),
+    re.compile(r'<!--.*?-->', re.S),
+    re.compile(r'<(?:input|meta)\b[^>]*(?:csrf|xsrf|token|nonce)[^>]*>', re.I),  # CSRF tokens
+    re.compile(r'\s(?:nonce|integrity|data-[\w-]*(?:token|session|nonce|time)[\w-]*)="[^"]*"', re.I),
+    re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?'),  # Timestamps
+    re.compile(r'(?<!\d)1\d{9}(?:\d{3})?(?!\d)'),  # Unix times in seconds or milliseconds
+]
+
+# Per-domain politeness defaults (one request every 5 seconds per site, one at a time)
+DOMAIN_RATE = float(os.getenv('FETCHA_DOMAIN_RATE', '0.2'))  # Requests per second per host
+DOMAIN_BURST = float(os.getenv('FETCHA_DOMAIN_BURST', '1'))  # Token bucket capacity per host
+DOMAIN_CONCURRENCY = int(os.getenv('FETCHA_DOMAIN_CONCURRENCY', '1'))  # Max simultaneous requests per host
+
+# Query parameters that only track the visitor and never change the product page
+TRACKING_PARAMS = {
+    'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'ref', 'ref_', 'referrer', 'tag', 'affid', 'aff_id', 'spm', 'srsltid',
+    'psc', 'pd_rd_i', 'pd_rd_r', 'pd_rd_w', 'pd_rd_wg', 'pf_rd_p', 'pf_rd_r', 'qid', 'sr', 'crid',
+}
+
+# Per-host overrides as JSON, e.g. {"amazon.com.au": {"rate": 0.5, "burst": 2, "concurrency": 2}}
+DOMAIN_POLICIES = json.loads(os.getenv('FETCHA_DOMAIN_POLICIES', '{}'))
+
+
+def _backfill_check_schedule(conn: sqlite3.Connection):
+    """Migration 5: canonical URLs for existing rows, first checks spread over a day"""
+    rows = conn.execute('SELECT id, url FROM tracked_products').fetchall()
+    conn.executemany(
+        'UPDATE tracked_products SET canonical_url = ? WHERE id = ?',
+        [(canonicalize_url(url), product_id) for product_id, url in rows]
+    )
+    conn.execute('''
+        UPDATE tracked_products
+        SET next_check_at = datetime('now', '+' || (abs(random()) % 86400) || ' seconds')
+        WHERE active = 1
+    ''')
+
+
+def _compact_price_history(conn: sqlite3.Connection, batch: int = PRICE_COMPACT_BATCH):
+    """Migration 13: set last_seen_at, and in 'changes' mode collapse runs of an unchanged price
+    
+    Works through the table batch products at a time and commits after each
+    batch, so it neither holds the table in memory nor the write lock for one
+    long transaction. Re-running it is harmless, so an interrupted migration
+    simply resumes.
+    """
+    after = None
+    while True:
+        products = [row[0] for row in conn.execute(
+            'SELECT DISTINCT product_id FROM price_history WHERE product_id > ? ORDER BY product_id LIMIT ?',
+            (after if after is not None else float('-inf'), max(1, batch))
+        )]
+        if not products:
+            break
+        
+        first, after = products[0], products[-1]
+        conn.execute('''
+            UPDATE price_history SET last_seen_at = checked_at
+            WHERE product_id BETWEEN ? AND ? AND last_seen_at IS NULL
+        ''', (first, after))
+        if PRICE_HISTORY_MODE == 'changes':
+            _collapse_price_runs(conn, first, after)
+        
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+    
+    conn.execute('UPDATE price_history SET last_seen_at = checked_at WHERE last_seen_at IS NULL')
+
+
+def _collapse_price_runs(conn: sqlite3.Connection, first: int, last: int):
+    """Delete repeats of an unchanged price for products first..last, extending the run's first row"""
+    extends, deletes = [], []
+    head = None  # (product_id, id, price) of the first row of the current run
+    last_seen = None
+    rows = conn.execute('''
+        SELECT id, product_id, price, last_seen_at, rolled_until FROM price_history
+        WHERE product_id BETWEEN ? AND ?
+        ORDER BY product_id, checked_at, id
+    ''', (first, last))
+    for row_id, product_id, price, seen_at, rolled_until in rows:
+        # Rows already folded into the rollups are kept, or they would count twice
+        if (head is not None and head[0] == product_id and price is not None and rolled_until is None
+                and head[2] is not None and abs(price - head[2]) <= 0.01):
+            deletes.append((row_id,))
+            last_seen = max(last_seen or seen_at, seen_at)
+            continue
+        
+        if last_seen is not None:
+            extends.append((last_seen, head[1]))
+        head, last_seen = (product_id, row_id, price), None
+    if last_seen is not None:
+        extends.append((last_seen, head[1]))
+    
+    conn.executemany('UPDATE price_history SET last_seen_at = MAX(last_seen_at, ?) WHERE id = ?', extends)
+    conn.executemany('DELETE FROM price_history WHERE id = ?', deletes)
+
+
+# Schema migrations: (version, description, steps). Each step is an SQL
+# statement or a callable taking the connection. Migrations run once, in
+# order, inside one transaction each, and are recorded in schema_version.
+# A callable may commit in batches (and BEGIN IMMEDIATE again) only if it is
+# safe to re-run, and only as the sole step of its migration.
+# Append new migrations - never edit one that has shipped.
+MIGRATIONS = [
+    (1, "Baseline schema", [
+        # Users table with region support
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            region TEXT DEFAULT 'unknown',
+            language_code TEXT DEFAULT 'en',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tier TEXT DEFAULT 'free',
+            tracked_count INTEGER DEFAULT 0
+        )
+        ''',
+        
+        # Tracked products table
+        '''
+        CREATE TABLE IF NOT EXISTS tracked_products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            url TEXT NOT NULL,
+            product_name TEXT,
+            current_price REAL,
+            alert_price REAL,
+            last_check TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            active INTEGER DEFAULT 1,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+        )
+        ''',
+        
+        # Price history table
+        '''
+        CREATE TABLE IF NOT EXISTS price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            price REAL,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES tracked_products (id)
+        )
+        ''',
+        
+        # Feature requests table with region and platform tracking
+        '''
+        CREATE TABLE IF NOT EXISTS feature_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            region TEXT,
+            category TEXT,
+            platform TEXT,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+        )
+        ''',
+    ]),
+    (2, "Indexes for the hot query paths", [
+        # get_tracked_products: WHERE telegram_id = ? AND active = 1 ORDER BY created_at DESC
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tracked_products_user_active
+        ON tracked_products (telegram_id, active, created_at)
+        ''',
+        
+        # get_all_tracked_products: active rows only, covering every selected column
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tracked_products_active_covering
+        ON tracked_products (id, telegram_id, url, product_name, current_price, alert_price)
+        WHERE active = 1
+        ''',
+        
+        # price_history lookups by product, in time order, without touching the table
+        '''
+        CREATE INDEX IF NOT EXISTS idx_price_history_product
+        ON price_history (product_id, checked_at, price)
+        ''',
+        
+        'ANALYZE',
+    ]),
+    (3, "HTTP validator cache for conditional GETs", [
+        # ETag / Last-Modified per canonical URL; a row with both NULL means
+        # the server sends no validators, so conditional GETs are skipped
+        '''
+        CREATE TABLE IF NOT EXISTS http_validators (
+            canonical_url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (4, "Per-domain extraction recipe cache", [
+        # Learned price/name locators per (domain, page template), with usage stats
+        '''
+        CREATE TABLE IF NOT EXISTS extraction_recipes (
+            domain TEXT NOT NULL,
+            template TEXT NOT NULL,
+            recipe TEXT NOT NULL,
+            hits INTEGER DEFAULT 0,
+            misses INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (domain, template)
+        ) WITHOUT ROWID
+        ''',
+        
+        '''
+        CREATE INDEX IF NOT EXISTS idx_extraction_recipes_last_used
+        ON extraction_recipes (last_used_at)
+        ''',
+    ]),
+    (5, "Per-product adaptive check schedule", [
+        'ALTER TABLE tracked_products ADD COLUMN canonical_url TEXT',
+        'ALTER TABLE tracked_products ADD COLUMN next_check_at TIMESTAMP',
+        'ALTER TABLE tracked_products ADD COLUMN check_interval INTEGER',
+        _backfill_check_schedule,
+        
+        # Due rows in next_check_at order (inactive rows have none)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tracked_products_due
+        ON tracked_products (next_check_at, canonical_url)
+        ''',
+        
+        # get_products_for_url: every active subscriber of a canonical URL
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tracked_products_canonical
+        ON tracked_products (canonical_url, active)
+        ''',
+    ]),
+    (6, "Checker leases and the price alert queue", [
+        'ALTER TABLE tracked_products ADD COLUMN lease_owner TEXT',
+        'ALTER TABLE tracked_products ADD COLUMN lease_expires_at TIMESTAMP',
+        
+        # renew_leases / release_leases: only leased rows are indexed
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tracked_products_lease
+        ON tracked_products (lease_owner)
+        WHERE lease_owner IS NOT NULL
+        ''',
+        
+        # Alerts queued by checkers, delivered by the bot
+        '''
+        CREATE TABLE IF NOT EXISTS price_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            telegram_id INTEGER,
+            product_name TEXT,
+            url TEXT,
+            old_price REAL,
+            new_price REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            attempts INTEGER DEFAULT 0,
+            FOREIGN KEY (product_id) REFERENCES tracked_products (id)
+        )
+        ''',
+        
+        '''
+        CREATE INDEX IF NOT EXISTS idx_price_alerts_pending
+        ON price_alerts (id, attempts)
+        WHERE sent_at IS NULL
+        ''',
+    ]),
+    (7, "Change-only price history with hourly/daily rollups", [
+        # A row now covers checked_at (first seen) to last_seen_at; rolled_until
+        # is how much of that span has been folded into the rollups
+        'ALTER TABLE price_history ADD COLUMN last_seen_at TIMESTAMP',
+        'ALTER TABLE price_history ADD COLUMN rolled_until TIMESTAMP',
+        # rollup_price_history: rows with time not yet rolled up
+        '''
+        CREATE INDEX IF NOT EXISTS idx_price_history_unrolled
+        ON price_history (id)
+        WHERE rolled_until IS NULL OR last_seen_at > rolled_until
+        ''',
+        
+        # Time-weighted price per product and bucket (avg = price_seconds / seconds)
+        '''
+        CREATE TABLE IF NOT EXISTS price_history_hourly (
+            product_id INTEGER NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            min_price REAL,
+            max_price REAL,
+            avg_price REAL,
+            price_seconds REAL DEFAULT 0,
+            seconds REAL DEFAULT 0,
+            samples INTEGER DEFAULT 0,
+            PRIMARY KEY (product_id, bucket_start)
+        ) WITHOUT ROWID
+        ''',
+        
+        '''
+        CREATE TABLE IF NOT EXISTS price_history_daily (
+            product_id INTEGER NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            min_price REAL,
+            max_price REAL,
+            avg_price REAL,
+            price_seconds REAL DEFAULT 0,
+            seconds REAL DEFAULT 0,
+            samples INTEGER DEFAULT 0,
+            PRIMARY KEY (product_id, bucket_start)
+        ) WITHOUT ROWID
+        ''',
+        
+        # Retention deletes by bucket age
+        '''
+        CREATE INDEX IF NOT EXISTS idx_price_history_hourly_bucket
+        ON price_history_hourly (bucket_start)
+        ''',
+        
+        '''
+        CREATE INDEX IF NOT EXISTS idx_price_history_daily_bucket
+        ON price_history_daily (bucket_start)
+        ''',
+    ]),
+    (8, "Alert dedupe and retry backoff", [
+        # Merge duplicate pending alerts per product: first old price, latest new price
+        '''
+        UPDATE price_alerts SET new_price = (
+            SELECT later.new_price FROM price_alerts AS later
+            WHERE later.product_id = price_alerts.product_id AND later.sent_at IS NULL
+            ORDER BY later.id DESC
+            LIMIT 1
+        )
+        WHERE sent_at IS NULL
+        ''',
+        
+        '''
+        DELETE FROM price_alerts
+        WHERE sent_at IS NULL AND id NOT IN (
+            SELECT MIN(id) FROM price_alerts WHERE sent_at IS NULL GROUP BY product_id
+        )
+        ''',
+        
+        'ALTER TABLE price_alerts ADD COLUMN next_attempt_at TIMESTAMP',
+        
+        # add_price_alerts: at most one pending alert per product
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_price_alerts_pending_product
+        ON price_alerts (product_id)
+        WHERE sent_at IS NULL
+        ''',
+    ]),
+    (9, "Conversation state shared by bot replicas", [
+        # A /feedback answer may reach a different replica than the button press
+        '''
+        CREATE TABLE IF NOT EXISTS feedback_drafts (
+            telegram_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            platform TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (10, "Checkpointed full check cycles", [
+        # One row per full cycle; updated_at is the owner's heartbeat
+        '''
+        CREATE TABLE IF NOT EXISTS check_cycles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            owner TEXT,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            scraped INTEGER NOT NULL DEFAULT 0,
+            checked INTEGER NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL DEFAULT 0,
+            alerts INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            restarts INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        
+        # The last cycle that checked the product; resumed cycles skip it
+        'ALTER TABLE tracked_products ADD COLUMN checked_cycle_id INTEGER',
+    ]),
+    (11, "Failed check backoff", [
+        # Consecutive failed checks; the retry delay doubles with each
+        'ALTER TABLE tracked_products ADD COLUMN check_failures INTEGER NOT NULL DEFAULT 0',
+    ]),
+    (12, "Page content fingerprints", [
+        # page_fingerprint of the page when its price was last recorded
+        'ALTER TABLE http_validators ADD COLUMN fingerprint TEXT',
+    ]),
+    (13, "Compact unchanged price history runs", [
+        # Moved out of migration 7 so it can commit in batches
+        _compact_price_history,
+    ]),
+]
+
+
+def _utc_timestamp(moment: datetime) -> str:
+    """Format a (naive local or aware) datetime like SQLite's CURRENT_TIMESTAMP"""
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _parse_utc_timestamp(value: str) -> datetime:
+    """Parse a timestamp written by _utc_timestamp (or CURRENT_TIMESTAMP) as aware UTC"""
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+def _split_into_buckets(start: float, end: float, size: int):
+    """Yield (bucket_start, seconds) for each size-second bucket overlapping [start, end]
+    
+    Times are epoch seconds. A single point in time (end <= start) counts
+    as one second in its bucket.
+    """
+    bucket = start - start % size
+    if end <= start:
+        yield bucket, 1.0
+        return
+    while bucket < end:
+        overlap = min(end, bucket + size) - max(start, bucket)
+        if overlap > 0:
+            yield bucket, overlap
+        bucket += size
+
+
+class Metrics:
+    """Process-wide counters, gauges and histograms, rendered in Prometheus text format
+    
+    Thread-safe: database calls are timed on executor threads. Gauges are
+    either set or read from a registered function when rendered. Names
+    must be listed in METRIC_DESCRIPTIONS.
+    """
+    
+    def __init__(self, buckets: tuple = METRICS_BUCKETS, max_domains: int = METRICS_MAX_DOMAINS):
+        self.buckets = buckets
+        self.max_domains = max_domains
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._gauges: Dict[Tuple[str, tuple], float] = {}
+        self._gauge_functions: Dict[str, object] = {}
+        self._histograms: Dict[Tuple[str, tuple], list] = {}  # [count per bucket..., sum, count]
+        self._domains = set()
+        self._lock = threading.Lock()
+    
+    def domain(self, url: str) -> str:
+        """Domain label for a URL, bounded to max_domains distinct values"""
+        host = normalize_host(url)
+        with self._lock:
+            if host in self._domains:
+                return host
+            if len(self._domains) < self.max_domains:
+                self._domains.add(host)
+                return host
+        return 'other'
+    
+    def inc(self, name: str, labels: Optional[Dict] = None, value: float = 1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict] = None):
+        with self._lock:
+            self._gauges[(name, tuple(sorted((labels or {}).items())))] = value
+    
+    def gauge_function(self, name: str, fn):
+        """Read gauge name from fn() at render time (None removes it)"""
+        with self._lock:
+            if fn is None:
+                self._gauge_functions.pop(name, None)
+            else:
+                self._gauge_functions[name] = fn
+    
+    def observe(self, name: str, value: float, labels: Optional[Dict] = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+    
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict] = None):
+        """Observe the duration of a with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+    
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        with self._lock:
+            gauge_functions = list(self._gauge_functions.items())
+            gauges = dict(self._gauges)
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        
+        for name, fn in gauge_functions:
+            try:
+                gauges[(name, ())] = fn()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+        
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(list(counters.items()) + list(gauges.items())):
+            samples.setdefault(name, []).append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), values in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {values[-1]}")
+        
+        output = []
+        for name in sorted(samples):
+            kind, description = METRIC_DESCRIPTIONS.get(name, ('untyped', ''))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+    
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+METRICS = Metrics()
+
+
+class EventLoopProfiler:
+    """On-demand cProfile of the event loop thread
+    
+    Profiles everything that runs on the loop (check workers, handlers,
+    alert delivery) for a window of seconds; database and extraction work
+    on executor threads is not included. One window at a time.
+    """
+    
+    def __init__(self):
+        self._running = False
+    
+    async def profile(self, seconds: float, top: int = 50) -> str:
+        """Profile the loop for seconds; returns the top functions by cumulative time"""
+        if self._running:
+            raise RuntimeError("A profile is already running")
+        
+        self._running = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                await asyncio.sleep(min(seconds, METRICS_PROFILE_MAX_SECONDS))
+            finally:
+                profiler.disable()
+        finally:
+            self._running = False
+        
+        if METRICS_PROFILE_DIR:
+            path = Path(METRICS_PROFILE_DIR) / f"fetcha-{os.getpid()}-{int(time.time())}.prof"
+            profiler.dump_stats(path)
+            logger.info(f"Saved event loop profile to {path}")
+        
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+        return report.getvalue()
+
+
+async def start_metrics_server(metrics: Metrics = METRICS) -> Optional[asyncio.AbstractServer]:
+    """Serve GET /metrics and GET /debug/profile?seconds=N on METRICS_HOST:METRICS_PORT
+    
+    Returns None when METRICS_PORT is 0 (disabled).
+    """
+    if not METRICS_PORT:
+        return None
+    
+    profiler = EventLoopProfiler()
+    
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # Headers are not needed
+            
+            target = urlsplit(request_line[1] if len(request_line) > 1 else '/')
+            status, content_type, body = '404 Not Found', 'text/plain', 'Not found\n'
+            if request_line[:1] != ['GET']:
+                status, body = '405 Method Not Allowed', 'GET only\n'
+            elif target.path == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4', metrics.render()
+            elif target.path == '/debug/profile':
+                seconds = float(dict(parse_qsl(target.query)).get('seconds', '30'))
+                try:
+                    status, body = '200 OK', await profiler.profile(seconds)
+                except RuntimeError as e:
+                    status, body = '409 Conflict', f"{e}\n"
+            
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, METRICS_HOST, METRICS_PORT)
+    logger.info(f"Metrics endpoint on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return server
+
+
+class UserCache:
+    """Thread-safe LRU cache of user records with a TTL
+    
+    Writers invalidate() the users they change once their transaction has
+    committed. Every invalidation bumps generation, and put() ignores a
+    record read under an older generation, so a row read before a write
+    committed is never cached after it.
+    """
+    
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: OrderedDict = OrderedDict()  # telegram_id -> (expires, user or None)
+        self._lock = threading.Lock()
+    
+    def get(self, telegram_id: int) -> Tuple[bool, Optional[Dict]]:
+        """Return (found, user); a cached None means the user does not exist"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return True, dict(entry[1]) if entry[1] is not None else None
+    
+    def put(self, telegram_id: int, user: Optional[Dict], generation: int):
+        """Cache a user read while generation was current"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[telegram_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, telegram_id: int):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+            self.generation += 1
+            self.invalidations += 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class PriceStatsCache:
+    """LRU cache of /history statistics per product, valid for one history version
+    
+    A product's version is its latest price_history row and that row's
+    last_seen_at, which every price write changes, so an entry is reused
+    until the product's next price write and never needs invalidating.
+    Only used from the event loop.
+    """
+    
+    def __init__(self, max_size: int = HISTORY_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()  # product_id -> (version, stats)
+    
+    def get(self, product_id: int, version: Tuple[int, str]) -> Optional[Dict]:
+        entry = self._entries.get(product_id)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(product_id)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, product_id: int, version: Tuple[int, str], stats: Dict):
+        if self.max_size <= 0:
+            return
+        self._entries[product_id] = (version, stats)
+        self._entries.move_to_end(product_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class ActiveProduct(NamedTuple):
+    """Compact active tracked_products row, as streamed by iter_active_products"""
+    id: int
+    telegram_id: int
+    url: str
+    product_name: Optional[str]
+    current_price: Optional[float]
+    alert_price: Optional[float]
+    canonical_url: Optional[str]
+
+
+class PriceTrackerDB:
+    """SQLite database for tracking users and products
+    
+    Connections are long-lived: one writer connection serialized by a lock
+    and a small pool of reader connections. The database runs in WAL mode so
+    readers never wait on the writer, and every connection keeps its page
+    cache and prepared statement cache warm between calls.
+    
+    User records are served from a UserCache in front of the database.
+    """
+    
+    def __init__(self, db_path: Path = DB_PATH, readers: int = DB_READERS,
+                 user_cache: Optional[UserCache] = None):
+        self.db_path = db_path
+        self.reader_count = max(1, readers)
+        self.user_cache = user_cache if user_cache is not None else UserCache()
+        self._user_invalidations: List[int] = []
+        self._write_lock = threading.RLock()
+        self._batch_depth = 0
+        self._write_conn = self._connect()
+        self._enable_wal(self._write_conn)
+        
+        self._readers: queue.Queue = queue.Queue()
+        self._all_readers = []
+        for _ in range(self.reader_count):
+            conn = self._connect()
+            self._all_readers.append(conn)
+            self._readers.put(conn)
+        
+        self.init_database()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with tuned pragmas"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = {-DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+    
+    def _enable_wal(self, conn: sqlite3.Connection):
+        """Switch the database file to WAL journal mode (persists in the file)"""
+        mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+        if str(mode).lower() != 'wal':
+            logger.warning(f"Could not enable WAL mode for {self.db_path} (journal_mode={mode})")
+    
+    @contextmanager
+    def _writer(self):
+        """Exclusive use of the writer connection; commits on success
+        
+        Inside write_batch() the call runs in a savepoint of the batch's
+        transaction instead, so a failing call only undoes its own changes.
+        """
+        with self._write_lock:
+            conn = self._write_conn
+            if self._batch_depth:
+                conn.execute('SAVEPOINT write_call')
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute('ROLLBACK TO write_call')
+                    conn.execute('RELEASE write_call')
+                    raise
+                conn.execute('RELEASE write_call')
+                return
+            
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._flush_user_invalidations()
+    
+    def _invalidate_user(self, telegram_id: int):
+        """Drop a user from the cache once the current write commits (or rolls back)"""
+        self._user_invalidations.append(telegram_id)
+    
+    def _flush_user_invalidations(self):
+        invalidations, self._user_invalidations = self._user_invalidations, []
+        for telegram_id in invalidations:
+            self.user_cache.invalidate(telegram_id)
+    
+    @contextmanager
+    def write_batch(self):
+        """Group several write calls into one transaction (one commit)
+        
+        The transaction takes the write lock up front (BEGIN IMMEDIATE):
+        with several processes writing, a deferred transaction that reads
+        before it writes could fail with "database is locked" instead of
+        waiting for the lock.
+        """
+        with self._write_lock:
+            if self._batch_depth == 0:
+                self._write_conn.execute('BEGIN IMMEDIATE')
+            self._batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._write_conn.rollback()
+                    self._flush_user_invalidations()
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                try:
+                    self._write_conn.commit()
+                finally:
+                    self._flush_user_invalidations()
+    
+    @contextmanager
+    def _reader(self):
+        """Borrow a reader connection from the pool"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+    
+    def close(self):
+        """Close all connections (checkpoints the WAL)"""
+        with self._write_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._write_conn.close()
+    
+    def init_database(self):
+        """Initialize database schema by applying pending migrations"""
+        self.migrate()
+    
+    def schema_version(self) -> int:
+        """Highest migration version applied to this database"""
+        with self._reader() as conn:
+            row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+            return row[0] or 0
+    
+    def migrate(self, migrations: Optional[List[Tuple[int, str, list]]] = None):
+        """Apply every migration newer than the database's schema version
+        
+        Each migration runs in its own IMMEDIATE transaction and re-checks the
+        version after taking the write lock, so several processes starting
+        against the same database apply it exactly once.
+        """
+        migrations = MIGRATIONS if migrations is None else migrations
+        
+        with self._writer() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+        for version, description, steps in sorted(migrations, key=lambda m: m[0]):
+            with self._writer() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                current = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+                if version <= current:
+                    continue
+                
+                logger.info(f"Applying database migration {version}: {description}")
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                
+                # OR IGNORE: another process may have finished a migration
+                # whose step committed in batches while this one also ran it
+                conn.execute(
+                    'INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)',
+                    (version, description)
+                )
+    
+    def explain_query_plan(self, sql: str, params: tuple = ()) -> List[str]:
+        """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+        with self._reader() as conn:
+            return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    
+    def add_user(self, telegram_id: int, username: str, first_name: str, 
+                 region: str = 'unknown', language_code: str = 'en'):
+        """Add or update user"""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO users (telegram_id, username, first_name, region, language_code)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (telegram_id, username, first_name, region, language_code))
+            self._invalidate_user(telegram_id)
+    
+    def update_user_region(self, telegram_id: int, region: str):
+        """Update user's region"""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users SET region = ? WHERE telegram_id = ?
+            ''', (region, telegram_id))
+            self._invalidate_user(telegram_id)
+    
+    def get_user(self, telegram_id: int) -> Optional[Dict]:
+        """Get user details (cached)"""
+        found, user = self.user_cache.get(telegram_id)
+        if found:
+            return user
+        
+        return self.load_user(telegram_id)
+    
+    def load_user(self, telegram_id: int) -> Optional[Dict]:
+        """Read a user from the database and cache the record"""
+        generation = self.user_cache.generation
+        user = self._select_user(telegram_id)
+        self.user_cache.put(telegram_id, user, generation)
+        return dict(user) if user is not None else None
+    
+    def _select_user(self, telegram_id: int) -> Optional[Dict]:
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT telegram_id, username, first_name, region, language_code,
+                       created_at, tier, tracked_count
+                FROM users WHERE telegram_id = ?
+            ''', (telegram_id,))
+            row = cursor.fetchone()
+            if row:
+                return {
+                    'telegram_id': row[0],
+                    'username': row[1],
+                    'first_name': row[2],
+                    'region': row[3],
+                    'language_code': row[4],
+                    'created_at': row[5],
+                    'tier': row[6],
+                    'tracked_count': row[7]
+                }
+            return None
+    
+    def add_tracked_product(self, telegram_id: int, url: str, product_name: str, 
+                           current_price: float, alert_price: Optional[float] = None) -> int:
+        """Add tracked product"""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            next_check_at = datetime.now() + timedelta(seconds=CHECK_FIRST_INTERVAL)
+            cursor.execute('''
+                INSERT INTO tracked_products 
+                (telegram_id, url, product_name, current_price, alert_price, last_check,
+                 canonical_url, next_check_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (telegram_id, url, product_name, current_price, alert_price, datetime.now(),
+                  canonicalize_url(url), _utc_timestamp(next_check_at)))
+            
+            product_id = cursor.lastrowid
+            
+            # Update user's tracked count
+            cursor.execute('''
+                UPDATE users SET tracked_count = tracked_count + 1
+                WHERE telegram_id = ?
+            ''', (telegram_id,))
+            self._invalidate_user(telegram_id)
+            
+            return product_id
+    
+    def get_tracked_products(self, telegram_id: int) -> List[Dict]:
+        """Get user's tracked products"""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, url, product_name, current_price, alert_price, last_check, created_at
+                FROM tracked_products
+                WHERE telegram_id = ? AND active = 1
+                ORDER BY created_at DESC
+            ''', (telegram_id,))
+            
+            products = []
+            for row in cursor.fetchall():
+                products.append({
+                    'id': row[0],
+                    'url': row[1],
+                    'product_name': row[2],
+                    'current_price': row[3],
+                    'alert_price': row[4],
+                    'last_check': row[5],
+                    'created_at': row[6]
+                })
+            return products
+    
+    def update_product_price(self, product_id: int, new_price: float) -> Tuple[bool, float]:
+        """Update product price and return if price changed"""
+        results = self.update_product_prices([(product_id, new_price, datetime.now())])
+        return results[product_id]
+    
+    def update_product_prices(self, results: List[Tuple[int, float, datetime]],
+                              validators: Optional[List[Tuple[str, Optional[str], Optional[str], Optional[str]]]] = None
+                              ) -> Dict[int, Tuple[bool, float]]:
+        """Write a batch of (product_id, new_price, checked_at) results in one transaction
+        
+        validators, if given, are (canonical_url, etag, last_modified,
+        fingerprint) rows stored in the same transaction, so a page is only
+        ever answered with 304 Not Modified, or matched by its fingerprint,
+        once its price has been recorded.
+        
+        Returns {product_id: (price_changed, old_price)} with the same
+        semantics as update_product_price.
+        """
+        if not results:
+            return {}
+        
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            
+            if validators:
+                self._store_http_validators(cursor, validators)
+            
+            # Get current prices (chunked to stay under SQLite's variable limit)
+            product_ids = [product_id for product_id, _, _ in results]
+            old_prices = {}
+            for i in range(0, len(product_ids), 500):
+                chunk = product_ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(
+                    f'SELECT id, current_price FROM tracked_products WHERE id IN ({placeholders})',
+                    chunk
+                )
+                old_prices.update(cursor.fetchall())
+            
+            # Update prices
+            cursor.executemany('''
+                UPDATE tracked_products 
+                SET current_price = ?, last_check = ?
+                WHERE id = ?
+            ''', [(new_price, checked_at, product_id) for product_id, new_price, checked_at in results])
+            
+            # Add to price history (UTC, same format as CURRENT_TIMESTAMP)
+            observations = [(product_id, new_price, _utc_timestamp(checked_at))
+                            for product_id, new_price, checked_at in results]
+            if PRICE_HISTORY_MODE == 'changes':
+                self._record_price_observations(cursor, observations)
+            else:
+                cursor.executemany('''
+                    INSERT INTO price_history (product_id, price, checked_at, last_seen_at)
+                    VALUES (?, ?, ?, ?)
+                ''', [(product_id, price, seen_at, seen_at) for product_id, price, seen_at in observations])
+            
+            changes = {}
+            for product_id, new_price, _ in results:
+                old_price = old_prices.get(product_id)
+                price_changed = old_price is not None and abs(old_price - new_price) > 0.01
+                changes[product_id] = (price_changed, old_price if old_price else new_price)
+            return changes
+    
+    def _record_price_observations(self, cursor: sqlite3.Cursor, observations: List[Tuple[int, float, str]]):
+        """Change-only history: extend the latest row while its price holds, else add a row"""
+        for product_id, price, seen_at in observations:
+            cursor.execute('''
+                UPDATE price_history SET last_seen_at = ?
+                WHERE id = (
+                    SELECT id FROM price_history
+                    WHERE product_id = ?
+                    ORDER BY checked_at DESC
+                    LIMIT 1
+                ) AND ABS(price - ?) <= 0.01
+            ''', (seen_at, product_id, price))
+            
+            if cursor.rowcount == 0:
+                cursor.execute('''
+                    INSERT INTO price_history (product_id, price, checked_at, last_seen_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (product_id, price, seen_at, seen_at))
+    
+    def touch_last_check(self, product_ids: List[int], checked_at: datetime):
+        """Record a check that found the page unchanged
+        
+        No history row is added; the latest row's last_seen_at is extended,
+        since its price was seen again.
+        """
+        seen_at = _utc_timestamp(checked_at)
+        with self._writer() as conn:
+            conn.executemany(
+                'UPDATE tracked_products SET last_check = ? WHERE id = ?',
+                [(checked_at, product_id) for product_id in product_ids]
+            )
+            conn.executemany('''
+                UPDATE price_history SET last_seen_at = ?
+                WHERE id = (
+                    SELECT id FROM price_history
+                    WHERE product_id = ?
+                    ORDER BY checked_at DESC
+                    LIMIT 1
+                ) AND last_seen_at < ?
+            ''', [(seen_at, product_id, seen_at) for product_id in product_ids])
+    
+    def rollup_price_history(self, limit: int = PRICE_ROLLUP_BATCH) -> int:
+        """Fold newly seen price history into the hourly and daily rollups
+        
+        A history row covers the time its price was seen (checked_at to
+        last_seen_at). The part after rolled_until is added to every bucket
+        it overlaps, weighted by seconds, and the row is marked rolled up, so
+        each run only touches rows seen since the last one. Processes up to
+        limit rows in one transaction; returns how many.
+        """
+        with self._writer() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            
+            rows = conn.execute('''
+                SELECT id, product_id, price, checked_at, last_seen_at, rolled_until
+                FROM price_history
+                WHERE rolled_until IS NULL OR last_seen_at > rolled_until
+                LIMIT ?
+            ''', (limit,)).fetchall()
+            
+            # (table, product_id, bucket) -> [min, max, price_seconds, seconds, samples]
+            buckets: Dict[Tuple[str, int, float], list] = {}
+            for _, product_id, price, checked_at, last_seen_at, rolled_until in rows:
+                if price is None:
+                    continue
+                start = _parse_utc_timestamp(rolled_until or checked_at).timestamp()
+                end = _parse_utc_timestamp(last_seen_at or checked_at).timestamp()
+                for table, size in PRICE_ROLLUPS:
+                    for bucket, seconds in _split_into_buckets(start, end, size):
+                        stats = buckets.get((table, product_id, bucket))
+                        if stats is None:
+                            buckets[(table, product_id, bucket)] = [price, price, price * seconds, seconds, 1]
+                        else:
+                            stats[0] = min(stats[0], price)
+                            stats[1] = max(stats[1], price)
+                            stats[2] += price * seconds
+                            stats[3] += seconds
+                            stats[4] += 1
+            
+            for table, _ in PRICE_ROLLUPS:
+                conn.executemany(f'''
+                    INSERT INTO {table}
+                    (product_id, bucket_start, min_price, max_price, avg_price, price_seconds, seconds, samples)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (product_id, bucket_start) DO UPDATE SET
+                        min_price = MIN(min_price, excluded.min_price),
+                        max_price = MAX(max_price, excluded.max_price),
+                        avg_price = (price_seconds + excluded.price_seconds) / (seconds + excluded.seconds),
+                        price_seconds = price_seconds + excluded.price_seconds,
+                        seconds = seconds + excluded.seconds,
+                        samples = samples + excluded.samples
+                ''', [
+                    (product_id, _utc_timestamp(datetime.fromtimestamp(bucket, timezone.utc)),
+                     low, high, price_seconds / seconds, price_seconds, seconds, samples)
+                    for (name, product_id, bucket), (low, high, price_seconds, seconds, samples) in buckets.items()
+                    if name == table
+                ])
+            
+            conn.executemany(
+                'UPDATE price_history SET rolled_until = COALESCE(last_seen_at, checked_at) WHERE id = ?',
+                [(row[0],) for row in rows]
+            )
+            return len(rows)
+    
+    def apply_price_history_retention(self) -> Dict[str, int]:
+        """Delete history past its retention period; returns rows deleted per table
+        
+        Raw rows go once they are rolled up and were last seen before the
+        cutoff, so a product's current price row is kept while it is checked.
+        """
+        now = datetime.now()
+        deleted = {}
+        with self._writer() as conn:
+            for table, column, days in (
+                ('price_history', 'last_seen_at', PRICE_HISTORY_RETENTION_DAYS),
+                ('price_history_hourly', 'bucket_start', PRICE_HOURLY_RETENTION_DAYS),
+                ('price_history_daily', 'bucket_start', PRICE_DAILY_RETENTION_DAYS),
+            ):
+                if days <= 0:
+                    continue
+                rolled = ' AND last_seen_at <= rolled_until' if table == 'price_history' else ''
+                cursor = conn.execute(
+                    f'DELETE FROM {table} WHERE {column} < ?{rolled}',
+                    (_utc_timestamp(now - timedelta(days=days)),)
+                )
+                deleted[table] = cursor.rowcount
+        return deleted
+    
+
+    def get_products_for_url(self, canonical_url: str) -> List[Dict]:
+        """Every active product row for a canonical URL, oldest first, with its owner's tier"""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.id, p.telegram_id, p.url, p.product_name, p.current_price, p.alert_price,
+                       p.check_interval, COALESCE(u.tier, 'free'), p.check_failures
+                FROM tracked_products p
+                LEFT JOIN users u ON u.telegram_id = p.telegram_id
+                WHERE p.canonical_url = ? AND p.active = 1
+                ORDER BY p.id
+            ''', (canonical_url,))
+            
+            products = []
+            for row in cursor.fetchall():
+                products.append({
+                    'id': row[0],
+                    'telegram_id': row[1],
+                    'url': row[2],
+                    'product_name': row[3],
+                    'current_price': row[4],
+                    'alert_price': row[5],
+                    'check_interval': row[6],
+                    'tier': row[7],
+                    'check_failures': row[8]
+                })
+            return products
+    
+    def get_price_volatility(self, product_id: int, days: float) -> Tuple[int, float]:
+        """Price changes recorded for a product in the last days
+        
+        Returns (changes, observed_days), where observed_days is how much of
+        the window the product's history covers. Changes are counted against
+        the previous row even if it is older than the window, which
+        change-only history needs.
+        """
+        since = datetime.now() - timedelta(days=days)
+        with self._reader() as conn:
+            row = conn.execute('''
+                SELECT MIN(checked_at), COALESCE(SUM(changed AND checked_at >= ?), 0) FROM (
+                    SELECT checked_at,
+                           ABS(price - LAG(price) OVER (ORDER BY checked_at)) > 0.01 AS changed
+                    FROM price_history
+                    WHERE product_id = ?
+                )
+            ''', (_utc_timestamp(since), product_id)).fetchone()
+        
+        if row[0] is None:
+            return 0, 0.0
+        first_seen = max(_parse_utc_timestamp(row[0]), since.astimezone(timezone.utc))
+        return row[1], (datetime.now(timezone.utc) - first_seen).total_seconds() / 86400
+    
+    def get_price_history_versions(self, product_ids: List[int]) -> Dict[int, Tuple[int, str]]:
+        """Latest price_history (id, last_seen_at) per product; every price write changes it"""
+        versions = {}
+        with self._reader() as conn:
+            for product_id in product_ids:
+                row = conn.execute('''
+                    SELECT id, COALESCE(last_seen_at, checked_at) FROM price_history
+                    WHERE product_id = ?
+                    ORDER BY checked_at DESC
+                    LIMIT 1
+                ''', (product_id,)).fetchone()
+                if row:
+                    versions[product_id] = (row[0], row[1])
+        return versions
+    
+    def get_price_history(self, product_id: int, days: float) -> Tuple[List[Tuple[str, str, float]], Optional[float]]:
+        """A product's (checked_at, last_seen_at, price) rows for the last days, and its all-time high
+        
+        Rows are in time order and start with the row whose price was in
+        effect when the window opened. The all-time high also covers
+        history already aged out into the daily rollup.
+        """
+        since = _utc_timestamp(datetime.now() - timedelta(days=days))
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT checked_at, COALESCE(last_seen_at, checked_at), price FROM price_history
+                WHERE product_id = ? AND checked_at >= COALESCE((
+                    SELECT MAX(checked_at) FROM price_history WHERE product_id = ? AND checked_at <= ?
+                ), ?)
+                ORDER BY checked_at
+            ''', (product_id, product_id, since, since)).fetchall()
+            
+            all_time_high = conn.execute('''
+                SELECT MAX(price) FROM (
+                    SELECT MAX(price) AS price FROM price_history WHERE product_id = ?
+                    UNION ALL
+                    SELECT MAX(max_price) FROM price_history_daily WHERE product_id = ?
+                )
+            ''', (product_id, product_id)).fetchone()[0]
+        return rows, all_time_high
+    
+    def reschedule_products(self, product_ids: List[int], next_check_at: datetime, interval: float):
+        """Set the next check time and current interval (seconds) for products, releasing their lease"""
+        with self._writer() as conn:
+            conn.executemany('''
+                UPDATE tracked_products
+                SET next_check_at = ?, check_interval = ?, check_failures = 0,
+                    lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ? AND active = 1
+            ''', [(_utc_timestamp(next_check_at), int(interval), product_id) for product_id in product_ids])
+    
+    def retry_products(self, product_ids: List[int], next_check_at: datetime, failed: bool = True):
+        """Schedule a retry for products whose check did not succeed, releasing their lease
+        
+        failed counts another consecutive failure; products skipped without
+        being checked keep their count. Their check interval is kept for
+        when checks succeed again.
+        """
+        with self._writer() as conn:
+            conn.executemany('''
+                UPDATE tracked_products
+                SET next_check_at = ?, check_failures = check_failures + ?,
+                    lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ? AND active = 1
+            ''', [(_utc_timestamp(next_check_at), int(failed), product_id) for product_id in product_ids])
+    
+    def claim_due_urls(self, owner: str, until: datetime, limit: int,
+                       lease_until: datetime) -> List[Tuple[str, str]]:
+        """Lease canonical URLs that are due by until to owner
+        
+        Claims every active row of up to limit due URLs that no other
+        checker holds an unexpired lease on, in one UPDATE, so concurrent
+        checkers never claim the same URL. Leases left behind by a crashed
+        checker expire and become claimable again. Returns the claimed
+        (canonical_url, next_check_at) rows.
+        """
+        with self._writer() as conn:
+            return conn.execute('''
+                UPDATE tracked_products
+                SET lease_owner = ?, lease_expires_at = ?
+                WHERE active = 1 AND canonical_url IN (
+                    SELECT due.canonical_url FROM tracked_products AS due
+                    WHERE due.next_check_at <= ?
+                      AND NOT EXISTS (
+                          SELECT 1 FROM tracked_products AS leased
+                          WHERE leased.canonical_url = due.canonical_url
+                            AND leased.active = 1
+                            AND leased.lease_expires_at > ?
+                      )
+                    ORDER BY due.next_check_at
+                    LIMIT ?
+                )
+                RETURNING canonical_url, next_check_at
+            ''', (owner, _utc_timestamp(lease_until), _utc_timestamp(until),
+                  _utc_timestamp(datetime.now()), limit)).fetchall()
+    
+    def claim_url_lease(self, owner: str, canonical_url: str, lease_until: datetime) -> bool:
+        """Lease one canonical URL to owner unless another checker holds an unexpired lease on it"""
+        with self._writer() as conn:
+            return conn.execute('''
+                UPDATE tracked_products
+                SET lease_owner = ?, lease_expires_at = ?
+                WHERE canonical_url = ? AND active = 1 AND NOT EXISTS (
+                    SELECT 1 FROM tracked_products AS leased
+                    WHERE leased.canonical_url = ? AND leased.active = 1 AND leased.lease_expires_at > ?
+                )
+            ''', (owner, _utc_timestamp(lease_until), canonical_url, canonical_url,
+                  _utc_timestamp(datetime.now()))).rowcount > 0
+    
+    def renew_leases(self, owner: str, lease_until: datetime):
+        """Heartbeat: extend every lease held by owner"""
+        with self._writer() as conn:
+            conn.execute(
+                'UPDATE tracked_products SET lease_expires_at = ? WHERE lease_owner = ?',
+                (_utc_timestamp(lease_until), owner)
+            )
+    
+    def release_leases(self, owner: str, canonical_urls: Optional[List[str]] = None):
+        """Give up every lease held by owner, or only those on canonical_urls"""
+        with self._writer() as conn:
+            if canonical_urls is None:
+                conn.execute(
+                    'UPDATE tracked_products SET lease_owner = NULL, lease_expires_at = NULL WHERE lease_owner = ?',
+                    (owner,)
+                )
+                return
+            conn.executemany('''
+                UPDATE tracked_products SET lease_owner = NULL, lease_expires_at = NULL
+                WHERE canonical_url = ? AND lease_owner = ?
+            ''', [(canonical_url, owner) for canonical_url in canonical_urls])
+    
+    def add_price_alerts(self, alerts: List[Tuple[int, int, str, str, float, float]]):
+        """Queue (product_id, telegram_id, product_name, url, old_price, new_price) alerts
+        
+        A product with an alert still pending keeps that one alert: its
+        new_price is updated, so the user sees the whole move once.
+        """
+        with self._writer() as conn:
+            conn.executemany('''
+                INSERT INTO price_alerts (product_id, telegram_id, product_name, url, old_price, new_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (product_id) WHERE sent_at IS NULL DO UPDATE SET
+                    product_name = excluded.product_name,
+                    new_price = excluded.new_price
+            ''', alerts)
+    
+    def claim_pending_alerts(self, limit: int, ready_before: datetime,
+                             per_chat: int = ALERT_DIGEST_MAX,
+                             claim_seconds: float = ALERT_CLAIM_SECONDS,
+                             max_attempts: int = ALERT_MAX_ATTEMPTS) -> List[Dict]:
+        """Claim the oldest unsent alerts that are due and have not used up their attempts
+        
+        Only users with a pending alert queued before ready_before are
+        included, so alerts that arrive in the meantime join their digest,
+        and at most per_chat alerts (one digest) are claimed per user; the
+        rest stay due for the next poll.
+        Claimed alerts are not due again for claim_seconds, so bot replicas
+        polling the same outbox never send an alert twice; the sender marks
+        them sent or failed, and an alert whose sender died is retried.
+        """
+        now = datetime.now()
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE price_alerts SET next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY telegram_id ORDER BY id) AS position
+                        FROM price_alerts
+                        WHERE sent_at IS NULL AND attempts < ?
+                          AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+                          AND telegram_id IN (
+                              SELECT telegram_id FROM price_alerts WHERE sent_at IS NULL AND created_at <= ?
+                          )
+                    )
+                    WHERE position <= ?
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id, product_id, telegram_id, product_name, url, old_price, new_price
+            ''', (_utc_timestamp(now + timedelta(seconds=claim_seconds)), max_attempts,
+                  _utc_timestamp(now), _utc_timestamp(ready_before), max(1, per_chat), limit))
+            
+            alerts = []
+            for row in sorted(cursor.fetchall()):
+                alerts.append({
+                    'id': row[0],
+                    'product_id': row[1],
+                    'telegram_id': row[2],
+                    'product_name': row[3],
+                    'url': row[4],
+                    'old_price': row[5],
+                    'new_price': row[6]
+                })
+            return alerts
+    
+    def mark_alerts_sent(self, alert_ids: List[int]):
+        """Record delivered alerts"""
+        with self._writer() as conn:
+            conn.executemany(
+                'UPDATE price_alerts SET sent_at = CURRENT_TIMESTAMP WHERE id = ?',
+                [(alert_id,) for alert_id in alert_ids]
+            )
+    
+    def record_alert_failures(self, alert_ids: List[int], retry_delay: float = ALERT_RETRY_DELAY):
+        """Count a failed delivery attempt for alerts and back off their retry"""
+        with self._writer() as conn:
+            conn.executemany('''
+                UPDATE price_alerts
+                SET next_attempt_at = datetime('now', printf('+%d seconds', ? * (1 << attempts))),
+                    attempts = attempts + 1
+                WHERE id = ?
+            ''', [(retry_delay, alert_id) for alert_id in alert_ids])
+    
+    def defer_alerts(self, deferrals: List[Tuple[int, float]]):
+        """Release claimed (alert_id, seconds) alerts to be sent again after seconds, without using an attempt"""
+        now = datetime.now()
+        with self._writer() as conn:
+            conn.executemany(
+                'UPDATE price_alerts SET next_attempt_at = ? WHERE id = ?',
+                [(_utc_timestamp(now + timedelta(seconds=seconds)), alert_id) for alert_id, seconds in deferrals]
+            )
+    
+    def give_up_alerts(self, alert_ids: List[int], max_attempts: int = ALERT_MAX_ATTEMPTS):
+        """Stop retrying alerts that can never be delivered (e.g. the user blocked the bot)"""
+        with self._writer() as conn:
+            conn.executemany(
+                'UPDATE price_alerts SET attempts = MAX(attempts, ?) WHERE id = ?',
+                [(max_attempts, alert_id) for alert_id in alert_ids]
+            )
+    
+    def save_feedback_draft(self, telegram_id: int, category: str, platform: Optional[str] = None):
+        """Remember the feedback category (and platform) a user is about to describe"""
+        with self._writer() as conn:
+            conn.execute('''
+                INSERT INTO feedback_drafts (telegram_id, category, platform, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    category = excluded.category,
+                    platform = excluded.platform,
+                    updated_at = excluded.updated_at
+            ''', (telegram_id, category, platform))
+    
+    def get_feedback_draft(self, telegram_id: int) -> Optional[Dict]:
+        """The user's unfinished feedback as {'category', 'platform'}, or None"""
+        with self._reader() as conn:
+            row = conn.execute(
+                'SELECT category, platform FROM feedback_drafts WHERE telegram_id = ?',
+                (telegram_id,)
+            ).fetchone()
+            return {'category': row[0], 'platform': row[1]} if row else None
+    
+    def delete_feedback_draft(self, telegram_id: int):
+        """Forget the user's unfinished feedback once it is saved"""
+        with self._writer() as conn:
+            conn.execute('DELETE FROM feedback_drafts WHERE telegram_id = ?', (telegram_id,))
+    
+    def get_http_validators(self, canonical_url: str
+                            ) -> Optional[Tuple[Optional[str], Optional[str], Optional[str]]]:
+        """Get cached (etag, last_modified, fingerprint) for a URL, or None if never fetched"""
+        with self._reader() as conn:
+            row = conn.execute(
+                'SELECT etag, last_modified, fingerprint FROM http_validators WHERE canonical_url = ?',
+                (canonical_url,)
+            ).fetchone()
+            return (row[0], row[1], row[2]) if row else None
+    
+    def _store_http_validators(self, cursor: sqlite3.Cursor,
+                               validators: List[Tuple[str, Optional[str], Optional[str], Optional[str]]]):
+        cursor.executemany('''
+            INSERT INTO http_validators (canonical_url, etag, last_modified, fingerprint, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (canonical_url) DO UPDATE SET
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                fingerprint = excluded.fingerprint,
+                updated_at = excluded.updated_at
+        ''', validators)
+    
+    def get_extraction_recipe(self, domain: str, template: str) -> Optional[Dict]:
+        """Get the learned extraction recipe for a page template, if any"""
+        with self._reader() as conn:
+            row = conn.execute(
+                'SELECT recipe FROM extraction_recipes WHERE domain = ? AND template = ?',
+                (domain, template)
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+    
+    def save_extraction_recipe(self, domain: str, template: str, recipe: Dict,
+                               max_recipes: int = RECIPE_CACHE_SIZE):
+        """Store (or replace) a recipe and evict the least recently used beyond max_recipes"""
+        with self._writer() as conn:
+            conn.execute('''
+                INSERT INTO extraction_recipes (domain, template, recipe)
+                VALUES (?, ?, ?)
+                ON CONFLICT (domain, template) DO UPDATE SET
+                    recipe = excluded.recipe,
+                    last_used_at = CURRENT_TIMESTAMP
+            ''', (domain, template, json.dumps(recipe)))
+            
+            conn.execute('''
+                DELETE FROM extraction_recipes
+                WHERE (domain, template) IN (
+                    SELECT domain, template FROM extraction_recipes
+                    ORDER BY last_used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (max_recipes,))
+    
+    def record_recipe_result(self, domain: str, template: str, hit: bool):
+        """Count a recipe hit (validated) or miss (fell back to full discovery)"""
+        with self._writer() as conn:
+            conn.execute(f'''
+                UPDATE extraction_recipes
+                SET {'hits = hits + 1' if hit else 'misses = misses + 1'},
+                    last_used_at = CURRENT_TIMESTAMP
+                WHERE domain = ? AND template = ?
+            ''', (domain, template))
+    
+    def get_recipe_stats(self) -> Dict:
+        """Totals across the recipe cache"""
+        with self._reader() as conn:
+            row = conn.execute('''
+                SELECT COUNT(*), COUNT(DISTINCT domain), COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0)
+                FROM extraction_recipes
+            ''').fetchone()
+            lookups = row[2] + row[3]
+            return {
+                'recipes': row[0],
+                'domains': row[1],
+                'hits': row[2],
+                'misses': row[3],
+                'hit_rate': row[2] / lookups if lookups else 0.0
+            }
+    
+    def delete_tracked_product(self, product_id: int, telegram_id: int):
+        """Delete tracked product"""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE tracked_products SET active = 0, next_check_at = NULL
+                WHERE id = ? AND telegram_id = ?
+            ''', (product_id, telegram_id))
+            
+            cursor.execute('''
+                UPDATE users SET tracked_count = tracked_count - 1
+                WHERE telegram_id = ?
+            ''', (telegram_id,))
+            self._invalidate_user(telegram_id)
+    
+    def add_feature_request(self, telegram_id: int, category: str, description: str,
+                           region: str = 'unknown', platform: str = None):
+        """Add feature request with region and platform tracking"""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO feature_requests (telegram_id, region, category, platform, description)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (telegram_id, region, category, platform, description))
+    
+    def get_market_stats(self, region: str = None) -> Dict:
+        """Get statistics by market/region"""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            
+            if region:
+                cursor.execute('''
+                    SELECT COUNT(*) as users, SUM(tracked_count) as products
+                    FROM users WHERE region = ?
+                ''', (region,))
+            else:
+                cursor.execute('''
+                    SELECT region, COUNT(*) as users, SUM(tracked_count) as products
+                    FROM users GROUP BY region
+                ''')
+            
+            if region:
+                row = cursor.fetchone()
+                return {'users': row[0], 'products': row[1]} if row else {'users': 0, 'products': 0}
+            else:
+                stats = {}
+                for row in cursor.fetchall():
+                    stats[row[0]] = {'users': row[1], 'products': row[2]}
+                return stats
+    
+    def iter_products(self, telegram_id: Optional[int] = None,
+                      page_size: int = EXPORT_PAGE_SIZE) -> Iterator[tuple]:
+        """Stream tracked_products rows (EXPORT_COLUMNS['products']) in id order
+        
+        Rows are read in keyset pages (id > last id seen), each on a reader
+        connection borrowed for that one query, so memory stays flat and no
+        connection is held while the caller consumes rows. Pages are not one
+        snapshot: rows written meanwhile may or may not be included.
+        """
+        columns = ', '.join(EXPORT_COLUMNS['products'])
+        where, params = ('AND telegram_id = ?', (telegram_id,)) if telegram_id is not None else ('', ())
+        last_id = 0
+        while True:
+            with self._reader() as conn:
+                rows = conn.execute(f'''
+                    SELECT {columns} FROM tracked_products
+                    WHERE id > ? {where}
+                    ORDER BY id
+                    LIMIT ?
+                ''', (last_id, *params, page_size)).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+    
+    def iter_price_history(self, telegram_id: Optional[int] = None,
+                           page_size: int = EXPORT_PAGE_SIZE) -> Iterator[tuple]:
+        """Stream price_history rows (EXPORT_COLUMNS['history']), like iter_products
+        
+        Everyone's history is paged in id order. A user's is paged product by
+        product along idx_price_history_product, (checked_at, price, id)
+        being that index's order, so no page needs a sort.
+        """
+        columns = ', '.join(EXPORT_COLUMNS['history'])
+        if telegram_id is None:
+            last_id = 0
+            while True:
+                with self._reader() as conn:
+                    rows = conn.execute(f'''
+                        SELECT {columns} FROM price_history
+                        WHERE id > ?
+                        ORDER BY id
+                        LIMIT ?
+                    ''', (last_id, page_size)).fetchall()
+                yield from rows
+                if len(rows) < page_size:
+                    return
+                last_id = rows[-1][0]
+        
+        for product in self.iter_products(telegram_id, page_size):
+            last_key = ('', 0.0, 0)
+            while True:
+                with self._reader() as conn:
+                    rows = conn.execute(f'''
+                        SELECT {columns} FROM price_history
+                        WHERE product_id = ? AND (checked_at, price, id) > (?, ?, ?)
+                        ORDER BY checked_at, price, id
+                        LIMIT ?
+                    ''', (product[0], *last_key, page_size)).fetchall()
+                yield from rows
+                if len(rows) < page_size:
+                    break
+                last_key = (rows[-1][3], rows[-1][2], rows[-1][0])
+    
+    def count_active_products(self) -> int:
+        """Number of active tracked products"""
+        with self._reader() as conn:
+            return conn.execute('SELECT COUNT(*) FROM tracked_products WHERE active = 1').fetchone()[0]
+    
+    def get_active_products_page(self, after_id: int = 0, limit: int = CHECK_STREAM_PAGE,
+                                 first_per_url: bool = False,
+                                 unchecked_in_cycle: Optional[int] = None) -> List[ActiveProduct]:
+        """One keyset page: up to limit active products with id > after_id, in id order
+        
+        first_per_url keeps only the lowest-id active row of each canonical
+        URL, which stands for all of the URL's subscribers.
+        unchecked_in_cycle skips products already checked in that cycle.
+        """
+        first = '''
+            AND NOT EXISTS (
+                SELECT 1 FROM tracked_products AS earlier
+                WHERE earlier.canonical_url = p.canonical_url AND earlier.active = 1 AND earlier.id < p.id
+            )
+        ''' if first_per_url else ''
+        unchecked = 'AND p.checked_cycle_id IS NOT ?' if unchecked_in_cycle is not None else ''
+        params = (after_id, unchecked_in_cycle, limit) if unchecked else (after_id, limit)
+        with self._reader() as conn:
+            rows = conn.execute(f'''
+                SELECT p.id, p.telegram_id, p.url, p.product_name, p.current_price, p.alert_price, p.canonical_url
+                FROM tracked_products AS p
+                WHERE p.active = 1 AND p.id > ? {unchecked} {first}
+                ORDER BY p.id
+                LIMIT ?
+            ''', params).fetchall()
+        return [ActiveProduct(*row) for row in rows]
+    
+    def iter_active_products(self, after_id: int = 0, page_size: int = CHECK_STREAM_PAGE,
+                             first_per_url: bool = False,
+                             unchecked_in_cycle: Optional[int] = None) -> Iterator[ActiveProduct]:
+        """Stream active products in id order, one keyset page at a time
+        
+        Memory stays at one page however many products there are, and each
+        page sees products added or removed since the previous one. Resume
+        an interrupted walk by passing the last id processed as after_id.
+        """
+        while True:
+            page = self.get_active_products_page(after_id, page_size, first_per_url, unchecked_in_cycle)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_id = page[-1].id
+    
+    def start_check_cycle(self) -> Optional[int]:
+        """Record a new full check cycle; None if one is already unfinished"""
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO check_cycles (total)
+                SELECT (SELECT COUNT(*) FROM tracked_products WHERE active = 1)
+                WHERE NOT EXISTS (SELECT 1 FROM check_cycles WHERE finished_at IS NULL)
+                RETURNING id
+            ''')
+            row = cursor.fetchone()
+            return row[0] if row else None
+    
+    def claim_check_cycle(self, owner: str, stale_before: datetime) -> Optional[Dict]:
+        """Take over the unfinished cycle if nobody owns it or its owner stopped checkpointing
+        
+        Returns the cycle record, whose cursor and counts the new owner
+        resumes from, or None if there is no cycle to run.
+        """
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE check_cycles
+                SET owner = ?, updated_at = CURRENT_TIMESTAMP,
+                    restarts = restarts + (cursor > 0 OR scraped > 0)
+                WHERE id = (SELECT id FROM check_cycles WHERE finished_at IS NULL ORDER BY id LIMIT 1)
+                  AND (owner IS NULL OR updated_at < ?)
+                RETURNING id, cursor, total, scraped, checked, changed, alerts, errors, restarts
+            ''', (owner, _utc_timestamp(stale_before)))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'cursor', *CYCLE_COUNTERS, 'restarts'), row))
+    
+    def checkpoint_check_cycle(self, cycle_id: int, owner: str, cursor: int, counts: Dict[str, int],
+                               finished: bool = False, release: bool = False) -> bool:
+        """Save a cycle's cursor and counts (see CYCLE_COUNTERS); False if owner no longer holds it
+        
+        finished closes the cycle; release gives it up for another checker
+        (or this one, later) to resume.
+        """
+        with self._writer() as conn:
+            updated = conn.execute('''
+                UPDATE check_cycles
+                SET cursor = :cursor, total = :total, scraped = :scraped, checked = :checked,
+                    changed = :changed, alerts = :alerts, errors = :errors,
+                    updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CASE WHEN :finished THEN CURRENT_TIMESTAMP END,
+                    owner = CASE WHEN :release THEN NULL ELSE owner END
+                WHERE id = :id AND owner = :owner
+            ''', {**counts, 'cursor': cursor, 'finished': finished, 'release': release,
+                  'id': cycle_id, 'owner': owner}).rowcount
+        return updated > 0
+    
+    def mark_checked_in_cycle(self, product_ids: List[int], cycle_id: int):
+        """Mark products as checked in a cycle so a resumed cycle skips them"""
+        with self._writer() as conn:
+            conn.executemany(
+                'UPDATE tracked_products SET checked_cycle_id = ? WHERE id = ?',
+                [(cycle_id, product_id) for product_id in product_ids]
+            )
+    
+    def get_check_cycle(self) -> Optional[Dict]:
+        """The latest full check cycle, or None if none was ever started"""
+        with self._reader() as conn:
+            row = conn.execute('''
+                SELECT id, started_at, updated_at, finished_at, owner, cursor,
+                       total, scraped, checked, changed, alerts, errors, restarts
+                FROM check_cycles ORDER BY id DESC LIMIT 1
+            ''').fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'started_at', 'updated_at', 'finished_at', 'owner', 'cursor',
+                         *CYCLE_COUNTERS, 'restarts'), row))
+
+
+class AsyncPriceTrackerDB:
+    """Asyncio facade over PriceTrackerDB so handlers never block on SQLite
+    
+    Reads run on a thread pool sized to the reader connection pool. Writes
+    are queued to one dedicated writer thread, which drains whatever has
+    queued up (up to max_batch) and applies it in a single transaction, so a
+    burst of writes costs one commit. Writes with a coalesce key replace a
+    queued, not yet started write with the same key (last write wins).
+    The wrapped synchronous database is available as .sync.
+    """
+    
+    def __init__(self, db: Optional[PriceTrackerDB] = None, max_batch: int = DB_WRITE_BATCH):
+        self.sync = db if db is not None else PriceTrackerDB()
+        self.max_batch = max(1, max_batch)
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=self.sync.reader_count, thread_name_prefix='db-read'
+        )
+        
+        # key -> [fn, args, futures]; unkeyed writes get a unique key
+        self._pending: 'OrderedDict[object, list]' = OrderedDict()
+        self._pending_changed = threading.Condition()
+        self._closing = False
+        self._writer_thread = threading.Thread(target=self._write_loop, name='db-writer', daemon=True)
+        self._writer_thread.start()
+        
+        METRICS.gauge_function('fetcha_db_pending_writes', self.pending_writes)
+        METRICS.gauge_function('fetcha_user_cache_hits', lambda: self.sync.user_cache.hits)
+        METRICS.gauge_function('fetcha_user_cache_misses', lambda: self.sync.user_cache.misses)
+    
+    async def _read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._timed_read, fn, *args)
+    
+    @staticmethod
+    def _timed_read(fn, *args):
+        with METRICS.timer('fetcha_db_seconds', {'method': fn.__name__}):
+            return fn(*args)
+    
+    async def _write(self, fn, *args, coalesce_key=None):
+        future: Future = Future()
+        with self._pending_changed:
+            if self._closing:
+                raise RuntimeError("Database is closed")
+            
+            key = coalesce_key if coalesce_key is not None else object()
+            queued = self._pending.pop(key, None)
+            futures = queued[2] if queued else []
+            futures.append(future)
+            self._pending[key] = [fn, args, futures]
+            self._pending_changed.notify()
+        return await asyncio.wrap_future(future)
+    
+    def _write_loop(self):
+        """Writer thread: apply queued writes in coalesced transactions
+        
+        Nothing may end this thread while the database is open: every later
+        write would wait forever.
+        """
+        while True:
+            with self._pending_changed:
+                while not self._pending and not self._closing:
+                    self._pending_changed.wait()
+                if not self._pending:
+                    return
+                
+                batch = []
+                while self._pending and len(batch) < self.max_batch:
+                    batch.append(self._pending.popitem(last=False)[1])
+            
+            try:
+                self._apply(batch)
+            except Exception as e:
+                logger.error(f"Database writer error on a batch of {len(batch)}: {e}")
+    
+    def _apply(self, batch: List[list]):
+        outcomes = []
+        try:
+            with METRICS.timer('fetcha_db_batch_seconds'), self.sync.write_batch():
+                for fn, args, futures in batch:
+                    try:
+                        with METRICS.timer('fetcha_db_seconds', {'method': fn.__name__}):
+                            outcomes.append((futures, fn(*args), None))
+                    except Exception as e:
+                        outcomes.append((futures, None, e))
+        except Exception as e:
+            # The commit itself failed: every write in the batch is lost
+            logger.error(f"Database write batch of {len(batch)} failed: {e}")
+            outcomes = [(futures, None, e) for _, _, futures in batch]
+        
+        # Only resolve callers once their writes are committed. A caller can
+        # be cancelled at any moment, cancelling its future too (the write
+        # itself was still applied), so a future that is already done is
+        # skipped rather than checked first, which would race the cancel.
+        for futures, result, error in outcomes:
+            for future in futures:
+                try:
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+                except InvalidStateError:
+                    continue
+    
+    def pending_writes(self) -> int:
+        """Number of queued writes not yet picked up by the writer thread"""
+        with self._pending_changed:
+            return len(self._pending)
+    
+    async def close(self):
+        """Finish queued writes, then close every connection"""
+        with self._pending_changed:
+            self._closing = True
+            self._pending_changed.notify()
+        await asyncio.to_thread(self._writer_thread.join)
+        self._read_executor.shutdown(wait=True)
+        self.sync.close()
+    
+    # Reads
+    
+    async def get_user(self, telegram_id: int) -> Optional[Dict]:
+        # Cache hits are answered without a trip through the read executor
+        found, user = self.sync.user_cache.get(telegram_id)
+        if found:
+            return user
+        return await self._read(self.sync.load_user, telegram_id)
+    
+    async def get_tracked_products(self, telegram_id: int) -> List[Dict]:
+        return await self._read(self.sync.get_tracked_products, telegram_id)
+    
+    async def get_market_stats(self, region: str = None) -> Dict:
+        return await self._read(self.sync.get_market_stats, region)
+    
+    async def count_active_products(self) -> int:
+        return await self._read(self.sync.count_active_products)
+    
+    async def iter_active_products(self, after_id: int = 0, page_size: int = CHECK_STREAM_PAGE,
+                                   first_per_url: bool = False,
+                                   unchecked_in_cycle: Optional[int] = None) -> AsyncIterator[ActiveProduct]:
+        """Async PriceTrackerDB.iter_active_products; each page is read off the event loop"""
+        while True:
+            page = await self._read(self.sync.get_active_products_page, after_id, page_size, first_per_url,
+                                    unchecked_in_cycle)
+            for product in page:
+                yield product
+            if len(page) < page_size:
+                return
+            after_id = page[-1].id
+    
+    async def get_http_validators(self, canonical_url: str
+                                  ) -> Optional[Tuple[Optional[str], Optional[str], Optional[str]]]:
+        return await self._read(self.sync.get_http_validators, canonical_url)
+    
+
+    async def get_products_for_url(self, canonical_url: str) -> List[Dict]:
+        return await self._read(self.sync.get_products_for_url, canonical_url)
+    
+    async def get_price_volatility(self, product_id: int, days: float) -> Tuple[int, float]:
+        return await self._read(self.sync.get_price_volatility, product_id, days)
+    
+    async def get_price_history_versions(self, product_ids: List[int]) -> Dict[int, Tuple[int, str]]:
+        return await self._read(self.sync.get_price_history_versions, product_ids)
+    
+    async def get_price_history(self, product_id: int, days: float
+                                ) -> Tuple[List[Tuple[str, str, float]], Optional[float]]:
+        return await self._read(self.sync.get_price_history, product_id, days)
+    
+    async def get_feedback_draft(self, telegram_id: int) -> Optional[Dict]:
+        return await self._read(self.sync.get_feedback_draft, telegram_id)
+    
+    # Writes
+    
+    async def add_user(self, telegram_id: int, username: str, first_name: str,
+                       region: str = 'unknown', language_code: str = 'en'):
+        return await self._write(self.sync.add_user, telegram_id, username, first_name,
+                                 region, language_code)
+    
+    async def update_user_region(self, telegram_id: int, region: str):
+        return await self._write(self.sync.update_user_region, telegram_id, region,
+                                 coalesce_key=('user_region', telegram_id))
+    
+    async def add_tracked_product(self, telegram_id: int, url: str, product_name: str,
+                                  current_price: float, alert_price: Optional[float] = None) -> int:
+        return await self._write(self.sync.add_tracked_product, telegram_id, url, product_name,
+                                 current_price, alert_price)
+    
+    async def update_product_price(self, product_id: int, new_price: float) -> Tuple[bool, float]:
+        return await self._write(self.sync.update_product_price, product_id, new_price)
+    
+    async def update_product_prices(self, results: List[Tuple[int, float, datetime]],
+                                    validators: Optional[List[Tuple[str, Optional[str], Optional[str],
+                                                                    Optional[str]]]] = None
+                                    ) -> Dict[int, Tuple[bool, float]]:
+        return await self._write(self.sync.update_product_prices, results, validators)
+    
+    async def touch_last_check(self, product_ids: List[int], checked_at: datetime):
+        return await self._write(self.sync.touch_last_check, product_ids, checked_at)
+    
+    async def rollup_price_history(self) -> int:
+        return await self._write(self.sync.rollup_price_history)
+    
+    async def apply_price_history_retention(self) -> Dict[str, int]:
+        return await self._write(self.sync.apply_price_history_retention)
+    
+    async def reschedule_products(self, product_ids: List[int], next_check_at: datetime, interval: float):
+        return await self._write(self.sync.reschedule_products, product_ids, next_check_at, interval)
+    
+    async def retry_products(self, product_ids: List[int], next_check_at: datetime, failed: bool = True):
+        return await self._write(self.sync.retry_products, product_ids, next_check_at, failed)
+    
+    async def claim_due_urls(self, owner: str, until: datetime, limit: int,
+                             lease_until: datetime) -> List[Tuple[str, str]]:
+        return await self._write(self.sync.claim_due_urls, owner, until, limit, lease_until)
+    
+    async def claim_url_lease(self, owner: str, canonical_url: str, lease_until: datetime) -> bool:
+        return await self._write(self.sync.claim_url_lease, owner, canonical_url, lease_until)
+    
+    async def renew_leases(self, owner: str, lease_until: datetime):
+        return await self._write(self.sync.renew_leases, owner, lease_until,
+                                 coalesce_key=('renew_leases', owner))
+    
+    async def release_leases(self, owner: str, canonical_urls: Optional[List[str]] = None):
+        return await self._write(self.sync.release_leases, owner, canonical_urls)
+    
+    async def add_price_alerts(self, alerts: List[Tuple[int, int, str, str, float, float]]):
+        return await self._write(self.sync.add_price_alerts, alerts)
+    
+    async def claim_pending_alerts(self, limit: int, ready_before: datetime) -> List[Dict]:
+        return await self._write(self.sync.claim_pending_alerts, limit, ready_before)
+    
+    async def start_check_cycle(self) -> Optional[int]:
+        return await self._write(self.sync.start_check_cycle)
+    
+    async def claim_check_cycle(self, owner: str, stale_before: datetime) -> Optional[Dict]:
+        return await self._write(self.sync.claim_check_cycle, owner, stale_before)
+    
+    async def checkpoint_check_cycle(self, cycle_id: int, owner: str, cursor: int, counts: Dict[str, int],
+                                     finished: bool = False, release: bool = False) -> bool:
+        return await self._write(self.sync.checkpoint_check_cycle, cycle_id, owner, cursor, counts,
+                                 finished, release)
+    
+    async def mark_checked_in_cycle(self, product_ids: List[int], cycle_id: int):
+        return await self._write(self.sync.mark_checked_in_cycle, product_ids, cycle_id)
+    
+    async def get_check_cycle(self) -> Optional[Dict]:
+        return await self._read(self.sync.get_check_cycle)
+    
+    async def mark_alerts_sent(self, alert_ids: List[int]):
+        return await self._write(self.sync.mark_alerts_sent, alert_ids)
+    
+    async def record_alert_failures(self, alert_ids: List[int]):
+        return await self._write(self.sync.record_alert_failures, alert_ids)
+    
+    async def defer_alerts(self, deferrals: List[Tuple[int, float]]):
+        return await self._write(self.sync.defer_alerts, deferrals)
+    
+    async def give_up_alerts(self, alert_ids: List[int]):
+        return await self._write(self.sync.give_up_alerts, alert_ids)
+    
+    async def get_extraction_recipe(self, domain: str, template: str) -> Optional[Dict]:
+        return await self._read(self.sync.get_extraction_recipe, domain, template)
+    
+    async def save_extraction_recipe(self, domain: str, template: str, recipe: Dict):
+        return await self._write(self.sync.save_extraction_recipe, domain, template, recipe,
+                                 coalesce_key=('recipe', domain, template))
+    
+    async def record_recipe_result(self, domain: str, template: str, hit: bool):
+        return await self._write(self.sync.record_recipe_result, domain, template, hit)
+    
+    async def get_recipe_stats(self) -> Dict:
+        return await self._read(self.sync.get_recipe_stats)
+    
+    def user_cache_stats(self) -> Dict:
+        return self.sync.user_cache.stats()
+    
+    async def delete_tracked_product(self, product_id: int, telegram_id: int):
+        return await self._write(self.sync.delete_tracked_product, product_id, telegram_id)
+    
+    async def add_feature_request(self, telegram_id: int, category: str, description: str,
+                                  region: str = 'unknown', platform: str = None):
+        return await self._write(self.sync.add_feature_request, telegram_id, category, description,
+                                 region, platform)
+    
+    async def save_feedback_draft(self, telegram_id: int, category: str, platform: Optional[str] = None):
+        return await self._write(self.sync.save_feedback_draft, telegram_id, category, platform)
+    
+    async def delete_feedback_draft(self, telegram_id: int):
+        return await self._write(self.sync.delete_feedback_draft, telegram_id)
+
+
+def normalize_host(url: str) -> str:
+    """Return the lower-cased host of a URL without port or leading 'www.'"""
+    host = (urlsplit(url).hostname or '').lower().rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def canonicalize_url(url: str) -> str:
+    """Canonical form of a product URL used to de-duplicate scrapes
+    
+    Lower-cases scheme and host, drops 'www.', default ports, fragments,
+    trailing slashes and tracking query parameters (utm_*, gclid, ...), and
+    sorts the remaining query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'https').lower()
+    host = normalize_host(url)
+    port = parts.port
+    if port and not (scheme == 'http' and port == 80) and not (scheme == 'https' and port == 443):
+        host = f"{host}:{port}"
+    
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    ]
+    query.sort()
+    
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+class TokenBucket:
+    """Token bucket rate limiter (rate tokens per second, up to capacity)"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def take(self):
+        """Consume one token"""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens -= 1
+
+
+class ChatRateLimiter:
+    """Global and per-chat token buckets for outgoing Telegram messages
+    
+    Telegram allows about 30 messages/sec overall and 1/sec to one chat.
+    acquire() waits for both; pause() holds every sender after flood
+    control (RetryAfter). Per-chat buckets are kept for the most recently
+    used max_chats chats.
+    """
+    
+    def __init__(self, global_rate: float, chat_rate: float, max_chats: int = 10000):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chats: OrderedDict = OrderedDict()
+        self._max_chats = max_chats
+        self._paused_until = 0.0
+    
+    def pause(self, seconds: float):
+        """Hold all sending for seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    async def acquire(self, chat_id: int):
+        """Wait until a message may be sent to chat_id, and take its tokens"""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, 1)
+            if len(self._chats) > self._max_chats:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(chat_id)
+        
+        while True:
+            wait = max(self._paused_until - time.monotonic(), bucket.delay(), self._global.delay())
+            if wait <= 0:
+                bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(wait)
+
+
+class DomainScheduler:
+    """Per-host politeness scheduler for check workers
+    
+    Scrape targets (anything with a 'url') are grouped into one queue per host. Each host has its own token
+    bucket and concurrency limit, and hosts are served round-robin so that
+    throughput grows with the number of distinct sites while no single site
+    sees more than its configured rate.
+    
+    Items can be queued in separate lanes, each drained by its own workers
+    (a checker's due URLs and its full check cycle), while every lane shares
+    the hosts' buckets and concurrency limits. A scheduler created with
+    closed=False stays open for add() and its next() waits for more items
+    instead of returning None, until close(); other lanes start open.
+    """
+    
+    def __init__(self, items: List[Dict], policies: Optional[Dict] = None, closed: bool = True):
+        self.policies = DOMAIN_POLICIES if policies is None else policies
+        self._lanes: Dict[Optional[str], Dict] = {}  # lane -> {'queues', 'hosts', 'pending', 'closed'}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._active: Dict[str, int] = {}
+        self._limits: Dict[str, int] = {}
+        self._changed = asyncio.Condition()
+        self._lane(None)['closed'] = closed
+        for item in items:
+            self._enqueue(item, None)
+    
+    def __len__(self) -> int:
+        return sum(lane['pending'] for lane in self._lanes.values())
+    
+    @property
+    def host_count(self) -> int:
+        return len(self._buckets)
+    
+    def _lane(self, lane: Optional[str]) -> Dict:
+        state = self._lanes.get(lane)
+        if state is None:
+            # hosts: the hosts with queued items, in round-robin order
+            state = self._lanes[lane] = {'queues': {}, 'hosts': deque(), 'pending': 0, 'closed': False}
+        return state
+    
+    def _enqueue(self, item: Dict, lane: Optional[str]):
+        host = normalize_host(item['url'])
+        if host not in self._buckets:
+            policy = self._policy_for(host)
+            self._buckets[host] = TokenBucket(policy['rate'], policy['burst'])
+            self._limits[host] = max(1, int(policy['concurrency']))
+            self._active[host] = 0
+        
+        state = self._lane(lane)
+        pending = state['queues'].get(host)
+        if pending is None:
+            pending = state['queues'][host] = deque()
+            state['hosts'].append(host)
+        pending.append(item)
+        state['pending'] += 1
+    
+    async def add(self, item: Dict, lane: Optional[str] = None):
+        """Queue another item"""
+        async with self._changed:
+            self._enqueue(item, lane)
+            self._changed.notify_all()
+    
+    async def close(self, lane: Optional[str] = None):
+        """Let next() return None once every item queued in the lane has been handed out"""
+        async with self._changed:
+            self._lane(lane)['closed'] = True
+            self._changed.notify_all()
+    
+    def discard(self, lane: str):
+        """Forget a lane and every item still queued in it, once its workers have stopped"""
+        self._lanes.pop(lane, None)
+    
+    def _policy_for(self, host: str) -> Dict:
+        """Resolve the policy for a host, matching overrides by domain suffix"""
+        policy = {'rate': DOMAIN_RATE, 'burst': DOMAIN_BURST, 'concurrency': DOMAIN_CONCURRENCY}
+        parts = host.split('.')
+        # Most specific override wins (shop.amazon.com.au before amazon.com.au)
+        for i in range(len(parts)):
+            override = self.policies.get('.'.join(parts[i:]))
+            if override:
+                policy.update(override)
+                break
+        return policy
+    
+    async def next(self, lane: Optional[str] = None) -> Optional[Tuple[str, Dict]]:
+        """Wait for the lane's next item whose host may be scraped now
+        
+        Returns (host, item), or None once every item has been handed out
+        and the lane is closed. Callers must call release(host) when they
+        are done with it.
+        """
+        async with self._changed:
+            while True:
+                state = self._lane(lane)
+                if state['pending'] == 0 and state['closed']:
+                    return None
+                
+                wait = None
+                hosts = state['hosts']
+                for _ in range(len(hosts)):
+                    host = hosts[0]
+                    hosts.rotate(-1)
+                    
+                    if self._active[host] >= self._limits[host]:
+                        continue
+                    
+                    bucket = self._buckets[host]
+                    delay = bucket.delay()
+                    if delay > 0:
+                        wait = delay if wait is None else min(wait, delay)
+                        continue
+                    
+                    bucket.take()
+                    self._active[host] += 1
+                    state['pending'] -= 1
+                    pending = state['queues'][host]
+                    item = pending.popleft()
+                    if not pending:
+                        hosts.remove(host)
+                        del state['queues'][host]
+                    return host, item
+                
+                # Nothing ready: sleep until a token refills or a slot is released
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+    
+    async def release(self, host: str):
+        """Mark a request to host as finished"""
+        # Before taking the lock, so a cancelled caller still frees the slot
+        self._active[host] -= 1
+        async with self._changed:
+            self._changed.notify_all()
+
+
+class DomainCircuitBreaker:
+    """Per-host circuit breaker for check workers
+    
+    A host whose checks fail failures times in a row is opened: its URLs
+    are skipped for a cooldown instead of each going through a full
+    extraction. Once the cooldown is over the breaker is half-open and lets
+    up to probes checks through; a successful one closes it, a failed one
+    opens it again with the cooldown doubled up to max_cooldown. Only hosts
+    with recent failures are tracked.
+    """
+    
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN, probes: int = BREAKER_PROBES):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.probes = max(1, probes)
+        self._hosts: Dict[str, Dict] = {}  # host -> {'failures', 'cooldown', 'open_until', 'probing'}
+    
+    @property
+    def open_count(self) -> int:
+        """Hosts whose breaker is open or half-open"""
+        return sum(1 for breaker in self._hosts.values() if breaker['open_until'] is not None)
+    
+    def state(self, host: str) -> str:
+        """'closed', 'open' or 'half-open'"""
+        breaker = self._hosts.get(host)
+        if breaker is None or breaker['open_until'] is None:
+            return 'closed'
+        return 'open' if time.monotonic() < breaker['open_until'] else 'half-open'
+    
+    def retry_in(self, host: str) -> float:
+        """Seconds until host's breaker lets checks through again (0 unless open)"""
+        breaker = self._hosts.get(host)
+        if breaker is None or breaker['open_until'] is None:
+            return 0.0
+        return max(0.0, breaker['open_until'] - time.monotonic())
+    
+    def allow(self, host: str) -> bool:
+        """Whether a check of host may run now; a half-open breaker counts it as a probe
+        
+        Every allowed check must be reported with record().
+        """
+        state = self.state(host)
+        if state == 'closed':
+            return True
+        if state == 'open':
+            return False
+        
+        breaker = self._hosts[host]
+        if breaker['probing'] >= self.probes:
+            return False
+        breaker['probing'] += 1
+        return True
+    
+    def record(self, host: str, success: bool):
+        """Report the outcome of an allowed check"""
+        breaker = self._hosts.get(host)
+        if success:
+            if breaker is not None and breaker['open_until'] is not None:
+                logger.info(f"Circuit breaker for {host} closed")
+            self._hosts.pop(host, None)
+            return
+        
+        if breaker is None:
+            breaker = self._hosts[host] = {'failures': 0, 'cooldown': self.cooldown, 'open_until': None, 'probing': 0}
+        breaker['failures'] += 1
+        
+        if breaker['open_until'] is not None:
+            if time.monotonic() < breaker['open_until']:
+                return  # A check started before the breaker opened
+            # Failed probe: back off further
+            breaker['probing'] = max(0, breaker['probing'] - 1)
+            breaker['cooldown'] = min(self.max_cooldown, breaker['cooldown'] * 2)
+        elif breaker['failures'] < self.failures:
+            return
+        
+        cooldown = breaker['cooldown'] * (1 + random.uniform(-CHECK_JITTER, CHECK_JITTER))
+        breaker['open_until'] = time.monotonic() + cooldown
+        logger.warning(f"Circuit breaker for {host} opened after {breaker['failures']} failed checks; "
+                       f"skipping it for {cooldown:.0f}s")
+
+
+def check_interval_bounds(tiers) -> Tuple[float, float]:
+    """Tightest [min, max] check interval across the tiers subscribed to a URL"""
+    bounds = [CHECK_INTERVAL_BOUNDS.get(tier) or CHECK_INTERVAL_BOUNDS['free'] for tier in tiers]
+    bounds = bounds or [CHECK_INTERVAL_BOUNDS['free']]
+    return min(low for low, _ in bounds), min(high for _, high in bounds)
+
+
+def adaptive_check_interval(changes: int, observed_days: float, previous: Optional[float],
+                            bounds: Tuple[float, float]) -> float:
+    """Next check interval (seconds) for a URL from its recent price changes
+    
+    A URL whose price moved is checked CHECK_CHECKS_PER_CHANGE times per
+    expected change; a quiet one backs off geometrically from its previous
+    interval. The result is clamped to bounds.
+    """
+    low, high = bounds
+    if changes > 0:
+        changes_per_day = changes / max(observed_days, 1.0)
+        interval = 86400 / (changes_per_day * CHECK_CHECKS_PER_CHANGE)
+    else:
+        interval = (previous or low) * CHECK_BACKOFF
+    return max(low, min(high, interval))
+
+
+def retry_delay(failures: int, bounds: Tuple[float, float]) -> float:
+    """Seconds before retrying a URL after its failures-th failed check in a row
+    
+    Doubles from CHECK_RETRY_BASE up to CHECK_RETRY_MAX (or the tier's max
+    interval, if shorter). Equal jitter (a random half of the delay) keeps
+    URLs that failed together from being retried together.
+    """
+    delay = min(CHECK_RETRY_BASE * 2 ** max(0, failures - 1), CHECK_RETRY_MAX, bounds[1])
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class DueQueue:
+    """Min-heap of the canonical URLs a checker has claimed, ordered by due time
+    
+    URLs are claimed from tracked_products under a lease held by owner, so
+    several checkers can share one database without checking the same URL.
+    A URL stays claimed from refill() until done() is called once its check
+    has been rescheduled (which releases the lease), and at most batch_size
+    URLs are held at a time.
+    """
+    
+    def __init__(self, db: AsyncPriceTrackerDB, owner: str, batch_size: int = CHECK_SCHEDULER_BATCH,
+                 lease_seconds: float = CHECK_LEASE_SECONDS):
+        self.db = db
+        self.owner = owner
+        self.batch_size = max(1, batch_size)
+        self.lease_seconds = lease_seconds
+        self._heap: List[Tuple[str, str]] = []  # (next_check_at in UTC, canonical_url)
+        self._known: set = set()
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    @property
+    def claimed(self) -> int:
+        """URLs held by this queue, including those being checked"""
+        return len(self._known)
+    
+    async def refill(self, horizon: float) -> int:
+        """Claim URLs due within horizon seconds; returns how many were new"""
+        limit = self.batch_size - len(self._known)
+        if limit <= 0:
+            return 0
+        
+        now = datetime.now()
+        rows = await self.db.claim_due_urls(
+            self.owner, now + timedelta(seconds=horizon), limit,
+            now + timedelta(seconds=self.lease_seconds)
+        )
+        
+        # One row per claimed product; a URL is due when its earliest subscriber is
+        earliest: Dict[str, str] = {}
+        for canonical_url, due in rows:
+            if canonical_url not in earliest or due < earliest[canonical_url]:
+                earliest[canonical_url] = due
+        
+        added = 0
+        for canonical_url, due in earliest.items():
+            if canonical_url in self._known:
+                continue
+            self._known.add(canonical_url)
+            heapq.heappush(self._heap, (due, canonical_url))
+            added += 1
+        return added
+    
+    async def renew(self):
+        """Extend the lease on every URL this queue holds"""
+        if self._known:
+            await self.db.renew_leases(self.owner, datetime.now() + timedelta(seconds=self.lease_seconds))
+    
+    def pop_due(self) -> List[str]:
+        """Remove and return every loaded URL whose check time has come"""
+        now = _utc_timestamp(datetime.now())
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[1])
+        return due
+    
+    def seconds_until_next(self) -> Optional[float]:
+        """Seconds until the earliest loaded URL is due, or None if none is loaded"""
+        if not self._heap:
+            return None
+        due = _parse_utc_timestamp(self._heap[0][0])
+        return max(0.0, (due - datetime.now(timezone.utc)).total_seconds())
+    
+    def done(self, canonical_url: str):
+        """Forget a URL once its next check (and lease release) has been written"""
+        self._known.discard(canonical_url)
+
+
+class HttpFetcher:
+    """Process-wide pooled HTTP client
+    
+    One httpx.AsyncClient (HTTP/2 when h2 is installed) is shared by the
+    whole process, so connections, TLS sessions and DNS lookups are reused
+    across products on the same host. fetch() sends conditional GETs when
+    validators are known, and only ever connects to public addresses.
+    """
+    
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=HTTP_TIMEOUT,
+                headers={'User-Agent': HTTP_USER_AGENT},
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
+    
+    async def fetch(self, url: str, etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> Optional[httpx.Response]:
+        """GET a page, conditionally if validators are given; None if it, or a redirect, leads off the public internet
+        
+        Redirects are followed one at a time so every hop is checked with
+        is_public_url before it is requested. A new connection's peer is
+        checked again once it is open (_check_peer), so a host whose DNS
+        answer changes after the check still cannot reach an internal address.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            if not await self.is_public_url(url):
+                logger.warning(f"Refusing to fetch non-public URL {url}")
+                return None
+            response = await self.client.get(url, headers=headers, extensions={'trace': self._check_peer})
+            if response.next_request is None:
+                return response
+            url = str(response.next_request.url)
+        raise httpx.TooManyRedirects("Exceeded maximum allowed redirects.", request=response.request)
+    
+    async def _check_peer(self, event: str, info: Dict):
+        """httpcore trace hook: close a new connection whose peer address is not public
+        
+        Runs when the TCP connection is open, before TLS or the request.
+        """
+        if event != 'connection.connect_tcp.complete':
+            return
+        stream = info['return_value']
+        peer = stream.get_extra_info('server_addr')
+        if peer and not is_public_address(peer[0]):
+            await stream.aclose()
+            raise httpcore.ConnectError(f"Refusing to connect to non-public address {peer[0]}")
+    
+    async def is_public_url(self, url: str) -> bool:
+        """True for an http(s) URL whose host resolves only to public addresses
+        
+        Keeps loopback, private, link-local and other internal addresses out
+        of reach of the pages users ask us to fetch.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False
+        try:
+            addresses = await self.resolve(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        except (OSError, ValueError):
+            return False
+        return bool(addresses) and all(is_public_address(address) for address in addresses)
+    
+    async def resolve(self, host: str, port: int) -> List[str]:
+        """Every IP address host resolves to"""
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        return [info[4][0] for info in infos]
+    
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def is_public_address(address: str) -> bool:
+    """Whether an IP address is publicly routable (IPv4-mapped IPv6 is judged as IPv4)"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def parse_price_text(value) -> Optional[float]:
+    """Parse a price such as 1299, '$1,299.00', '1.299,00 €', '1.299 €' or '1 299,00' into a float"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    
+    match = re.search(r'\d{1,3}(?:[ \u00a0]\d{3})+(?:[.,]\d+)?|\d[\d.,]*', value)
+    if not match:
+        return None
+    number = re.sub(r'[ \u00a0]', '', match.group(0)).rstrip('.,')
+    
+    if ',' in number and '.' in number:
+        # Whichever separator comes last is the decimal point
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif ',' in number:
+        decimals = number.rsplit(',', 1)[1]
+        if number.count(',') == 1 and len(decimals) in (1, 2):
+            number = number.replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif number.count('.') > 1 or re.fullmatch(r'[1-9]\d{0,2}\.\d{3}', number):
+        # '1.299.000', or a lone '.' before exactly three digits: thousands
+        number = number.replace('.', '')
+    
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def page_template(url: str) -> str:
+    """Path shape shared by a site's product pages, e.g. '/dp/*' on Amazon
+    
+    The first path segment is kept unless it looks like an id; every later
+    segment is replaced by '*'.
+    """
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    if not segments:
+        return '/'
+    
+    shape = []
+    for i, segment in enumerate(segments):
+        if i == 0 and len(segment) <= 20 and not any(c.isdigit() for c in segment):
+            shape.append(segment.lower())
+        else:
+            shape.append('*')
+    return '/' + '/'.join(shape)
+
+
+class PageSignals(HTMLParser):
+    """Collects JSON-LD blocks and meta / itemprop values from an HTML page
+    
+    An itemprop element without a content attribute contributes its first
+    text instead, as in <span itemprop="price">$12.99</span>.
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.json_ld: List = []
+        self.meta: Dict[str, str] = {}
+        self._in_json_ld = False
+        self._buffer: List[str] = []
+        self._itemprop_text: Optional[str] = None
+    
+    @classmethod
+    def parse(cls, html: str) -> 'PageSignals':
+        signals = cls()
+        signals.feed(html)
+        signals.close()
+        return signals
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'script' and (attrs.get('type') or '').lower() == 'application/ld+json':
+            self._in_json_ld = True
+            self._buffer = []
+            return
+        
+        if tag == 'meta':
+            key = attrs.get('property') or attrs.get('name') or attrs.get('itemprop')
+        else:
+            key = attrs.get('itemprop')
+        if key and attrs.get('content') is not None:
+            self.meta.setdefault(key.lower(), attrs['content'])
+        elif key and tag != 'meta':
+            self._itemprop_text = key.lower()
+    
+    def handle_data(self, data):
+        if self._in_json_ld:
+            self._buffer.append(data)
+        elif self._itemprop_text and data.strip():
+            self.meta.setdefault(self._itemprop_text, data.strip())
+            self._itemprop_text = None
+    
+    def handle_endtag(self, tag):
+        if tag == 'script' and self._in_json_ld:
+            self._in_json_ld = False
+            try:
+                self.json_ld.append(json.loads(''.join(self._buffer)))
+            except ValueError:
+                pass
+
+
+def _json_ld_products(node) -> Iterator[Dict]:
+    """Every schema.org product in a JSON-LD document, including @graph members and variants"""
+    if isinstance(node, list):
+        for item in node:
+            yield from _json_ld_products(item)
+        return
+    if not isinstance(node, dict):
+        return
+    
+    types = node.get('@type')
+    types = types if isinstance(types, list) else [types]
+    if any(str(t).rsplit('/', 1)[-1] in STRUCTURED_PRODUCT_TYPES for t in types):
+        yield node
+    for key in ('@graph', 'mainEntity', 'hasVariant'):
+        if key in node:
+            yield from _json_ld_products(node[key])
+
+
+def _offer_price(offers) -> Optional[float]:
+    """First usable price in a JSON-LD Offer, AggregateOffer or list of them"""
+    for offer in offers if isinstance(offers, list) else [offers]:
+        if not isinstance(offer, dict):
+            continue
+        for key in ('price', 'lowPrice'):
+            price = parse_price_text(offer.get(key))
+            if price:
+                return price
+        specs = offer.get('priceSpecification')
+        for spec in specs if isinstance(specs, list) else [specs]:
+            price = parse_price_text(spec.get('price')) if isinstance(spec, dict) else None
+            if price:
+                return price
+        if 'offers' in offer:
+            price = _offer_price(offer['offers'])
+            if price:
+                return price
+    return None
+
+
+def _json_ld_product_price(blocks: List) -> Optional[Tuple[float, Optional[str]]]:
+    """(price, name) of the first JSON-LD product with a priced offer"""
+    for product in _json_ld_products(blocks):
+        price = _offer_price(product.get('offers'))
+        if price:
+            name = product.get('name')
+            return price, name.strip()[:100] if isinstance(name, str) and name.strip() else None
+    return None
+
+
+def extract_structured_data(html: str, chunk_size: int = STRUCTURED_DATA_CHUNK) -> Optional[Dict]:
+    """Read the price a page publishes as structured data, without the universal extractor
+    
+    Tries a JSON-LD Product offer, then microdata (itemprop="price"), then
+    OpenGraph product:price:amount. The page is fed to the parser in chunks
+    and parsing stops at the first JSON-LD product price, which is usually
+    in the <head>. Returns {'price', 'product_name', 'source'} (the name may
+    be None), or None if the page has no structured price.
+    """
+    signals = PageSignals()
+    for start in range(0, len(html), max(1, chunk_size)):
+        signals.feed(html[start:start + chunk_size])
+        found = _json_ld_product_price(signals.json_ld)
+        if found:
+            return {'price': found[0], 'product_name': found[1], 'source': 'jsonld'}
+    signals.close()
+    
+    meta = signals.meta
+    name = meta.get('og:title') or meta.get('name')
+    for source, key in (('microdata', 'price'), ('opengraph', 'product:price:amount'),
+                        ('opengraph', 'og:price:amount')):
+        price = parse_price_text(meta.get(key))
+        if price:
+            return {'price': price, 'product_name': name.strip()[:100] if name else None, 'source': source}
+    return None
+
+
+def _find_json_path(node, predicate, path: tuple = ()) -> Optional[list]:
+    """Depth-first search for the first (key, value) matching predicate"""
+    if isinstance(node, dict):
+        items = node.items()
+    elif isinstance(node, list):
+        items = enumerate(node)
+    else:
+        return None
+    
+    for key, value in items:
+        if isinstance(value, (dict, list)):
+            found = _find_json_path(value, predicate, path + (key,))
+            if found is not None:
+                return found
+        elif predicate(key, value):
+            return list(path + (key,))
+    return None
+
+
+def _follow_json_path(node, path: list):
+    for key in path:
+        try:
+            node = node[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return node
+
+
+def _price_spellings(price: float) -> List[str]:
+    """Ways a price may be written in HTML, most specific first"""
+    european = str.maketrans(',.', '.,')
+    spellings = [f"{price:,.2f}", f"{price:.2f}", f"{price:,.2f}".translate(european), f"{price:.2f}".translate(european)]
+    if price == int(price):
+        spellings += [f"{int(price):,}", f"{int(price)}", f"{int(price):,}".translate(european)]
+    return list(dict.fromkeys(spellings))
+
+
+def page_fingerprint(html: str, price: Optional[float], scope: str = FINGERPRINT_SCOPE) -> Optional[str]:
+    """Hash of a page with dynamic noise removed, to recognise it when it comes back unchanged
+    
+    Scripts (except JSON-LD), styles, comments, CSRF tokens, nonces and
+    timestamps are stripped (FINGERPRINT_NOISE) and whitespace collapsed.
+    price is the price last read from the page; it must appear in what is
+    hashed, so a page that renders its price from a script is never
+    fingerprinted. In 'price' scope only FINGERPRINT_WINDOW characters
+    either side of it are hashed. Returns None if there is no fingerprint.
+    """
+    if scope == 'off' or not price:
+        return None
+    
+    text = html
+    for pattern in FINGERPRINT_NOISE:
+        text = pattern.sub('', text)
+    text = ' '.join(text.split())
+    
+    position = None
+    for spelling in _price_spellings(price):
+        match = re.search(r'(?<![\d.,])' + re.escape(spelling) + r'(?!\d)', text)
+        if match:
+            position = match.start()
+            break
+    if position is None:
+        return None
+    
+    if scope == 'price':
+        text = text[max(0, position - FINGERPRINT_WINDOW):position + FINGERPRINT_WINDOW]
+    return hashlib.sha256(text.encode('utf-8', 'replace')).hexdigest()
+
+
+def learn_recipe(html: str, price: float, product_name: Optional[str] = None) -> Optional[Dict]:
+    """Work out how a known price (and name) can be read back from a page
+    
+    Tries, in order: a JSON-LD path, a meta/itemprop key, and finally the
+    markup immediately before the first occurrence of the price. Returns a
+    JSON-serializable recipe, or None if the price cannot be located.
+    """
+    def is_price(value) -> bool:
+        parsed = parse_price_text(value)
+        return parsed is not None and abs(parsed - price) < 0.01
+    
+    def is_name(value) -> bool:
+        return (
+            bool(product_name) and isinstance(value, str)
+            and value.strip().lower()[:30] == product_name.strip().lower()[:30]
+        )
+    
+    signals = PageSignals.parse(html)
+    
+    price_path = _find_json_path(signals.json_ld, lambda key, value: 'price' in str(key).lower() and is_price(value))
+    if price_path:
+        name_path = _find_json_path(signals.json_ld, lambda key, value: key == 'name' and is_name(value))
+        return {'type': 'jsonld', 'price': price_path, 'name': name_path}
+    
+    for key, content in signals.meta.items():
+        if 'price' in key and 'currency' not in key and is_price(content):
+            name_key = next(
+                (k for k, v in signals.meta.items() if ('title' in k or k == 'name') and is_name(v)), None
+            )
+            return {'type': 'meta', 'price': key, 'name': name_key}
+    
+    for spelling in _price_spellings(price):
+        for match in re.finditer(r'(?<![\d.,])' + re.escape(spelling) + r'(?!\d)', html):
+            window = html[max(0, match.start() - 80):match.start()]
+            tag_start = window.rfind('<')
+            if tag_start == -1:
+                continue
+            anchor = window[tag_start:]
+            # Applying the recipe takes the first occurrence of the anchor
+            if html.find(anchor) == match.start() - len(anchor):
+                return {'type': 'anchor', 'price': anchor}
+    return None
+
+
+def apply_recipe(recipe: Dict, html: str) -> Tuple[Optional[float], Optional[str]]:
+    """Read (price, product_name) from a page using a learned recipe"""
+    price, name = None, None
+    
+    if recipe['type'] == 'anchor':
+        start = html.find(recipe['price'])
+        if start != -1:
+            following = html[start + len(recipe['price']):start + len(recipe['price']) + 40]
+            match = re.match(r'\s*(\d[\d.,\u00a0 ]*)', following)
+            if match:
+                price = parse_price_text(match.group(1))
+        return price, name
+    
+    signals = PageSignals.parse(html)
+    if recipe['type'] == 'jsonld':
+        price = parse_price_text(_follow_json_path(signals.json_ld, recipe['price']))
+        if recipe.get('name'):
+            value = _follow_json_path(signals.json_ld, recipe['name'])
+            name = value if isinstance(value, str) else None
+    elif recipe['type'] == 'meta':
+        price = parse_price_text(signals.meta.get(recipe['price']))
+        if recipe.get('name'):
+            name = signals.meta.get(recipe['name'])
+    return price, name
+
+
+def run_extraction_job(url: str) -> Optional[Dict]:
+    """Run the universal scraper for a URL (blocking) and return its results
+    
+    Returns None if extraction failed. Lives at module level so it can be
+    pickled into extraction worker processes.
+    """
+    tester = UniversalExtractionTester(target_url=url)
+    success = tester.run_intelligent_extraction_test()
+    
+    if not success:
+        return None
+    return getattr(tester, '_dedicated_parser_results', {})
+
+
+def extract_product_name(results: Dict) -> Optional[str]:
+    """Extract product name from results"""
+    # Try various field names
+    for key in ['product_name', 'title', 'name', 'heading', 'product_title']:
+        if key in results:
+            value = results[key]
+            if isinstance(value, dict) and 'value' in value:
+                return str(value['value'])[:100]
+            elif isinstance(value, str):
+                return value[:100]
+    
+    return "Unknown Product"
+
+
+def extract_price(results: Dict) -> Optional[float]:
+    """Extract price from results"""
+    # Try various field names
+    for key in ['price', 'current_price', 'sale_price', 'product_price']:
+        if key in results:
+            value = results[key]
+            if isinstance(value, dict) and 'value' in value:
+                value = value['value']
+            
+            # Extract numeric price
+            if isinstance(value, (int, float)):
+                return float(value)
+            elif isinstance(value, str):
+                # Remove currency symbols and commas
+                price_str = value.replace('$', '').replace(',', '').strip()
+                try:
+                    return float(price_str)
+                except:
+                    pass
+    
+    return None
+
+
+def observe_extraction_tier(tier: str, seconds: float, hit: bool):
+    """Record one attempt of an extraction tier ('recipe', 'structured' or 'universal')"""
+    METRICS.observe('fetcha_extraction_tier_seconds', seconds, {'tier': tier})
+    METRICS.inc('fetcha_extraction_tier_total', {'tier': tier, 'outcome': 'hit' if hit else 'miss'})
+
+
+def price_change_percent(old_price: Optional[float], new_price: float) -> float:
+    """Relative price change in percent (0 if there is no old price)"""
+    if not old_price:
+        return 0.0
+    return (new_price - old_price) / old_price * 100
+
+
+def price_history_stats(rows: List[Tuple[str, str, float]], all_time_high: Optional[float],
+                        days: float = HISTORY_DAYS) -> Optional[Dict]:
+    """Summarise a product's price history (rows as returned by get_price_history)
+    
+    Each price holds until the next row, so the mean is time-weighted, and
+    the daily series behind the moving averages, volatility and sparkline
+    is the price in effect at the end of each day. The window ends at the
+    latest observation. Volatility is the standard deviation of the daily
+    price change in percent, over the days that follow a positive price;
+    it is None when there are none.
+    """
+    if not rows:
+        return None
+    
+    checked = np.array([row[0] for row in rows], dtype='datetime64[s]').astype(np.int64).astype(float)
+    last_seen = np.array([row[1] for row in rows], dtype='datetime64[s]').astype(np.int64).astype(float)
+    prices = np.array([row[2] for row in rows], dtype=float)
+    end = float(last_seen.max())
+    start = max(end - days * 86400, float(checked[0]))
+    
+    # Seconds each price held inside the window
+    held_from = np.maximum(checked, start)
+    held_until = np.minimum(np.append(checked[1:], end), end)
+    in_window = held_until >= start
+    weights = np.clip(held_until - held_from, 0, None)
+    window_prices = prices[in_window]
+    mean = np.average(prices, weights=weights) if weights.sum() > 0 else window_prices.mean()
+    
+    day_ends = end - 86400 * np.arange(int((end - start) // 86400), -1, -1)
+    daily = prices[np.searchsorted(checked, day_ends, side='right') - 1]
+    previous = daily[:-1]
+    daily_changes = np.diff(daily)[previous > 0] / previous[previous > 0] * 100
+    
+    low_index = int(np.argmin(np.where(in_window, prices, np.inf)))
+    current = float(prices[-1])
+    peak = max(float(window_prices.max()), all_time_high or 0.0)
+    return {
+        'current': current,
+        'low': float(prices[low_index]),
+        'low_at': datetime.fromtimestamp(held_from[low_index], timezone.utc).strftime('%Y-%m-%d'),
+        'high': float(window_prices.max()),
+        'mean': float(mean),
+        'moving_averages': {n: float(daily[-n:].mean()) for n in HISTORY_MOVING_AVERAGES if len(daily) >= n},
+        'all_time_high': peak,
+        'drop_from_high': (peak - current) / peak * 100 if peak else 0.0,
+        'volatility': float(daily_changes.std()) if len(daily_changes) else None,
+        'observed_days': (end - start) / 86400,
+        'daily': daily,
+    }
+
 
-# Try to import scraper - if not available (cloud deployment), scraping will be disabled
-try:
-    from test_universal_parser_approach import UniversalExtractionTester
-    SCRAPER_AVAILABLE = True
-    logger.info("Scraper module loaded successfully")
-except ImportError:
-    SCRAPER_AVAILABLE = False
-    logger.warning("Scraper module not available - product tracking disabled. This is normal for cloud deployment.")
+def sparkline(values, width: int = HISTORY_SPARKLINE_WIDTH) -> str:
+    """Block-character sparkline of a series, averaged down to at most width characters"""
+    values = np.asarray(values, dtype=float)
+    if len(values) > width:
+        values = np.array([chunk.mean() for chunk in np.array_split(values, width)])
+    
+    low, high = values.min(), values.max()
+    if high - low < 0.005:
+        return SPARKLINE_BLOCKS[len(SPARKLINE_BLOCKS) // 2] * len(values)
+    levels = np.rint((values - low) / (high - low) * (len(SPARKLINE_BLOCKS) - 1)).astype(int)
+    return ''.join(SPARKLINE_BLOCKS[level] for level in levels)
 
-# Database setup
-DB_PATH = Path(__file__).parent / "price_tracker.db"
+
+def export_lines(rows: Iterator[tuple], columns: Tuple[str, ...], fmt: str) -> Iterator[str]:
+    """Serialise rows one line at a time: CSV with a header line, or JSON Lines"""
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
 
 
-class PriceTrackerDB:
-    """SQLite database for tracking users and products"""
+def write_export(db: PriceTrackerDB, table: str, fmt: str, out: BinaryIO,
+                 telegram_id: Optional[int] = None):
+    """Stream one table ('products' or 'history') of one user, or everyone, to a binary file"""
+    rows = db.iter_products(telegram_id) if table == 'products' else db.iter_price_history(telegram_id)
+    for line in export_lines(rows, EXPORT_COLUMNS[table], fmt):
+        out.write(line.encode('utf-8'))
+
+
+class ExtractionPool:
+    """Runs blocking scraper jobs off the event loop
     
-    def __init__(self, db_path: Path = DB_PATH):
-        self.db_path = db_path
-        self.init_database()
+    Jobs go to a process pool (or thread pool) with a per-job timeout.
+    Process workers are replaced after max_jobs_per_worker jobs; thread
+    pools are swapped for a fresh one after the same number of jobs per
+    worker. A timed-out job cannot be interrupted, so the pool it runs in is
+    retired: new jobs go to a fresh pool and the old one is torn down once
+    its remaining jobs have finished. Background jobs may only use
+    workers - interactive_slots workers so chat requests never queue behind
+    a whole check cycle.
+    """
     
-    def init_database(self):
-        """Initialize database schema"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Users table with region support
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    region TEXT DEFAULT 'unknown',
-                    language_code TEXT DEFAULT 'en',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    tier TEXT DEFAULT 'free',
-                    tracked_count INTEGER DEFAULT 0
-                )
-            ''')
-            
-            # Tracked products table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tracked_products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER,
-                    url TEXT NOT NULL,
-                    product_name TEXT,
-                    current_price REAL,
-                    alert_price REAL,
-                    last_check TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    active INTEGER DEFAULT 1,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
-                )
-            ''')
-            
-            # Price history table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS price_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    product_id INTEGER,
-                    price REAL,
-                    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (product_id) REFERENCES tracked_products (id)
-                )
-            ''')
-            
-            # Feature requests table with region and platform tracking
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS feature_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER,
-                    region TEXT,
-                    category TEXT,
-                    platform TEXT,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
-                )
-            ''')
+    def __init__(self, mode: str = EXTRACTION_POOL_MODE, workers: int = EXTRACTION_WORKERS,
+                 timeout: float = EXTRACTION_TIMEOUT,
+                 max_jobs_per_worker: int = EXTRACTION_MAX_JOBS_PER_WORKER,
+                 interactive_slots: int = EXTRACTION_INTERACTIVE_SLOTS):
+        if mode not in ('process', 'thread'):
+            raise ValueError(f"Unknown extraction pool mode: {mode}")
+        
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.interactive_slots = min(max(0, interactive_slots), self.workers - 1)
+        
+        self._executor: Optional[Executor] = None
+        self._jobs_submitted = 0
+        self._active: Dict[Executor, int] = {}
+        self._retired: List[Executor] = []
+        self._lock = threading.Lock()
+        self._background_slots: Optional[asyncio.Semaphore] = None
+    
+    def _new_executor(self) -> Executor:
+        if self.mode == 'process':
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                max_tasks_per_child=self.max_jobs_per_worker
+            )
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='extraction')
+    
+    def _acquire_executor(self) -> Executor:
+        """Return the current executor, replacing it when it is due for recycling"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+                self._jobs_submitted = 0
+            elif self.mode == 'thread' and self._jobs_submitted >= self.workers * self.max_jobs_per_worker:
+                self._retire(self._executor)
+                self._executor = self._new_executor()
+                self._jobs_submitted = 0
             
-            conn.commit()
+            self._jobs_submitted += 1
+            self._active[self._executor] = self._active.get(self._executor, 0) + 1
+            return self._executor
     
-    def add_user(self, telegram_id: int, username: str, first_name: str, 
-                 region: str = 'unknown', language_code: str = 'en'):
-        """Add or update user"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (telegram_id, username, first_name, region, language_code)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (telegram_id, username, first_name, region, language_code))
-            conn.commit()
+    def _retire(self, executor: Executor):
+        """Stop sending jobs to an executor; it is shut down once idle (lock held)"""
+        if executor is self._executor:
+            self._executor = None
+        if executor not in self._retired:
+            self._retired.append(executor)
+        self._reap()
     
-    def update_user_region(self, telegram_id: int, region: str):
-        """Update user's region"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE users SET region = ? WHERE telegram_id = ?
-            ''', (region, telegram_id))
-            conn.commit()
+    def _release(self, executor: Executor, timed_out: bool = False):
+        with self._lock:
+            self._active[executor] -= 1
+            if timed_out:
+                logger.warning(f"Extraction job timed out after {self.timeout:.0f}s - recycling {self.mode} pool")
+                self._retire(executor)
+            else:
+                self._reap()
     
-    def get_user(self, telegram_id: int) -> Optional[Dict]:
-        """Get user details"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'telegram_id': row[0],
-                    'username': row[1],
-                    'first_name': row[2],
-                    'created_at': row[3],
-                    'tier': row[4],
-                    'tracked_count': row[5]
-                }
-            return None
+    def _reap(self):
+        """Shut down retired executors that have no jobs left (lock held)"""
+        for executor in list(self._retired):
+            if self._active.get(executor, 0) > 0:
+                continue
+            self._retired.remove(executor)
+            self._active.pop(executor, None)
+            self._terminate(executor)
     
-    def add_tracked_product(self, telegram_id: int, url: str, product_name: str, 
-                           current_price: float, alert_price: Optional[float] = None) -> int:
-        """Add tracked product"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO tracked_products 
-                (telegram_id, url, product_name, current_price, alert_price, last_check)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (telegram_id, url, product_name, current_price, alert_price, datetime.now()))
-            
-            product_id = cursor.lastrowid
-            
-            # Update user's tracked count
-            cursor.execute('''
-                UPDATE users SET tracked_count = tracked_count + 1
-                WHERE telegram_id = ?
-            ''', (telegram_id,))
-            
-            conn.commit()
-            return product_id
+    def _terminate(self, executor: Executor):
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Kill worker processes still stuck in an abandoned (timed-out) job
+        if isinstance(executor, ProcessPoolExecutor):
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                if process.is_alive():
+                    process.terminate()
     
-    def get_tracked_products(self, telegram_id: int) -> List[Dict]:
-        """Get user's tracked products"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, url, product_name, current_price, alert_price, last_check, created_at
-                FROM tracked_products
-                WHERE telegram_id = ? AND active = 1
-                ORDER BY created_at DESC
-            ''', (telegram_id,))
-            
-            products = []
-            for row in cursor.fetchall():
-                products.append({
-                    'id': row[0],
-                    'url': row[1],
-                    'product_name': row[2],
-                    'current_price': row[3],
-                    'alert_price': row[4],
-                    'last_check': row[5],
-                    'created_at': row[6]
-                })
-            return products
+    async def run(self, url: str, interactive: bool = False) -> Optional[Dict]:
+        """Extract a URL in the pool; raises asyncio.TimeoutError on timeout
+        
+        Cancelling the awaiting task cancels the job if it has not started yet.
+        """
+        priority = 'interactive' if interactive else 'background'
+        if interactive or self.interactive_slots == 0:
+            return await self._submit(url, priority)
+        
+        if self._background_slots is None:
+            self._background_slots = asyncio.Semaphore(self.workers - self.interactive_slots)
+        async with self._background_slots:
+            return await self._submit(url, priority)
     
-    def update_product_price(self, product_id: int, new_price: float) -> Tuple[bool, float]:
-        """Update product price and return if price changed"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Get current price
-            cursor.execute('SELECT current_price FROM tracked_products WHERE id = ?', (product_id,))
-            row = cursor.fetchone()
-            old_price = row[0] if row else None
-            
-            # Update price
-            cursor.execute('''
-                UPDATE tracked_products 
-                SET current_price = ?, last_check = ?
-                WHERE id = ?
-            ''', (new_price, datetime.now(), product_id))
-            
-            # Add to price history
-            cursor.execute('''
-                INSERT INTO price_history (product_id, price)
-                VALUES (?, ?)
-            ''', (product_id, new_price))
-            
-            conn.commit()
-            
-            price_changed = old_price is not None and abs(old_price - new_price) > 0.01
-            return price_changed, old_price if old_price else new_price
+    async def _submit(self, url: str, priority: str) -> Optional[Dict]:
+        executor = self._acquire_executor()
+        future = executor.submit(run_extraction_job, url)
+        timed_out = False
+        outcome = 'error'
+        started = time.perf_counter()
+        try:
+            results = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+            outcome = 'failure' if results is None else 'success'
+            return results
+        except asyncio.TimeoutError:
+            timed_out = not future.done()
+            outcome = 'timeout'
+            raise
+        finally:
+            future.cancel()
+            self._release(executor, timed_out)
+            METRICS.observe('fetcha_extraction_seconds', time.perf_counter() - started, {'priority': priority})
+            METRICS.inc('fetcha_extractions_total', {'priority': priority, 'outcome': outcome})
     
-    def delete_tracked_product(self, product_id: int, telegram_id: int):
-        """Delete tracked product"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE tracked_products SET active = 0
-                WHERE id = ? AND telegram_id = ?
-            ''', (product_id, telegram_id))
-            
-            cursor.execute('''
-                UPDATE users SET tracked_count = tracked_count - 1
-                WHERE telegram_id = ?
-            ''', (telegram_id,))
-            
-            conn.commit()
+    def shutdown(self):
+        """Shut down all executors without waiting for running jobs"""
+        with self._lock:
+            if self._executor is not None:
+                self._retired.append(self._executor)
+                self._executor = None
+            for executor in self._retired:
+                self._terminate(executor)
+            self._retired.clear()
+            self._active.clear()
+
+
+class PriceWriteBuffer:
+    """Collects check results and writes them in batched transactions
     
-    def add_feature_request(self, telegram_id: int, category: str, description: str,
-                           region: str = 'unknown', platform: str = None):
-        """Add feature request with region and platform tracking"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO feature_requests (telegram_id, region, category, platform, description)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (telegram_id, region, category, platform, description))
-            conn.commit()
+    Results are flushed when batch_size of them are pending, or by the
+    cycle's periodic flush, so alerts are never held back for long.
+    flush() returns (product, price_changed, old_price, new_price) for
+    every written row.
     
-    def get_market_stats(self, region: str = None) -> Dict:
-        """Get statistics by market/region"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            if region:
-                cursor.execute('''
-                    SELECT COUNT(*) as users, SUM(tracked_count) as products
-                    FROM users WHERE region = ?
-                ''', (region,))
-            else:
-                cursor.execute('''
-                    SELECT region, COUNT(*) as users, SUM(tracked_count) as products
-                    FROM users GROUP BY region
-                ''')
-            
-            if region:
-                row = cursor.fetchone()
-                return {'users': row[0], 'products': row[1]} if row else {'users': 0, 'products': 0}
-            else:
-                stats = {}
-                for row in cursor.fetchall():
-                    stats[row[0]] = {'users': row[1], 'products': row[2]}
-                return stats
+    Items handed to settle() are passed to on_flushed(items, stored) once
+    the flush that took every result added before them has finished;
+    stored is False if that flush failed.
+    """
     
-    def get_all_tracked_products(self) -> List[Dict]:
-        """Get all active tracked products for background checking"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, telegram_id, url, product_name, current_price, alert_price
-                FROM tracked_products
-                WHERE active = 1
-            ''')
+    def __init__(self, db: AsyncPriceTrackerDB, batch_size: int = CHECK_WRITE_BATCH, on_flushed=None):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.on_flushed = on_flushed
+        self._pending: List[Tuple[Dict, float, datetime]] = []
+        self._validators: Dict[str, Tuple[str, Optional[str], Optional[str], Optional[str]]] = {}
+        self._settling: List = []
+        self._lock = asyncio.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+    
+    async def add(self, products: List[Dict], new_price: float, checked_at: datetime,
+                  validators: Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]] = None
+                  ) -> List[Tuple[Dict, bool, float, float]]:
+        """Queue one price for several products; flushes if the batch is full
+        
+        validators is an optional (canonical_url, etag, last_modified,
+        fingerprint) row written in the same transaction as the prices.
+        """
+        self._pending.extend((product, new_price, checked_at) for product in products)
+        if validators is not None:
+            self._validators[validators[0]] = validators
+        if len(self._pending) >= self.batch_size:
+            return await self.flush()
+        return []
+    
+    def settle(self, item):
+        """Pass item to on_flushed once every result added so far is written"""
+        self._settling.append(item)
+    
+    async def flush(self) -> List[Tuple[Dict, bool, float, float]]:
+        """Write every pending result in one transaction"""
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            validators, self._validators = list(self._validators.values()), {}
+            settling, self._settling = self._settling, []
+            try:
+                updates = await self.db.update_product_prices(
+                    [(product['id'], new_price, checked_at) for product, new_price, checked_at in batch],
+                    validators
+                ) if batch else {}
+            except BaseException:
+                if settling and self.on_flushed is not None:
+                    await self.on_flushed(settling, False)
+                raise
             
-            products = []
-            for row in cursor.fetchall():
-                products.append({
-                    'id': row[0],
-                    'telegram_id': row[1],
-                    'url': row[2],
-                    'product_name': row[3],
-                    'current_price': row[4],
-                    'alert_price': row[5]
-                })
-            return products
+            if settling and self.on_flushed is not None:
+                await self.on_flushed(settling, True)
+            return [
+                (product, *updates[product['id']], new_price)
+                for product, new_price, _ in batch
+            ]
+
+
+class CheckCycleProgress:
+    """Counters for a full check cycle or the running check scheduler"""
+    
+    def __init__(self, total: int, urls: int = 0, domains: int = 0):
+        self.total = total
+        self.urls = urls
+        self.domains = domains
+        self.scraped = 0
+        self.checked = 0
+        self.changed = 0
+        self.alerts = 0
+        self.errors = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.recipe_hits = 0
+        self.recipe_misses = 0
+        self.structured_hits = 0
+        self.structured_misses = 0
+        self.short_circuited = 0
+        self.started = time.monotonic()
+    
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+    
+    def counts(self) -> Dict[str, int]:
+        """The counters a check_cycles checkpoint saves"""
+        return {counter: getattr(self, counter) for counter in CYCLE_COUNTERS}
+    
+    def summary(self) -> str:
+        """One-line progress report for the log"""
+        elapsed = self.elapsed()
+        rate = self.checked / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.checked
+        eta = remaining / rate if rate > 0 else 0.0
+        return (
+            f"{self.checked}/{self.total} checked ({self.scraped}/{self.urls} unique URLs "
+            f"across {self.domains} domains), {self.not_modified} not modified, "
+            f"{self.unchanged} unchanged by fingerprint, {self.changed} changed, "
+            f"{self.alerts} alerts, {self.errors} errors, "
+            f"{self.short_circuited} skipped by circuit breakers, "
+            f"recipes {self.recipe_hits} hit/{self.recipe_misses} miss, "
+            f"structured data {self.structured_hits} hit/{self.structured_misses} miss, "
+            f"{rate:.2f} products/s, elapsed {elapsed:.0f}s, eta {eta:.0f}s"
+        )
 
 
 class PriceTrackerBot:
     """Main bot class"""
     
-    def __init__(self, token: str):
+    def __init__(self, token: str, run_checker: bool = True, db: Optional[AsyncPriceTrackerDB] = None):
         self.token = token
-        self.db = PriceTrackerDB()
+        self.db = db if db is not None else AsyncPriceTrackerDB()
         self.application = None
         
         # Free tier limits
         self.FREE_TIER_LIMIT = 3  # 3 tracked products for free
+        
+        # Extraction for interactive lookups; shared with the embedded checker
+        self.extraction_pool = ExtractionPool()
+        self.http = HttpFetcher()
+        
+        # Embedded checker for single-process deployments (None when checkers run standalone)
+        self.checker = PriceChecker(self.db, self.extraction_pool, self.http) if run_checker else None
+        self._background_tasks: List[asyncio.Task] = []
+        self._metrics_server: Optional[asyncio.AbstractServer] = None
+        
+        # /history statistics, reused until a product's next price write
+        self.history_cache = PriceStatsCache()
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command with region selection"""
         user = update.effective_user
         
         # Check if user already exists
-        existing_user = self.db.get_user(user.id)
+        existing_user = await self.db.get_user(user.id)
         
         if not existing_user or existing_user.get('region') == 'unknown':
             # New user - ask for region
@@ -355,7 +3718,7 @@ class PriceTrackerBot:
             
             # Add user with unknown region for now
             language_code = user.language_code or 'en'
-            self.db.add_user(user.id, user.username, user.first_name, 'unknown', language_code)
+            await self.db.add_user(user.id, user.username, user.first_name, 'unknown', language_code)
             return
         
         # Existing user - show normal welcome
@@ -408,6 +3771,8 @@ Ready to start? Send me a product URL!
 /start - Start the bot
 /track - Track a new product
 /list - View tracked products
+/history - Price history and trends
+/export - Download your data (CSV, or /export jsonl)
 /help - Show this help
 /feedback - Send feature requests
 
@@ -450,7 +3815,49 @@ Contact @your_username
     async def list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /list command"""
         user_id = update.effective_user.id
-        products = self.db.get_tracked_products(user_id)
+        products = await self.db.get_tracked_products(user_id)
+        
+        if not products:
+            await update.message.reply_text(
+                "📭 You're not tracking any products yet.\n\n"
+                "Send me a product URL to start tracking!"
+            )
+            return
+        
+        message = f"📊 **Your Tracked Products** ({len(products)}/{self.FREE_TIER_LIMIT})\n\n"
+        
+        for i, product in enumerate(products, 1):
+            price_text = f"${product['current_price']:.2f}" if product['current_price'] else "Unknown"
+            alert_text = f" (Alert: ${product['alert_price']:.2f})" if product['alert_price'] else ""
+            
+            message += f"{i}. **{product['product_name']}**\n"
+            message += f"   💰 Price: {price_text}{alert_text}\n"
+            message += f"   🔗 [Link]({product['url'][:50]}...)\n"
+            message += f"   📅 Added: {product['created_at'][:10]}\n\n"
+        
+        # Add action buttons
+        keyboard = []
+        for product in products[:5]:  # Show first 5
+            keyboard.append([
+                InlineKeyboardButton("📈 History", callback_data=f"history_{product['id']}"),
+                InlineKeyboardButton(
+                    f"❌ Delete: {product['product_name'][:30]}",
+                    callback_data=f"delete_{product['id']}"
+                )
+            ])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        
+        await update.message.reply_text(
+            message,
+            parse_mode='Markdown',
+            reply_markup=reply_markup,
+            disable_web_page_preview=True
+        )
+    
+    async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /history [n]: price statistics for tracked products (n as numbered in /list)"""
+        products = await self.db.get_tracked_products(update.effective_user.id)
         
         if not products:
             await update.message.reply_text(
@@ -459,34 +3866,141 @@ Contact @your_username
             )
             return
         
-        message = f"📊 **Your Tracked Products** ({len(products)}/{self.FREE_TIER_LIMIT})\n\n"
+        if context.args:
+            index = int(context.args[0]) if context.args[0].isdigit() else 0
+            if not 1 <= index <= len(products):
+                await update.message.reply_text(f"Usage: /history [1-{len(products)}] (the number from /list)")
+                return
+            products = [products[index - 1]]
+        
+        await update.message.reply_text(
+            await self._price_history_message(products),
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+    
+    async def _price_history_message(self, products: List[Dict]) -> str:
+        """/history text for up to HISTORY_MAX_PRODUCTS products"""
+        if not NUMPY_AVAILABLE:
+            return "📈 Price history analytics are not available on this server yet."
+        
+        stats = await self._price_history_stats(products[:HISTORY_MAX_PRODUCTS])
+        message = f"📈 **Price History** (last {HISTORY_DAYS:g} days)\n\n"
+        for product in products[:HISTORY_MAX_PRODUCTS]:
+            message += f"📦 **{product['product_name']}**\n"
+            product_stats = stats[product['id']]
+            if product_stats is None:
+                message += "   No price history yet\n\n"
+                continue
+            
+            message += f"`{product_stats['sparkline']}`\n"
+            if product_stats['observed_days'] < HISTORY_DAYS - 1:
+                message += f"📅 {product_stats['observed_days']:.0f} days of history\n"
+            message += f"💰 Now ${product_stats['current']:.2f} • Avg ${product_stats['mean']:.2f}\n"
+            message += (f"⬇️ Low ${product_stats['low']:.2f} ({product_stats['low_at']}) • "
+                        f"⬆️ High ${product_stats['high']:.2f}\n")
+            if product_stats['moving_averages']:
+                message += "📉 " + " • ".join(f"{days}d avg ${average:.2f}"
+                                             for days, average in product_stats['moving_averages'].items()) + "\n"
+            if product_stats['drop_from_high'] > 0.05:
+                message += (f"🏔 {product_stats['drop_from_high']:.1f}% below all-time high "
+                            f"(${product_stats['all_time_high']:.2f})\n")
+            volatility = product_stats['volatility']
+            if volatility is not None:
+                level = 'low' if volatility < 1 else 'medium' if volatility < 5 else 'high'
+                message += f"🌊 Volatility {volatility:.1f}%/day ({level})\n"
+            message += "\n"
+        
+        if len(products) > HISTORY_MAX_PRODUCTS:
+            message += f"Use /history 1-{len(products)} for the others."
+        return message.rstrip()
+    
+    async def _price_history_stats(self, products: List[Dict]) -> Dict[int, Optional[Dict]]:
+        """History statistics per product id; None for products with no history"""
+        versions = await self.db.get_price_history_versions([product['id'] for product in products])
+        stats = {}
+        for product in products:
+            version = versions.get(product['id'])
+            product_stats = self.history_cache.get(product['id'], version) if version else None
+            if version and product_stats is None:
+                rows, all_time_high = await self.db.get_price_history(product['id'], HISTORY_DAYS)
+                product_stats = price_history_stats(rows, all_time_high)
+                if product_stats is not None:
+                    product_stats['sparkline'] = sparkline(product_stats.pop('daily'))
+                    self.history_cache.put(product['id'], version, product_stats)
+            stats[product['id']] = product_stats
+        return stats
+    
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /export [csv|jsonl] [all]: send tracked products and price history as documents
+        
+        'all' exports every user's data and is limited to ADMIN_IDS. Rows are
+        streamed from the database into a temporary file, off the event loop;
+        only the finished document is read for the upload.
+        """
+        args = [arg.lower() for arg in context.args or []]
+        fmt = 'jsonl' if 'jsonl' in args else 'csv'
+        user_id = update.effective_user.id
+        everyone = 'all' in args
         
-        for i, product in enumerate(products, 1):
-            price_text = f"${product['current_price']:.2f}" if product['current_price'] else "Unknown"
-            alert_text = f" (Alert: ${product['alert_price']:.2f})" if product['alert_price'] else ""
-            
-            message += f"{i}. **{product['product_name']}**\n"
-            message += f"   💰 Price: {price_text}{alert_text}\n"
-            message += f"   🔗 [Link]({product['url'][:50]}...)\n"
-            message += f"   📅 Added: {product['created_at'][:10]}\n\n"
+        if everyone and user_id not in ADMIN_IDS:
+            await update.message.reply_text("⛔ Only admins can export everyone's data.")
+            return
         
-        # Add action buttons
-        keyboard = []
-        for product in products[:5]:  # Show first 5
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"❌ Delete: {product['product_name'][:30]}",
-                    callback_data=f"delete_{product['id']}"
+        await update.message.reply_text("📤 Preparing your export...")
+        stamp = datetime.now().strftime('%Y%m%d')
+        for table in EXPORT_COLUMNS:
+            with tempfile.TemporaryFile() as spool:
+                await asyncio.to_thread(write_export, self.db.sync, table, fmt, spool,
+                                        None if everyone else user_id)
+                if spool.tell() > EXPORT_MAX_UPLOAD_BYTES:
+                    await update.message.reply_text(
+                        f"⚠️ The {table} export is larger than Telegram allows (50 MB). "
+                        "Use the 'export' command-line role on the server instead."
+                    )
+                    continue
+                
+                spool.seek(0)
+                await update.message.reply_document(
+                    document=spool,
+                    filename=f"fetcha_{table}_{'all' if everyone else user_id}_{stamp}.{fmt}"
                 )
-            ])
+    
+    async def cycle_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /cycle [start]: show the latest full check cycle, or start one (admins only)
         
-        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        Starting only records the cycle; a checker process picks it up
+        within CHECK_SCHEDULER_TICK seconds and checkpoints its progress.
+        """
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("⛔ Only admins can manage check cycles.")
+            return
+        
+        if [arg.lower() for arg in context.args or []] == ['start']:
+            if await self.db.start_check_cycle() is None:
+                await update.message.reply_text("⏳ A full check cycle is already running.")
+                return
+            await update.message.reply_text("▶️ Full check cycle started; a checker will pick it up shortly.")
+        
+        cycle = await self.db.get_check_cycle()
+        if cycle is None:
+            await update.message.reply_text("No full check cycle has been run yet. Use /cycle start.")
+            return
         
+        if cycle['finished_at']:
+            status = f"✅ finished {cycle['finished_at']}"
+        elif cycle['owner']:
+            status = f"🔄 running on {cycle['owner']} (last checkpoint {cycle['updated_at']})"
+        else:
+            status = "⏸ waiting for a checker"
+        percent = cycle['checked'] / cycle['total'] * 100 if cycle['total'] else 0.0
         await update.message.reply_text(
-            message,
-            parse_mode='Markdown',
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
+            f"Full check cycle #{cycle['id']}: {status}\n"
+            f"Started {cycle['started_at']}, resumed {cycle['restarts']} times\n"
+            f"{cycle['checked']}/{cycle['total']} products checked ({percent:.0f}%), "
+            f"{cycle['scraped']} URLs scraped\n"
+            f"{cycle['changed']} changed, {cycle['alerts']} alerts, {cycle['errors']} errors\n"
+            f"Cursor: product {cycle['cursor']}"
         )
     
     async def feedback_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -517,9 +4031,14 @@ Contact @your_username
         # Validate URL
         if not url.startswith('http'):
             return
-        
+        if not await self.http.is_public_url(url):
+            await update.message.reply_text(
+                "❌ **Invalid URL**\n\n"
+                "Please send a link to a product page on a public website."
+            )
+            return
         # Check user limits
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         if user and user['tracked_count'] >= self.FREE_TIER_LIMIT:
             await update.message.reply_text(
                 f"⚠️ **Free Tier Limit Reached**\n\n"
@@ -535,11 +4054,15 @@ Contact @your_username
         )
         
         try:
-            # Check if scraper is available
-            if not SCRAPER_AVAILABLE:
+            # Fast path: the price the page publishes as structured data
+            product = await self._extract_structured_product(url)
+            
+            # Without the scraper there is nothing to escalate to
+            if product is None and not SCRAPER_AVAILABLE:
                 await processing_msg.edit_text(
-                    "⚠️ **Product Scraping Temporarily Unavailable**\n\n"
-                    "We're currently in beta and the scraping feature is being upgraded.\n\n"
+                    "⚠️ **Couldn't Read This Page**\n\n"
+                    "This site doesn't publish its price in a format we can read yet, "
+                    "and full page scraping is being upgraded.\n\n"
                     "**You can help!**\n"
                     "Please use /feedback to tell us:\n"
                     "• What website/platform you want to track\n"
@@ -550,35 +4073,37 @@ Contact @your_username
                 )
                 return
             
-            # Use universal scraper to extract product data
-            tester = UniversalExtractionTester(target_url=url)
-            success = tester.run_intelligent_extraction_test()
-            
-            if not success:
-                await processing_msg.edit_text(
-                    "❌ **Extraction Failed**\n\n"
-                    "Could not extract product data from this URL.\n"
-                    "Please try a different URL or contact support."
-                )
-                return
-            
-            # Get extracted data
-            results = tester._dedicated_parser_results if hasattr(tester, '_dedicated_parser_results') else {}
-            
-            # Extract product name and price
-            product_name = self._extract_product_name(results)
-            current_price = self._extract_price(results)
-            
-            if not product_name or current_price is None:
-                await processing_msg.edit_text(
-                    "⚠️ **Partial Success**\n\n"
-                    "Could extract some data but missing product name or price.\n"
-                    "Please try a different URL."
-                )
-                return
+            if product is not None:
+                product_name, current_price = product
+            else:
+                # Use universal scraper to extract product data (runs in the extraction pool)
+                started = time.perf_counter()
+                results = await self.extraction_pool.run(url, interactive=True)
+                observe_extraction_tier('universal', time.perf_counter() - started,
+                                        results is not None and extract_price(results) is not None)
+                
+                if results is None:
+                    await processing_msg.edit_text(
+                        "❌ **Extraction Failed**\n\n"
+                        "Could not extract product data from this URL.\n"
+                        "Please try a different URL or contact support."
+                    )
+                    return
+                
+                # Extract product name and price
+                product_name = extract_product_name(results)
+                current_price = extract_price(results)
+                
+                if not product_name or current_price is None:
+                    await processing_msg.edit_text(
+                        "⚠️ **Partial Success**\n\n"
+                        "Could extract some data but missing product name or price.\n"
+                        "Please try a different URL."
+                    )
+                    return
             
             # Add to tracking
-            product_id = self.db.add_tracked_product(
+            product_id = await self.db.add_tracked_product(
                 user_id, url, product_name, current_price
             )
             
@@ -599,6 +4124,14 @@ Contact @your_username
                 parse_mode='Markdown'
             )
             
+        except asyncio.TimeoutError:
+            logger.error(f"Extraction timed out for {url}")
+            await processing_msg.edit_text(
+                "⏱️ **Extraction Timed Out**\n\n"
+                "This page took too long to analyze.\n"
+                "Please try again later or try a different URL."
+            )
+        
         except Exception as e:
             logger.error(f"Error tracking product: {e}")
             await processing_msg.edit_text(
@@ -607,40 +4140,23 @@ Contact @your_username
                 f"Please try again or contact support."
             )
     
-    def _extract_product_name(self, results: Dict) -> Optional[str]:
-        """Extract product name from results"""
-        # Try various field names
-        for key in ['product_name', 'title', 'name', 'heading', 'product_title']:
-            if key in results:
-                value = results[key]
-                if isinstance(value, dict) and 'value' in value:
-                    return str(value['value'])[:100]
-                elif isinstance(value, str):
-                    return value[:100]
-        
-        return "Unknown Product"
-    
-    def _extract_price(self, results: Dict) -> Optional[float]:
-        """Extract price from results"""
-        # Try various field names
-        for key in ['price', 'current_price', 'sale_price', 'product_price']:
-            if key in results:
-                value = results[key]
-                if isinstance(value, dict) and 'value' in value:
-                    value = value['value']
-                
-                # Extract numeric price
-                if isinstance(value, (int, float)):
-                    return float(value)
-                elif isinstance(value, str):
-                    # Remove currency symbols and commas
-                    price_str = value.replace('$', '').replace(',', '').strip()
-                    try:
-                        return float(price_str)
-                    except:
-                        pass
+
+    async def _extract_structured_product(self, url: str) -> Optional[Tuple[str, float]]:
+        """(name, price) from the page's structured data, or None to fall back to the universal extractor"""
+        try:
+            response = await self.http.fetch(url)
+        except httpx.HTTPError as e:
+            logger.debug(f"Page fetch failed for {url}: {e}")
+            return None
+        if response is None or response.status_code != 200:
+            return None
         
-        return None
+        started = time.perf_counter()
+        found = await asyncio.to_thread(extract_structured_data, response.text)
+        observe_extraction_tier('structured', time.perf_counter() - started, found is not None)
+        if found is None:
+            return None
+        return found['product_name'] or "Unknown Product", found['price']
     
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle button callbacks"""
@@ -651,7 +4167,7 @@ Contact @your_username
         
         if data.startswith('delete_'):
             product_id = int(data.split('_')[1])
-            self.db.delete_tracked_product(product_id, query.from_user.id)
+            await self.db.delete_tracked_product(product_id, query.from_user.id)
             await query.edit_message_text(
                 "✅ Product removed from tracking.\n\n"
                 "Use /list to see remaining products."
@@ -666,6 +4182,20 @@ Contact @your_username
                 parse_mode='Markdown'
             )
         
+        elif data.startswith('history_'):
+            product_id = int(data.split('_')[1])
+            products = [product for product in await self.db.get_tracked_products(query.from_user.id)
+                        if product['id'] == product_id]
+            if not products:
+                await query.message.reply_text("This product is no longer tracked. Use /list to see your products.")
+                return
+            
+            await query.message.reply_text(
+                await self._price_history_message(products),
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        
         elif data == 'view_all':
             # Trigger /list command
             await self.list_command(update, context)
@@ -676,7 +4206,7 @@ Contact @your_username
             # For platform feedback, show platform selection
             if category == 'platform':
                 # Get user's region to show relevant platforms
-                user = self.db.get_user(query.from_user.id)
+                user = await self.db.get_user(query.from_user.id)
                 region = user.get('region', 'unknown') if user else 'unknown'
                 
                 # Region-specific platforms
@@ -696,7 +4226,7 @@ Contact @your_username
                     reply_markup=reply_markup,
                     parse_mode='Markdown'
                 )
-                context.user_data['feedback_category'] = category
+                await self.db.save_feedback_draft(query.from_user.id, category)
             else:
                 await query.edit_message_text(
                     f"**{category.title()} Feedback**\n\n"
@@ -704,7 +4234,7 @@ Contact @your_username
                     f"(Send your message now, I'll save it!)",
                     parse_mode='Markdown'
                 )
-                context.user_data['feedback_category'] = category
+                await self.db.save_feedback_draft(query.from_user.id, category)
         
         elif data.startswith('platform_'):
             platform = data.split('_', 1)[1]
@@ -716,7 +4246,6 @@ Contact @your_username
                     parse_mode='Markdown'
                 )
             else:
-                context.user_data['feedback_platform'] = platform
                 await query.edit_message_text(
                     f"**🌐 Platform: {platform}**\n\n"
                     f"What specific feature or support do you need for {platform}?\n\n"
@@ -724,13 +4253,14 @@ Contact @your_username
                     parse_mode='Markdown'
                 )
             
-            context.user_data['feedback_category'] = 'platform'
+            await self.db.save_feedback_draft(query.from_user.id, 'platform',
+                                              None if platform == 'other' else platform)
         
         elif data.startswith('region_'):
             region = data.split('_')[1]
             
             # Update user's region
-            self.db.update_user_region(query.from_user.id, region)
+            await self.db.update_user_region(query.from_user.id, region)
             
             await query.edit_message_text(
                 f"✅ **Region set to: {region.upper()}**\n\n"
@@ -743,19 +4273,20 @@ Contact @your_username
     
     async def handle_feedback_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle feedback messages with region and platform tracking"""
-        if 'feedback_category' in context.user_data:
-            category = context.user_data['feedback_category']
+        draft = await self.db.get_feedback_draft(update.effective_user.id)
+        if draft is not None:
+            category = draft['category']
             description = update.message.text
             
             # Get user's region
-            user = self.db.get_user(update.effective_user.id)
+            user = await self.db.get_user(update.effective_user.id)
             region = user.get('region', 'unknown') if user else 'unknown'
             
             # Get platform if available
-            platform = context.user_data.get('feedback_platform', None)
+            platform = draft['platform']
             
             # Save to database with region and platform
-            self.db.add_feature_request(
+            await self.db.add_feature_request(
                 update.effective_user.id,
                 category,
                 description,
@@ -772,63 +4303,121 @@ Contact @your_username
             
             await update.message.reply_text(response, parse_mode='Markdown')
             
-            # Clear context
-            del context.user_data['feedback_category']
-            if 'feedback_platform' in context.user_data:
-                del context.user_data['feedback_platform']
+            # Clear the draft
+            await self.db.delete_feedback_draft(update.effective_user.id)
     
-    async def background_price_check(self, context: ContextTypes.DEFAULT_TYPE):
-        """Background job to check all tracked products"""
-        logger.info("Starting background price check...")
-        
-        products = self.db.get_all_tracked_products()
+    async def run_alert_delivery(self, application: Application):
+        """Send the price alerts queued by checkers
         
-        for product in products:
+        A user's alerts are held for ALERT_DIGEST_WINDOW after the first one
+        and then sent as one message, a digest if there are several. Chats
+        are served concurrently within Telegram's rate limits (see
+        ChatRateLimiter). Flood control pauses sending and hands the alerts
+        back to be sent once it is over; other failures are retried with
+        backoff.
+        """
+        limiter = ChatRateLimiter(ALERT_GLOBAL_RATE, ALERT_CHAT_RATE)
+        while True:
+            alerts = []
             try:
-                # Skip if scraper not available
-                if not SCRAPER_AVAILABLE:
-                    continue
-                
-                # Extract current price
-                tester = UniversalExtractionTester(target_url=product['url'])
-                success = tester.run_intelligent_extraction_test()
-                
-                if success and hasattr(tester, '_dedicated_parser_results'):
-                    results = tester._dedicated_parser_results
-                    new_price = self._extract_price(results)
-                    
-                    if new_price:
-                        # Update price in database
-                        price_changed, old_price = self.db.update_product_price(
-                            product['id'], new_price
-                        )
-                        
-                        # Send alert if price changed significantly
-                        if price_changed:
-                            price_diff = new_price - old_price
-                            percent_change = (price_diff / old_price) * 100
-                            
-                            if abs(percent_change) >= 5:  # 5% threshold
-                                emoji = "🔻" if price_diff < 0 else "🔺"
-                                await context.bot.send_message(
-                                    chat_id=product['telegram_id'],
-                                    text=f"{emoji} **PRICE CHANGE ALERT**\n\n"
-                                         f"📦 {product['product_name']}\n"
-                                         f"💰 ${old_price:.2f} → ${new_price:.2f}\n"
-                                         f"📊 {percent_change:+.1f}%\n\n"
-                                         f"[View Product]({product['url']})",
-                                    parse_mode='Markdown',
-                                    disable_web_page_preview=True
-                                )
+                alerts = await self.db.claim_pending_alerts(
+                    ALERT_BATCH, datetime.now() - timedelta(seconds=ALERT_DIGEST_WINDOW)
+                )
+                by_chat: Dict[int, List[Dict]] = {}
+                for alert in alerts:
+                    by_chat.setdefault(alert['telegram_id'], []).append(alert)
                 
-                # Rate limiting
-                await asyncio.sleep(5)
+                # At most ALERT_DIGEST_MAX alerts are claimed per chat
+                results = await asyncio.gather(*(
+                    self._deliver_chat_alerts(application, limiter, chat_alerts)
+                    for chat_alerts in by_chat.values()
+                ))
                 
+                done = [alert_id for result in results for alert_id in result[0]]
+                failed = [alert_id for result in results for alert_id in result[1]]
+                rejected = [alert_id for result in results for alert_id in result[2]]
+                deferred = [deferral for result in results for deferral in result[3]]
+                if done:
+                    await self.db.mark_alerts_sent(done)
+                if failed:
+                    await self.db.record_alert_failures(failed)
+                if rejected:
+                    await self.db.give_up_alerts(rejected)
+                if deferred:
+                    await self.db.defer_alerts(deferred)
             except Exception as e:
-                logger.error(f"Error checking product {product['id']}: {e}")
-                continue
+                logger.error(f"Error delivering price alerts: {e}")
+            
+            # Keep going without a pause while there is a backlog
+            if len(alerts) < ALERT_BATCH:
+                await asyncio.sleep(ALERT_POLL_INTERVAL)
+    
+    async def _deliver_chat_alerts(self, context: ContextTypes.DEFAULT_TYPE, limiter: ChatRateLimiter,
+                                   alerts: List[Dict]) -> Tuple[List[int], List[int], List[int], List[Tuple[int, float]]]:
+        """Send one chat's pending alerts as a single message
+        
+        Returns (done, failed, rejected, deferred): alert ids, and
+        (alert_id, seconds) for alerts hit by flood control, which are sent
+        again once Telegram's retry_after is over. Alerts whose price has
+        moved back under the threshold are done without a message.
+        """
+        done = [alert['id'] for alert in alerts
+                if abs(price_change_percent(alert['old_price'], alert['new_price'])) < ALERT_MIN_CHANGE_PERCENT]
+        alerts = [alert for alert in alerts if alert['id'] not in done]
+        if not alerts:
+            return done, [], [], []
+        
+        chat_id = alerts[0]['telegram_id']
+        alert_ids = [alert['id'] for alert in alerts]
+        await limiter.acquire(chat_id)
+        started = time.perf_counter()
+        try:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=self._format_price_alerts(alerts),
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        except RetryAfter as e:
+            METRICS.inc('fetcha_telegram_sends_total', {'outcome': 'retry_after'})
+            limiter.pause(float(e.retry_after))
+            logger.warning(f"Telegram flood control: pausing alert delivery for {e.retry_after}s")
+            return done, [], [], [(alert_id, float(e.retry_after)) for alert_id in alert_ids]
+        except Forbidden as e:
+            METRICS.inc('fetcha_telegram_sends_total', {'outcome': 'forbidden'})
+            logger.info(f"Dropping {len(alerts)} alerts for user {chat_id}: {e}")
+            return done, [], alert_ids, []
+        except Exception as e:
+            METRICS.inc('fetcha_telegram_sends_total', {'outcome': 'error'})
+            product_ids = [alert['product_id'] for alert in alerts]
+            logger.error(f"Error alerting user {chat_id} for products {product_ids}: {e}")
+            return done, alert_ids, [], []
+        finally:
+            METRICS.observe('fetcha_telegram_send_seconds', time.perf_counter() - started)
+        
+        METRICS.inc('fetcha_telegram_sends_total', {'outcome': 'sent'})
+        return done + alert_ids, [], [], []
+    
+    def _format_price_alerts(self, alerts: List[Dict]) -> str:
+        """Message text for one alert, or a digest of several"""
+        if len(alerts) == 1:
+            alert = alerts[0]
+            old_price, new_price = alert['old_price'], alert['new_price']
+            emoji = "🔻" if new_price < old_price else "🔺"
+            return (f"{emoji} **PRICE CHANGE ALERT**\n\n"
+                    f"📦 {alert['product_name']}\n"
+                    f"💰 ${old_price:.2f} → ${new_price:.2f}\n"
+                    f"📊 {price_change_percent(old_price, new_price):+.1f}%\n\n"
+                    f"[View Product]({alert['url']})")
         
-        logger.info("Background price check complete")
+        text = f"📊 **PRICE CHANGES** ({len(alerts)} products)\n\n"
+        for alert in alerts:
+            old_price, new_price = alert['old_price'], alert['new_price']
+            emoji = "🔻" if new_price < old_price else "🔺"
+            text += (f"{emoji} {alert['product_name']}\n"
+                     f"   ${old_price:.2f} → ${new_price:.2f} "
+                     f"({price_change_percent(old_price, new_price):+.1f}%) [View]({alert['url']})\n\n")
+        return text.rstrip()
     
     def _get_platform_options(self, region: str) -> list:
         """Get relevant platform options based on user's region"""
@@ -843,46 +4432,813 @@ Contact @your_username
         
         return platforms.get(region, ['Amazon', 'eBay', 'Shopify', 'Other'])
     
-    def run(self):
-        """Start the bot"""
-        # Create application
-        self.application = Application.builder().token(self.token).build()
-        
-        # Add handlers
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("track", self.track_command))
-        self.application.add_handler(CommandHandler("list", self.list_command))
-        self.application.add_handler(CommandHandler("feedback", self.feedback_command))
+    async def _post_init(self, application: Application):
+        """Start alert delivery, the embedded checker if any and the metrics endpoint"""
+        self._metrics_server = await start_metrics_server()
+        self._background_tasks.append(asyncio.create_task(self.run_alert_delivery(application)))
+        if self.checker is not None:
+            self._background_tasks.append(asyncio.create_task(self.checker.run()))
+    
+    async def _post_stop(self, application: Application):
+        """Stop background tasks; undelivered alerts stay queued for the next start"""
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
+    
+    async def _post_shutdown(self, application: Application):
+        """Release background resources when the application stops"""
+        logger.info(f"User cache: {self.db.user_cache_stats()}")
+        self.extraction_pool.shutdown()
+        await self.http.aclose()
+        await self.db.close()
+    
+    def add_handlers(self, application: Application):
+        """Register the bot's command, message and button handlers"""
+        application.add_handler(CommandHandler("start", self.start_command))
+        application.add_handler(CommandHandler("help", self.help_command))
+        application.add_handler(CommandHandler("track", self.track_command))
+        application.add_handler(CommandHandler("list", self.list_command))
+        application.add_handler(CommandHandler("history", self.history_command))
+        application.add_handler(CommandHandler("export", self.export_command))
+        application.add_handler(CommandHandler("cycle", self.cycle_command))
+        application.add_handler(CommandHandler("feedback", self.feedback_command))
         
         # URL message handler
-        self.application.add_handler(
+        application.add_handler(
             MessageHandler(filters.TEXT & filters.Regex(r'http'), self.handle_url_message)
         )
         
         # Feedback message handler
-        self.application.add_handler(
+        application.add_handler(
             MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_feedback_message)
         )
         
         # Button callback handler
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
-        
-        # Background job (check prices every 24 hours)
-        job_queue = self.application.job_queue
-        job_queue.run_repeating(
-            self.background_price_check,
-            interval=86400,  # 24 hours
-            first=60  # Start after 1 minute
+        application.add_handler(CallbackQueryHandler(self.button_callback))
+    
+    def run(self):
+        """Start the bot: long polling (BOT_MODE=polling) or a webhook server
+        
+        Updates are handled up to BOT_CONCURRENT_UPDATES at a time. On
+        SIGINT/SIGTERM the application stops taking updates and waits for
+        the ones in flight before post_stop cancels the background tasks.
+        """
+        # Create application
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(max(1, BOT_CONCURRENT_UPDATES))
+            .post_init(self._post_init)
+            .post_stop(self._post_stop)
+            .post_shutdown(self._post_shutdown)
+            .build()
         )
+        self.add_handlers(self.application)
         
         # Start bot
-        logger.info("Starting Fetcha Bot...")
-        self.application.run_polling()
+        if BOT_MODE == 'webhook':
+            logger.info(f"Starting Fetcha Bot (webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT})...")
+            # The webhook stays registered on shutdown: other replicas keep serving it, and
+            # Telegram holds updates for a single replica while it restarts
+            self.application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=urlsplit(WEBHOOK_URL).path.lstrip('/'),
+                webhook_url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        else:
+            # Polling removes any registered webhook, so don't poll against a production bot
+            logger.info("Starting Fetcha Bot (long polling)...")
+            self.application.run_polling()
+
+
+class PriceChecker:
+    """Background price check engine, independent of the Telegram front-end
+    
+    Any number of checkers, embedded in the bot process or started with
+    `python telegram_price_tracker_mvp.py checker`, can run against the same
+    database. Each claims due URLs under a lease it keeps renewing while it
+    works; when a checker dies its leases expire and other checkers reclaim
+    the URLs. Significant price changes are queued in price_alerts, which
+    the bot delivers.
+    """
+    
+    def __init__(self, db: Optional[AsyncPriceTrackerDB] = None,
+                 extraction_pool: Optional[ExtractionPool] = None,
+                 http: Optional[HttpFetcher] = None, owner: Optional[str] = None):
+        self.db = db if db is not None else AsyncPriceTrackerDB()
+        self.extraction_pool = extraction_pool if extraction_pool is not None else ExtractionPool()
+        self.http = http if http is not None else HttpFetcher()
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.breaker = DomainCircuitBreaker()
+        
+        self.check_workers = max(1, CHECK_WORKERS)
+        self.check_max_in_flight = max(1, CHECK_MAX_IN_FLIGHT)
+        self._check_in_progress = False
+        
+        # One politeness scheduler and extraction cap per process: run() and
+        # run_full_cycle() queue in their own lanes but share the hosts' limits
+        self.scheduler = DomainScheduler([], closed=False)
+        self.in_flight = asyncio.Semaphore(self.check_max_in_flight)
+    
+    async def run(self):
+        """Check products continuously as they fall due
+        
+        URLs are claimed into a DueQueue and drained in next_check_at order
+        into the checker's DomainScheduler and a worker pool. Each finished URL
+        is rescheduled from its own price volatility, which also releases its
+        lease, so checks are spread across the day and concentrated on
+        products whose prices move. A failed URL is retried with exponential
+        backoff, and URLs on a domain whose circuit breaker is open are
+        deferred without a check. Full check cycles started with /cycle
+        start (or left unfinished by a stopped checker) run alongside.
+        """
+        if not SCRAPER_AVAILABLE:
+            logger.info("Scraper not available - checking pages with structured price data only")
+        
+        due = DueQueue(self.db, self.owner)
+        scheduler = self.scheduler
+        progress = CheckCycleProgress(0)
+        writes = PriceWriteBuffer(self.db)
+        
+        async def on_done(target: Dict, checked: Optional[bool]):
+            try:
+                await self._reschedule_target(target, checked)
+            except Exception as e:
+                progress.errors += 1
+                logger.error(f"Error rescheduling {target['canonical_url']}: {e}")
+            finally:
+                due.done(target['canonical_url'])
+        
+        tasks = [
+            asyncio.create_task(self._check_worker(scheduler, self.in_flight, writes, progress, on_done))
+            for _ in range(self.check_workers)
+        ]
+        tasks.append(asyncio.create_task(self._report_check_progress(progress)))
+        tasks.append(asyncio.create_task(self._flush_price_writes(writes, progress)))
+        tasks.append(asyncio.create_task(self._renew_leases(due, progress)))
+        tasks.append(asyncio.create_task(self._maintain_price_history(progress)))
+        tasks.append(asyncio.create_task(self._run_full_cycles(progress)))
+        METRICS.gauge_function('fetcha_due_claimed', lambda: due.claimed)
+        METRICS.gauge_function('fetcha_scheduler_queued', lambda: len(scheduler))
+        METRICS.gauge_function('fetcha_write_buffer', lambda: len(writes))
+        METRICS.gauge_function('fetcha_breakers_open', lambda: self.breaker.open_count)
+        logger.info(f"Price checker {self.owner} started")
+        
+        try:
+            while True:
+                try:
+                    await due.refill(CHECK_SCHEDULER_TICK)
+                except Exception as e:
+                    progress.errors += 1
+                    logger.error(f"Error loading due products: {e}")
+                
+                for canonical_url in due.pop_due():
+                    try:
+                        products = await self.db.get_products_for_url(canonical_url)
+                    except Exception as e:
+                        progress.errors += 1
+                        logger.error(f"Error loading products for {canonical_url}: {e}")
+                        products = []
+                    
+                    if not products:
+                        due.done(canonical_url)
+                        continue
+                    
+                    target = {'canonical_url': canonical_url, 'url': products[0]['url'], 'products': products}
+                    if self.breaker.state(normalize_host(target['url'])) == 'open':
+                        await self._short_circuit(target, progress, on_done)
+                        continue
+                    
+                    await scheduler.add(target)
+                    progress.total += len(products)
+                    progress.urls += 1
+                progress.domains = scheduler.host_count
+                
+                # Sleep until the next URL falls due, refilling at least every tick
+                wait = due.seconds_until_next()
+                await asyncio.sleep(CHECK_SCHEDULER_TICK if wait is None else min(max(wait, 0.1), CHECK_SCHEDULER_TICK))
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Let a running full cycle save its checkpoint before the database closes
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for gauge in ('fetcha_due_claimed', 'fetcha_scheduler_queued', 'fetcha_write_buffer',
+                          'fetcha_breakers_open'):
+                METRICS.gauge_function(gauge, None)
+            await self._queue_price_alerts(await writes.flush(), progress)
+            # Hand unfinished URLs straight back instead of waiting for the leases to expire
+            await self.db.release_leases(self.owner)
+            logger.info(f"Price checker {self.owner} stopped: {progress.summary()}")
+    
+    async def _reschedule_target(self, target: Dict, checked: Optional[bool]):
+        """Write every subscriber's next_check_at from the URL's price volatility
+        
+        A failed check (checked is False) is retried with jittered
+        exponential backoff (see retry_delay). A URL skipped by its domain's
+        circuit breaker is deferred until the breaker lets probes through,
+        without counting as a failure. A page with nothing to extract it
+        from (checked is None) is simply checked again at its usual interval.
+        """
+        products = target['products']
+        product_ids = [product['id'] for product in products]
+        bounds = check_interval_bounds(product.get('tier', 'free') for product in products)
+        if target.get('short_circuited'):
+            wait = max(self.breaker.retry_in(normalize_host(target['url'])), CHECK_RETRY_BASE)
+            await self.db.retry_products(product_ids, datetime.now() + timedelta(seconds=wait * random.uniform(1, 2)),
+                                         failed=False)
+            return
+        
+        if checked is False:
+            failures = max(product.get('check_failures', 0) for product in products) + 1
+            delay = retry_delay(failures, bounds)
+            await self.db.retry_products(product_ids, datetime.now() + timedelta(seconds=delay))
+            return
+        
+        changes, observed_days = await self.db.get_price_volatility(products[0]['id'], CHECK_VOLATILITY_DAYS)
+        interval = adaptive_check_interval(changes, observed_days, products[0].get('check_interval'), bounds)
+        delay = interval * (1 + random.uniform(-CHECK_JITTER, CHECK_JITTER))
+        await self.db.reschedule_products(product_ids, datetime.now() + timedelta(seconds=delay), interval)
+    
+    async def _renew_leases(self, due: DueQueue, progress: CheckCycleProgress):
+        """Heartbeat: extend the leases on claimed URLs well before they expire"""
+        while True:
+            await asyncio.sleep(CHECK_LEASE_SECONDS / 3)
+            try:
+                await due.renew()
+            except Exception as e:
+                progress.errors += 1
+                logger.error(f"Error renewing check leases: {e}")
+    
+    async def _maintain_price_history(self, progress: CheckCycleProgress):
+        """Periodically roll price history up and apply retention
+        
+        Safe to run in every checker: each rollup batch claims its rows in
+        one transaction, so no history is counted twice.
+        """
+        while True:
+            await asyncio.sleep(PRICE_ROLLUP_INTERVAL)
+            try:
+                rolled = 0
+                while True:
+                    count = await self.db.rollup_price_history()
+                    rolled += count
+                    if count < PRICE_ROLLUP_BATCH:
+                        break
+                deleted = await self.db.apply_price_history_retention()
+                logger.info(f"Price history maintenance: {rolled} rows rolled up, deleted {deleted}")
+            except Exception as e:
+                progress.errors += 1
+                logger.error(f"Error maintaining price history: {e}")
+    
+    async def run_full_cycle(self, cycle: Optional[Dict] = None):
+        """Check every tracked product in one full pass
+        
+        Regular checks are run by run(); this is a one-off
+        sweep over everything, recorded in check_cycles so that it survives
+        restarts. cycle is a record claimed with claim_check_cycle; without
+        one a new cycle is started (unless another checker is running one).
+        
+        Active products are streamed in id order,
+        one row per canonical URL, and each URL's subscribers are loaded as
+        it is queued, so at most CHECK_STREAM_WINDOW URLs are held however
+        many products there are, and products added or removed meanwhile are
+        picked up. URLs are handed out to a pool of worker tasks through the
+        cycle's lane of the checker's per-domain politeness scheduler, so
+        regular checks and the cycle together stay within each host's
+        limits. The checker's semaphore caps how many extractions run at
+        once, and a reporter task logs cycle progress while the workers run.
+        Each URL is leased like a due URL while the cycle checks it; a URL
+        another checker (or this checker's due queue) holds is skipped.
+        Prices are written in batched transactions through a PriceWriteBuffer.
+        
+        Checked products are marked with the cycle id once the flush that
+        stored their price has committed, and every
+        CHECK_CYCLE_CHECKPOINT_INTERVAL the record's cursor (every URL whose
+        first row id is at or below it is done) and counts are saved; a URL
+        only counts as done once its result is written. A resumed cycle
+        starts after the cursor and skips marked products, so nothing
+        finished is scraped again. If another checker takes the cycle over,
+        this one cancels its checks in flight and stops without saving
+        anything more to the record.
+        """
+        if self._check_in_progress:
+            logger.warning("Previous background price check still running - skipping this cycle")
+            return
+        
+        self._check_in_progress = True
+        try:
+            logger.info("Starting background price check...")
+            
+            if cycle is None:
+                await self.db.start_check_cycle()
+                cycle = await self.db.claim_check_cycle(self.owner, self._stale_cycle_heartbeat())
+                if cycle is None:
+                    logger.info("Another checker is running the full check cycle")
+                    return
+            
+            cycle_id = cycle['id']
+            progress = CheckCycleProgress(await self.db.count_active_products())
+            for counter in CYCLE_COUNTERS[1:]:
+                setattr(progress, counter, cycle[counter])
+            progress.urls = progress.scraped
+            if cycle['cursor'] or cycle['scraped']:
+                logger.info(f"Resuming full check cycle {cycle_id} after product {cycle['cursor']}")
+            
+            scheduler, lane = self.scheduler, 'cycle'
+            lease_owner = f"{self.owner}/cycle"
+            window = asyncio.Semaphore(CHECK_STREAM_WINDOW)
+            queued: Dict[int, None] = {}  # ids of the rows standing for queued URLs, ascending
+            last_queued = cycle['cursor']
+            lost = asyncio.Event()
+            
+            def cursor() -> int:
+                return next(iter(queued)) - 1 if queued else last_queued
+            
+            async def on_done(target: Dict, checked: Optional[bool]):
+                window.release()
+                if checked:
+                    # Done once the flush that stores its price has committed
+                    writes.settle(target)
+                else:
+                    queued.pop(target['first_id'], None)
+                try:
+                    await self.db.release_leases(lease_owner, [target['canonical_url']])
+                except Exception as e:
+                    progress.errors += 1
+                    logger.error(f"Error releasing the lease on {target['canonical_url']}: {e}")
+            
+            async def on_flushed(targets: List[Dict], stored: bool):
+                try:
+                    if stored:
+                        await self.db.mark_checked_in_cycle(
+                            [product['id'] for target in targets for product in target['products']], cycle_id
+                        )
+                except Exception as e:
+                    progress.errors += 1
+                    logger.error(f"Error marking {len(targets)} URLs checked in cycle {cycle_id}: {e}")
+                finally:
+                    for target in targets:
+                        queued.pop(target['first_id'], None)
+            
+            writes = PriceWriteBuffer(self.db, on_flushed=on_flushed)
+            
+            workers = [
+                asyncio.create_task(self._check_worker(scheduler, self.in_flight, writes, progress, on_done, lane))
+                for _ in range(self.check_workers)
+            ]
+            reporter = asyncio.create_task(self._report_check_progress(progress))
+            flusher = asyncio.create_task(self._flush_price_writes(writes, progress))
+            checkpointer = asyncio.create_task(self._checkpoint_cycle(cycle_id, cursor, progress, lost, lease_owner))
+            
+            completed = False
+            drained = None
+            try:
+                async for first in self.db.iter_active_products(cycle['cursor'], first_per_url=True,
+                                                                unchecked_in_cycle=cycle_id):
+                    await window.acquire()
+                    if lost.is_set():
+                        window.release()
+                        break
+                    
+                    lease_until = datetime.now() + timedelta(seconds=CHECK_LEASE_SECONDS)
+                    if not await self.db.claim_url_lease(lease_owner, first.canonical_url, lease_until):
+                        # Skipped: a regular check, here or in another checker, is checking it now
+                        window.release()
+                        last_queued = first.id
+                        continue
+                    
+                    try:
+                        products = await self.db.get_products_for_url(first.canonical_url)
+                    except Exception as e:
+                        progress.errors += 1
+                        logger.error(f"Error loading products for {first.canonical_url}: {e}")
+                        products = []
+                    
+                    if not products:
+                        window.release()
+                        await self.db.release_leases(lease_owner, [first.canonical_url])
+                        continue
+                    
+                    target = {'canonical_url': first.canonical_url, 'url': products[0]['url'],
+                              'products': products, 'first_id': first.id}
+                    queued[first.id] = None
+                    last_queued = first.id
+                    if self.breaker.state(normalize_host(target['url'])) == 'open':
+                        await self._short_circuit(target, progress, on_done)
+                        continue
+                    
+                    await scheduler.add(target, lane)
+                    progress.urls += 1
+                    progress.domains = scheduler.host_count
+                
+                await scheduler.close(lane)
+                # Drain the queued URLs, unless the cycle is taken over meanwhile
+                drained = asyncio.gather(*workers)
+                taken_over = asyncio.create_task(lost.wait())
+                await asyncio.wait([drained, taken_over], return_when=asyncio.FIRST_COMPLETED)
+                taken_over.cancel()
+                if not lost.is_set():
+                    drained.result()
+                    completed = True
+            finally:
+                reporter.cancel()
+                flusher.cancel()
+                checkpointer.cancel()
+                if drained is not None:
+                    drained.cancel()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                scheduler.discard(lane)
+                # URLs left unchecked go back to the due queue
+                await self.db.release_leases(lease_owner)
+                
+                # Write whatever is still buffered, then the final checkpoint unless the cycle is no longer ours
+                await self._queue_price_alerts(await writes.flush(), progress)
+                if not lost.is_set():
+                    if not await self.db.checkpoint_check_cycle(cycle_id, self.owner, cursor(), progress.counts(),
+                                                                finished=completed, release=True):
+                        logger.warning(f"Full check cycle {cycle_id} was taken over by another checker")
+                        lost.set()
+                    elif not completed:
+                        logger.warning(f"Full check cycle {cycle_id} interrupted after product {cursor()}; "
+                                       f"it will be resumed")
+            
+            if lost.is_set():
+                return
+            
+            METRICS.observe('fetcha_check_cycle_seconds', progress.elapsed())
+            logger.info(f"Background price check complete: {progress.summary()}")
+        finally:
+            self._check_in_progress = False
+    
+    def _stale_cycle_heartbeat(self) -> datetime:
+        """A cycle whose owner has not checkpointed since this time is up for grabs"""
+        return datetime.now() - timedelta(seconds=CHECK_LEASE_SECONDS)
+    
+    async def _checkpoint_cycle(self, cycle_id: int, cursor, progress: CheckCycleProgress,
+                                lost: asyncio.Event, lease_owner: str):
+        """Heartbeat: save the cycle's cursor and counts and renew its URL leases
+        
+        Sets lost if another checker took the cycle over.
+        """
+        while True:
+            await asyncio.sleep(CHECK_CYCLE_CHECKPOINT_INTERVAL)
+            try:
+                if not await self.db.checkpoint_check_cycle(cycle_id, self.owner, cursor(), progress.counts()):
+                    logger.warning(f"Full check cycle {cycle_id} was taken over by another checker")
+                    lost.set()
+                    return
+                await self.db.renew_leases(lease_owner, datetime.now() + timedelta(seconds=CHECK_LEASE_SECONDS))
+            except Exception as e:
+                progress.errors += 1
+                logger.error(f"Error checkpointing full check cycle {cycle_id}: {e}")
+    
+    async def _run_full_cycles(self, progress: CheckCycleProgress):
+        """Run full check cycles started with /cycle start, resuming any left unfinished"""
+        while True:
+            try:
+                cycle = await self.db.claim_check_cycle(self.owner, self._stale_cycle_heartbeat())
+                if cycle is not None:
+                    await self.run_full_cycle(cycle)
+            except Exception as e:
+                progress.errors += 1
+                logger.error(f"Error running full check cycle: {e}")
+            await asyncio.sleep(CHECK_SCHEDULER_TICK)
+    
+    async def _check_worker(self, scheduler: DomainScheduler, in_flight: asyncio.Semaphore,
+                            writes: PriceWriteBuffer, progress: CheckCycleProgress, on_done=None,
+                            lane: Optional[str] = None):
+        """Worker task: check the lane's URLs handed out by the scheduler until none are left
+        
+        on_done, if given, is awaited as on_done(target, checked) after each
+        URL, with checked as returned by _check_target (False on an error).
+        Only failed checks count against the domain's circuit breaker. A check
+        cancelled part-way is not reported at all: the URL keeps its lease,
+        or stays ahead of the cycle's cursor, and is checked again later.
+        Its host's slot is released, as the scheduler outlives the worker.
+        """
+        while True:
+            item = await scheduler.next(lane)
+            if item is None:
+                return
+            
+            host, target = item
+            if not self.breaker.allow(host):
+                # The breaker opened while this URL was queued
+                await scheduler.release(host)
+                await self._short_circuit(target, progress, on_done)
+                continue
+            
+            checked = False
+            outcome = 'error'
+            domain = METRICS.domain(target['url'])
+            started = time.perf_counter()
+            try:
+                async with in_flight:
+                    checked = await self._check_target(target, writes, progress)
+                outcome = {True: 'checked', False: 'failed', None: 'no_extractor'}[checked]
+            except asyncio.CancelledError:
+                await scheduler.release(host)
+                raise
+            except Exception as e:
+                progress.errors += 1
+                product_ids = [product['id'] for product in target['products']]
+                logger.error(f"Error checking {target['canonical_url']} (products {product_ids}): {e}")
+            
+            # The host answered even when there was nothing to extract
+            self.breaker.record(host, checked is not False)
+            METRICS.observe('fetcha_check_seconds', time.perf_counter() - started, {'domain': domain})
+            METRICS.inc('fetcha_checks_total', {'domain': domain, 'outcome': outcome})
+            progress.scraped += 1
+            progress.checked += len(target['products'])
+            await scheduler.release(host)
+            if on_done is not None:
+                await on_done(target, checked)
+    
+    async def _short_circuit(self, target: Dict, progress: CheckCycleProgress, on_done=None):
+        """Skip a URL whose domain's circuit breaker is open; on_done sees it as not checked"""
+        target['short_circuited'] = True
+        progress.short_circuited += 1
+        METRICS.inc('fetcha_checks_total', {'domain': METRICS.domain(target['url']), 'outcome': 'short_circuited'})
+        if on_done is not None:
+            await on_done(target, False)
+    
+    async def _check_target(self, target: Dict, writes: PriceWriteBuffer,
+                            progress: CheckCycleProgress) -> Optional[bool]:
+        """Scrape one canonical URL and fan the price out to every subscriber
+        
+        Returns True if the URL was checked (a price, 304 Not Modified or a
+        page whose fingerprint is unchanged), None if the page loaded but
+        has no structured price and the universal scraper is not installed,
+        and False if the check failed.
+        """
+        canonical_url = target['canonical_url']
+        products = target['products']
+        
+        # Conditional GET first: an unchanged page needs no extraction at all
+        fetched = await self._fetch_page(target)
+        if fetched is None:
+            return False  # Not a public page: the universal scraper must not fetch it either
+        not_modified, response, known_fingerprint = fetched
+        if not_modified:
+            await self.db.touch_last_check([product['id'] for product in products], datetime.now())
+            progress.not_modified += 1
+            return True
+        
+        new_price = None
+        last_price = self._last_price(products)
+        fingerprint = None
+        if response is not None:
+            # Same content around the same price: nothing to extract or record
+            fingerprint = await asyncio.to_thread(page_fingerprint, response.text, last_price)
+            if fingerprint is not None and fingerprint == known_fingerprint:
+                METRICS.inc('fetcha_page_fingerprints_total', {'outcome': 'unchanged'})
+                await self.db.touch_last_check([product['id'] for product in products], datetime.now())
+                progress.unchanged += 1
+                return True
+            METRICS.inc('fetcha_page_fingerprints_total', {'outcome': 'changed' if fingerprint else 'none'})
+            
+            # A learned recipe for this page template avoids the full discovery,
+            # and most retailers publish the price as structured data
+            new_price = await self._extract_with_recipe(target, response.text, progress)
+            if new_price is None:
+                new_price = await self._extract_structured(target, response.text, progress)
+        
+        if new_price is None:
+            if not SCRAPER_AVAILABLE:
+                # Nothing to extract the price with - not the site's fault
+                return None if response is not None else False
+            
+            # Extract current price in the extraction pool
+            started = time.perf_counter()
+            results = await self.extraction_pool.run(target['url'])
+            new_price = extract_price(results) if results is not None else None
+            observe_extraction_tier('universal', time.perf_counter() - started, bool(new_price))
+            if not new_price:
+                return False
+            
+            if response is not None:
+                await self._learn_recipe(target, response.text, new_price, extract_product_name(results))
+        
+        validators = None
+        if response is not None:
+            if last_price is None or abs(new_price - last_price) > 0.01:
+                fingerprint = await asyncio.to_thread(page_fingerprint, response.text, new_price)
+            validators = (canonical_url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                          fingerprint)
+        
+        # Queue the price for every subscriber's row; alert on whatever a flush wrote
+        changes = await writes.add(products, new_price, datetime.now(), validators)
+        await self._queue_price_alerts(changes, progress)
+        return True
+    
+    async def _fetch_page(self, target: Dict) -> Tuple[bool, Optional[httpx.Response], Optional[str]]:
+        """GET a target's page, conditionally if validators are cached
+        
+        Returns (not_modified, response, fingerprint); response is None
+        unless the page came back 200, and fingerprint is the one stored
+        when the page's price was last recorded. Returns None if the URL,
+        or a redirect, leads off the public internet.
+        """
+        etag, last_modified, fingerprint = await self.db.get_http_validators(target['canonical_url']) or (None,) * 3
+        
+        domain = METRICS.domain(target['url'])
+        try:
+            with METRICS.timer('fetcha_page_fetch_seconds', {'domain': domain}):
+                response = await self.http.fetch(target['url'], etag, last_modified)
+        except httpx.HTTPError as e:
+            METRICS.inc('fetcha_page_fetches_total', {'domain': domain, 'status': 'error'})
+            logger.debug(f"Page fetch failed for {target['url']}: {e}")
+            return False, None, fingerprint
+        if response is None:
+            METRICS.inc('fetcha_page_fetches_total', {'domain': domain, 'status': 'refused'})
+            return None
+        
+        METRICS.inc('fetcha_page_fetches_total', {'domain': domain, 'status': str(response.status_code)})
+        if response.status_code == 304:
+            return True, None, fingerprint
+        if response.status_code != 200:
+            return False, None, fingerprint
+        return False, response, fingerprint
+    
+    async def _extract_with_recipe(self, target: Dict, html: str,
+                                   progress: CheckCycleProgress) -> Optional[float]:
+        """Try the cached recipe for this page template; None means fall back"""
+        domain, template = normalize_host(target['url']), page_template(target['url'])
+        recipe = await self.db.get_extraction_recipe(domain, template)
+        if recipe is None:
+            METRICS.inc('fetcha_recipe_lookups_total', {'outcome': 'none'})
+            progress.recipe_misses += 1
+            return None
+        
+        started = time.perf_counter()
+        try:
+            price, _ = await asyncio.to_thread(apply_recipe, recipe, html)
+        except Exception as e:
+            logger.debug(f"Recipe failed for {domain}{template}: {e}")
+            price = None
+        
+        hit = price is not None and self._price_is_plausible(price, target['products'])
+        observe_extraction_tier('recipe', time.perf_counter() - started, hit)
+        await self.db.record_recipe_result(domain, template, hit)
+        METRICS.inc('fetcha_recipe_lookups_total', {'outcome': 'hit' if hit else 'miss'})
+        if hit:
+            progress.recipe_hits += 1
+            return price
+        
+        progress.recipe_misses += 1
+        return None
+    
+    async def _extract_structured(self, target: Dict, html: str,
+                                  progress: CheckCycleProgress) -> Optional[float]:
+        """Read the price from the page's JSON-LD, microdata or OpenGraph; None means escalate"""
+        started = time.perf_counter()
+        try:
+            found = await asyncio.to_thread(extract_structured_data, html)
+        except Exception as e:
+            logger.debug(f"Structured data parse failed for {target['url']}: {e}")
+            found = None
+        
+        hit = found is not None and self._price_is_plausible(found['price'], target['products'])
+        observe_extraction_tier('structured', time.perf_counter() - started, hit)
+        if hit:
+            progress.structured_hits += 1
+            return found['price']
+        
+        progress.structured_misses += 1
+        return None
+    
+    def _last_price(self, products: List[Dict]) -> Optional[float]:
+        """The last price recorded for a URL's subscribers, if any"""
+        return next((p['current_price'] for p in products if p.get('current_price')), None)
+    
+    def _price_is_plausible(self, price: float, products: List[Dict]) -> bool:
+        """Validate a recipe or structured-data price against the last known price"""
+        if price <= 0:
+            return False
+        
+        last_price = self._last_price(products)
+        if not last_price:
+            return True
+        return 1 / RECIPE_MAX_PRICE_RATIO <= price / last_price <= RECIPE_MAX_PRICE_RATIO
+    
+    async def _learn_recipe(self, target: Dict, html: str, price: float, product_name: Optional[str]):
+        """Remember how the full extractor's price can be read from this page"""
+        domain, template = normalize_host(target['url']), page_template(target['url'])
+        try:
+            recipe = await asyncio.to_thread(learn_recipe, html, price, product_name)
+        except Exception as e:
+            logger.debug(f"Could not learn recipe for {domain}{template}: {e}")
+            return
+        
+        if recipe is not None:
+            await self.db.save_extraction_recipe(domain, template, recipe)
+    
+    async def _flush_price_writes(self, writes: PriceWriteBuffer, progress: CheckCycleProgress):
+        """Periodically write buffered prices so alerts are not held back"""
+        while True:
+            await asyncio.sleep(CHECK_WRITE_INTERVAL)
+            try:
+                await self._queue_price_alerts(await writes.flush(), progress)
+            except Exception as e:
+                progress.errors += 1
+                logger.error(f"Error writing price batch: {e}")
+    
+    async def _queue_price_alerts(self, changes: List[Tuple[Dict, bool, float, float]],
+                                  progress: CheckCycleProgress):
+        """Queue an alert for every written row whose price changed significantly"""
+        alerts = []
+        for product, price_changed, old_price, new_price in changes:
+            if not price_changed:
+                continue
+            
+            progress.changed += 1
+            if abs(price_change_percent(old_price, new_price)) < ALERT_MIN_CHANGE_PERCENT:
+                continue
+            
+            alerts.append((product['id'], product['telegram_id'], product['product_name'],
+                           product['url'], old_price, new_price))
+        
+        if alerts:
+            await self.db.add_price_alerts(alerts)
+            progress.alerts += len(alerts)
+    
+    async def _report_check_progress(self, progress: CheckCycleProgress):
+        """Periodically log progress of the running check cycle"""
+        while True:
+            await asyncio.sleep(CHECK_PROGRESS_INTERVAL)
+            logger.info(f"Background price check progress: {progress.summary()}")
+    
+    async def close(self):
+        """Release the checker's extraction pool, HTTP client and database"""
+        self.extraction_pool.shutdown()
+        await self.http.aclose()
+        await self.db.close()
+
+
+async def _run_standalone_checker():
+    """Run one PriceChecker until SIGINT/SIGTERM, then hand its leases back"""
+    checker = PriceChecker()
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    
+    metrics_server = await start_metrics_server()
+    try:
+        await checker.run()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        await checker.close()
 
 
 def main():
-    """Main entry point"""
+    """Main entry point
+    
+    Roles:
+        all      the bot with an embedded price checker (default)
+        bot      Telegram front-end only; delivers alerts queued by checkers
+        checker  a standalone price checker; run as many as needed
+        export   write products or price history as CSV/JSONL and exit
+    """
+    parser = argparse.ArgumentParser(description="Fetcha - Telegram Price Tracker Bot")
+    parser.add_argument('role', nargs='?', choices=['all', 'bot', 'checker', 'export'], default='all',
+                        help="process role (default: all)")
+    export_options = parser.add_argument_group('export options')
+    export_options.add_argument('--table', choices=list(EXPORT_COLUMNS), default='products')
+    export_options.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    export_options.add_argument('--user', type=int, help="Telegram id to export (default: everyone)")
+    export_options.add_argument('--output', help="file to write (default: stdout)")
+    args = parser.parse_args()
+    
+    if args.role == 'export':
+        db = PriceTrackerDB()
+        try:
+            if args.output:
+                with open(args.output, 'wb') as out:
+                    write_export(db, args.table, args.format, out, args.user)
+            else:
+                write_export(db, args.table, args.format, sys.stdout.buffer, args.user)
+                sys.stdout.flush()
+        finally:
+            db.close()
+        return
+    
+    if args.role == 'checker':
+        asyncio.run(_run_standalone_checker())
+        return
+    
     # Get token from environment
     token = os.getenv('TELEGRAM_BOT_TOKEN')
     
@@ -895,8 +5251,21 @@ def main():
         print("3. Run this script again")
         sys.exit(1)
     
+    if BOT_MODE not in ('polling', 'webhook'):
+        print(f"❌ Error: FETCHA_BOT_MODE must be 'polling' or 'webhook', not '{BOT_MODE}'")
+        sys.exit(1)
+    
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_AVAILABLE:
+            print("❌ Error: webhook mode needs: pip install 'python-telegram-bot[webhooks]'")
+            sys.exit(1)
+        if not WEBHOOK_URL.startswith('https://') or not WEBHOOK_SECRET:
+            print("❌ Error: webhook mode needs FETCHA_WEBHOOK_URL (https://...) and FETCHA_WEBHOOK_SECRET")
+            print("   FETCHA_WEBHOOK_SECRET: 1-256 characters from A-Z, a-z, 0-9, _ and -")
+            sys.exit(1)
+    
     # Start bot
-    bot = PriceTrackerBot(token)
+    bot = PriceTrackerBot(token, run_checker=args.role == 'all')
     bot.run()
 
 
@@ -0,0 +1,18 @@
+"""Shared fixtures for the Fetcha test suite"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram_price_tracker_mvp import PriceTrackerDB  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A migrated PriceTrackerDB in a temporary directory"""
+    database = PriceTrackerDB(tmp_path / 'fetcha.db')
+    yield database
+    database.close()
@@ -0,0 +1,47 @@
+"""Price alert delivery through the Telegram rate limits"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+from telegram_price_tracker_mvp import AsyncPriceTrackerDB, PriceTrackerBot, _parse_utc_timestamp
+
+
+class FloodedBot:
+    """Stands in for the Telegram bot: every send hits flood control"""
+    
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        self.sent = asyncio.Event()
+    
+    async def send_message(self, **kwargs):
+        self.sent.set()
+        raise RetryAfter(self.retry_after)
+
+
+def test_flood_controlled_alerts_are_sent_again_after_retry_after(db, monkeypatch):
+    monkeypatch.setattr('telegram_price_tracker_mvp.ALERT_DIGEST_WINDOW', 0)
+    db.add_price_alerts([(1, 1, 'Kettle', 'https://shop.com/p/1', 50.0, 40.0)])
+    
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        bot = PriceTrackerBot('token', run_checker=False, db=async_db)
+        telegram = FloodedBot(retry_after=30)
+        delivery = asyncio.create_task(bot.run_alert_delivery(SimpleNamespace(bot=telegram)))
+        await asyncio.wait_for(telegram.sent.wait(), 5)
+        await asyncio.sleep(0.1)
+        delivery.cancel()
+        await asyncio.gather(delivery, return_exceptions=True)
+        with db._reader() as conn:
+            alert = conn.execute('SELECT next_attempt_at, attempts FROM price_alerts').fetchone()
+        await bot.http.aclose()
+        await async_db.close()
+        return alert
+    
+    next_attempt_at, attempts = asyncio.run(scenario())
+    retry_at = _parse_utc_timestamp(next_attempt_at) - datetime.now(timezone.utc)
+    # Released for Telegram's retry_after, not held for the whole claim
+    assert timedelta(seconds=25) < retry_at < timedelta(seconds=35)
+    assert attempts == 0
@@ -0,0 +1,145 @@
+"""Full check cycles: resuming an interrupted cycle, leases and the shared scheduler"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmark_load import FakeHttpFetcher, page_price, seed
+from telegram_price_tracker_mvp import (
+    AsyncPriceTrackerDB, DomainScheduler, ExtractionPool, PriceChecker, canonicalize_url,
+)
+
+
+class CountingFetcher(FakeHttpFetcher):
+    """FakeHttpFetcher that counts page fetches and flags when stop_after is reached"""
+    
+    def __init__(self, stop_after: int = 0, latency: float = 0.002):
+        super().__init__(latency=latency, not_modified_rate=0.0)
+        self.fetched = []
+        self.stop_after = stop_after
+        self.reached = asyncio.Event()
+    
+    async def fetch(self, url, etag=None, last_modified=None):
+        self.fetched.append(url)
+        if len(self.fetched) >= self.stop_after:
+            self.reached.set()
+        return await super().fetch(url, etag, last_modified)
+
+
+@pytest.fixture
+def fast_cycles(monkeypatch):
+    monkeypatch.setattr('telegram_price_tracker_mvp.CHECK_STREAM_PAGE', 20)
+    monkeypatch.setattr('telegram_price_tracker_mvp.CHECK_CYCLE_CHECKPOINT_INTERVAL', 0.05)
+    monkeypatch.setattr('telegram_price_tracker_mvp.DOMAIN_RATE', 1000)
+    monkeypatch.setattr('telegram_price_tracker_mvp.DOMAIN_BURST', 10)
+
+
+def test_interrupted_cycle_resumes_where_it_stopped(db, fast_cycles):
+    seed(db, 120, 12, 0.3)
+    
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        first = CountingFetcher(stop_after=50)
+        checker = PriceChecker(async_db, ExtractionPool('thread', 1), first, owner='checker-a')
+        cycle = asyncio.create_task(checker.run_full_cycle())
+        await asyncio.wait_for(first.reached.wait(), 30)
+        cycle.cancel()
+        await asyncio.gather(cycle, return_exceptions=True)
+        
+        interrupted = await async_db.get_check_cycle()
+        assert interrupted['finished_at'] is None and interrupted['owner'] is None
+        
+        second = CountingFetcher()
+        resumed = PriceChecker(async_db, ExtractionPool('thread', 1), second, owner='checker-b')
+        await resumed.run_full_cycle()
+        
+        finished = await async_db.get_check_cycle()
+        checked = products(db)
+        await async_db.close()
+        return first.fetched, second.fetched, interrupted, finished, checked
+    
+    first, second, interrupted, finished, checked = asyncio.run(scenario())
+    
+    assert finished['id'] == interrupted['id']
+    assert finished['finished_at'] is not None and finished['restarts'] == 1
+    # Every URL was checked, and at most the ones in flight at the interruption twice
+    assert set(first) | set(second) == {product['url'] for product in checked}
+    assert len(set(first) & set(second)) <= len(first) - interrupted['scraped']
+    assert finished['scraped'] == 120
+    
+    for product in checked:
+        assert product['checked_cycle_id'] == finished['id']
+        assert product['current_price'] == page_price(product['url'])
+
+
+def test_cycle_taken_over_stops_at_once(db, fast_cycles, caplog):
+    seed(db, 120, 12, 0.3)
+    
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        fetcher = CountingFetcher(stop_after=10, latency=0.05)
+        checker = PriceChecker(async_db, ExtractionPool('thread', 1), fetcher, owner='checker-a')
+        cycle = asyncio.create_task(checker.run_full_cycle())
+        await asyncio.wait_for(fetcher.reached.wait(), 30)
+        taken = await async_db.claim_check_cycle('checker-b', datetime.now() + timedelta(minutes=5))
+        
+        # The next heartbeat finds the cycle gone; the checks in flight are cancelled, not drained
+        await asyncio.wait_for(cycle, 5)
+        stopped_at = len(fetcher.fetched)
+        await asyncio.sleep(0.2)
+        record = await async_db.get_check_cycle()
+        await async_db.close()
+        return taken, record, stopped_at, len(fetcher.fetched)
+    
+    taken, record, stopped_at, fetched = asyncio.run(scenario())
+    assert fetched == stopped_at < 60
+    assert record['owner'] == 'checker-b' and record['finished_at'] is None
+    assert record['scraped'] == taken['scraped']
+    assert 'Background price check complete' not in caplog.text
+
+
+def products(db):
+    with db._reader() as conn:
+        rows = conn.execute('SELECT url, checked_cycle_id, current_price FROM tracked_products').fetchall()
+    return [dict(zip(('url', 'checked_cycle_id', 'current_price'), row)) for row in rows]
+
+
+def test_cycle_skips_urls_another_checker_holds(db, fast_cycles):
+    seed(db, 20, 4, 0.3)
+    held = [product['url'] for product in products(db)][:3]
+    later = datetime.now() + timedelta(minutes=5)
+    for url in held:
+        assert db.claim_url_lease('checker-z', canonicalize_url(url), later)
+    
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        fetcher = CountingFetcher()
+        checker = PriceChecker(async_db, ExtractionPool('thread', 1), fetcher, owner='checker-a')
+        await checker.run_full_cycle()
+        with db._reader() as conn:
+            leases = conn.execute('SELECT DISTINCT lease_owner FROM tracked_products').fetchall()
+        await async_db.close()
+        return fetcher.fetched, leases
+    
+    fetched, leases = asyncio.run(scenario())
+    assert not set(fetched) & set(held)
+    assert len(fetched) == 17
+    assert set(leases) == {(None,), ('checker-z',)}  # The cycle released its own
+
+
+def test_lanes_share_each_hosts_limits():
+    async def scenario():
+        scheduler = DomainScheduler([], {'shop.com': {'rate': 1000, 'burst': 10, 'concurrency': 1}}, closed=False)
+        await scheduler.add({'url': 'https://shop.com/p/1'})
+        await scheduler.add({'url': 'https://shop.com/p/2'}, 'cycle')
+        host, _ = await scheduler.next()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.next('cycle'), 0.1)
+        
+        await scheduler.release(host)
+        _, item = await asyncio.wait_for(scheduler.next('cycle'), 1)
+        assert item['url'] == 'https://shop.com/p/2'
+        assert len(scheduler) == 0
+    
+    asyncio.run(scenario())
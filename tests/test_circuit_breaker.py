@@ -0,0 +1,79 @@
+"""DomainCircuitBreaker state transitions"""
+
+import pytest
+
+from telegram_price_tracker_mvp import DomainCircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A controllable time.monotonic for the breaker"""
+    now = [1000.0]
+    monkeypatch.setattr('telegram_price_tracker_mvp.time.monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return DomainCircuitBreaker(failures=3, cooldown=60, max_cooldown=200, probes=1)
+
+
+def fail(breaker, host, times):
+    for _ in range(times):
+        assert breaker.allow(host)
+        breaker.record(host, False)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    fail(breaker, 'shop.com', 2)
+    assert breaker.state('shop.com') == 'closed'
+    fail(breaker, 'shop.com', 1)
+    assert breaker.state('shop.com') == 'open'
+    assert not breaker.allow('shop.com')
+    assert 50 <= breaker.retry_in('shop.com') <= 70
+    assert breaker.open_count == 1
+
+
+def test_success_resets_the_failure_count(breaker):
+    fail(breaker, 'shop.com', 2)
+    breaker.record('shop.com', True)
+    fail(breaker, 'shop.com', 2)
+    assert breaker.state('shop.com') == 'closed'
+
+
+def test_hosts_are_independent(breaker):
+    fail(breaker, 'shop.com', 3)
+    assert breaker.allow('other.com')
+    assert breaker.state('other.com') == 'closed'
+
+
+def test_half_open_probe_success_closes(breaker, clock):
+    fail(breaker, 'shop.com', 3)
+    clock[0] += 100
+    assert breaker.state('shop.com') == 'half-open'
+    assert breaker.allow('shop.com')
+    assert not breaker.allow('shop.com')  # Only one probe at a time
+    breaker.record('shop.com', True)
+    assert breaker.state('shop.com') == 'closed'
+    assert breaker.open_count == 0
+
+
+def test_half_open_probe_failure_reopens_with_longer_cooldown(breaker, clock):
+    fail(breaker, 'shop.com', 3)
+    clock[0] += 100
+    fail(breaker, 'shop.com', 1)
+    assert breaker.state('shop.com') == 'open'
+    assert 100 <= breaker.retry_in('shop.com') <= 140
+    
+    # The cooldown doubles up to max_cooldown
+    clock[0] += 200
+    fail(breaker, 'shop.com', 1)
+    assert 180 <= breaker.retry_in('shop.com') <= 220
+
+
+def test_failure_of_a_check_started_before_opening_is_ignored(breaker):
+    for _ in range(4):
+        assert breaker.allow('shop.com')
+    for _ in range(4):
+        breaker.record('shop.com', False)
+    assert 50 <= breaker.retry_in('shop.com') <= 70
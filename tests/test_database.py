@@ -0,0 +1,224 @@
+"""Migration runner, alert outbox, check cycle records and the async writer"""
+
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from unittest.mock import ANY
+
+import pytest
+
+from telegram_price_tracker_mvp import MIGRATIONS, AsyncPriceTrackerDB, PriceTrackerDB, canonicalize_url
+
+
+def columns(db, table):
+    with db._reader() as conn:
+        return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def test_new_database_is_at_the_latest_version(db):
+    assert db.schema_version() == max(version for version, _, _ in MIGRATIONS)
+    assert {'canonical_url', 'next_check_at', 'checked_cycle_id', 'check_failures'} <= columns(db, 'tracked_products')
+
+
+def test_migrations_are_applied_once(db):
+    calls = []
+    migration = (1000, "Test migration", [
+        'CREATE TABLE test_widgets (id INTEGER PRIMARY KEY)',
+        lambda conn: calls.append(conn.execute('SELECT COUNT(*) FROM test_widgets').fetchone()[0]),
+    ])
+    db.migrate(MIGRATIONS + [migration])
+    db.migrate(MIGRATIONS + [migration])
+    assert calls == [0]
+    assert db.schema_version() == 1000
+
+
+def test_failed_migration_is_rolled_back(db):
+    def broken(conn):
+        raise RuntimeError("broken step")
+    
+    with pytest.raises(RuntimeError):
+        db.migrate(MIGRATIONS + [(1000, "Broken migration", ['CREATE TABLE test_widgets (id INTEGER)', broken])])
+    assert db.schema_version() == max(version for version, _, _ in MIGRATIONS)
+    assert 'id' not in columns(db, 'test_widgets')
+
+
+def test_reopening_an_existing_database_keeps_its_data(db, tmp_path):
+    db.add_user(1, 'user1', 'Test', 'australia')
+    db.add_tracked_product(1, 'https://shop.com/p/1', 'Kettle', 50.0)
+    db.close()
+    
+    reopened = PriceTrackerDB(tmp_path / 'fetcha.db')
+    try:
+        assert [p['product_name'] for p in reopened.get_tracked_products(1)] == ['Kettle']
+    finally:
+        reopened.close()
+
+
+def pending_alerts(db):
+    with db._reader() as conn:
+        return conn.execute('''
+            SELECT product_id, old_price, new_price FROM price_alerts WHERE sent_at IS NULL ORDER BY id
+        ''').fetchall()
+
+
+def test_pending_alert_per_product_is_updated_not_duplicated(db):
+    db.add_price_alerts([(1, 1, 'Kettle', 'https://shop.com/p/1', 50.0, 45.0)])
+    db.add_price_alerts([(1, 1, 'Kettle', 'https://shop.com/p/1', 45.0, 40.0)])
+    assert pending_alerts(db) == [(1, 50.0, 40.0)]
+    
+    # Once sent, the next move is a new alert
+    alerts = db.claim_pending_alerts(10, datetime.now() + timedelta(hours=1))
+    db.mark_alerts_sent([alert['id'] for alert in alerts])
+    db.add_price_alerts([(1, 1, 'Kettle', 'https://shop.com/p/1', 40.0, 42.0)])
+    assert pending_alerts(db) == [(1, 40.0, 42.0)]
+
+
+def test_claimed_alerts_are_not_claimed_again(db):
+    db.add_price_alerts([(n, 1, 'Kettle', f'https://shop.com/p/{n}', 50.0, 45.0) for n in range(1, 4)])
+    later = datetime.now() + timedelta(hours=1)
+    assert len(db.claim_pending_alerts(10, later)) == 3
+    assert db.claim_pending_alerts(10, later) == []
+
+
+def test_alerts_are_claimed_one_digest_per_chat(db):
+    db.add_price_alerts([(n, 1 if n <= 5 else 2, 'Kettle', f'https://shop.com/p/{n}', 50.0, 45.0)
+                         for n in range(1, 8)])
+    later = datetime.now() + timedelta(hours=1)
+    first = db.claim_pending_alerts(10, later, per_chat=3)
+    assert [alert['product_id'] for alert in first] == [1, 2, 3, 6, 7]
+    assert [alert['product_id'] for alert in db.claim_pending_alerts(10, later, per_chat=3)] == [4, 5]
+
+
+def test_alerts_wait_for_the_digest_window(db):
+    db.add_price_alerts([(1, 1, 'Kettle', 'https://shop.com/p/1', 50.0, 45.0)])
+    assert db.claim_pending_alerts(10, datetime.now() - timedelta(hours=1)) == []
+
+
+def test_deferred_alerts_wait_without_using_an_attempt(db):
+    db.add_price_alerts([(1, 1, 'Kettle', 'https://shop.com/p/1', 50.0, 45.0)])
+    later = datetime.now() + timedelta(hours=1)
+    [alert] = db.claim_pending_alerts(10, later, claim_seconds=3600)
+    db.defer_alerts([(alert['id'], 0)])
+    assert [claimed['id'] for claimed in db.claim_pending_alerts(10, later)] == [alert['id']]
+    
+    db.defer_alerts([(alert['id'], 60)])
+    assert db.claim_pending_alerts(10, later) == []
+    with db._reader() as conn:
+        assert conn.execute('SELECT attempts FROM price_alerts').fetchone() == (0,)
+
+
+def add_products(db, count):
+    for n in range(1, count + 1):
+        db.add_user(n, f'user{n}', 'Test', 'australia')
+        db.add_tracked_product(n, f'https://shop.com/p/{n}', f'Product {n}', 50.0)
+
+
+def test_only_one_check_cycle_runs_at_a_time(db):
+    add_products(db, 3)
+    cycle_id = db.start_check_cycle()
+    assert cycle_id is not None
+    assert db.start_check_cycle() is None
+    assert db.get_check_cycle()['total'] == 3
+
+
+def test_check_cycle_resumes_from_its_checkpoint(db):
+    add_products(db, 6)
+    cycle_id = db.start_check_cycle()
+    fresh = datetime.now() - timedelta(minutes=5)
+    cycle = db.claim_check_cycle('checker-a', fresh)
+    assert cycle['cursor'] == 0 and cycle['restarts'] == 0
+    assert db.claim_check_cycle('checker-b', fresh) is None  # Still owned
+    
+    db.mark_checked_in_cycle([1, 2, 4], cycle_id)
+    counts = {'total': 6, 'scraped': 3, 'checked': 3, 'changed': 1, 'alerts': 1, 'errors': 0}
+    assert db.checkpoint_check_cycle(cycle_id, 'checker-a', 2, counts, release=True)
+    
+    resumed = db.claim_check_cycle('checker-b', fresh)
+    assert resumed['cursor'] == 2 and resumed['scraped'] == 3 and resumed['restarts'] == 1
+    remaining = db.get_active_products_page(resumed['cursor'], 100, unchecked_in_cycle=cycle_id)
+    assert [product.id for product in remaining] == [3, 5, 6]
+    
+    # The previous owner lost the cycle
+    assert not db.checkpoint_check_cycle(cycle_id, 'checker-a', 4, counts)
+    assert db.checkpoint_check_cycle(cycle_id, 'checker-b', 6, counts, finished=True, release=True)
+    assert db.get_check_cycle()['finished_at'] is not None
+    assert db.claim_check_cycle('checker-c', fresh) is None
+
+
+def test_stale_check_cycle_is_taken_over(db):
+    db.start_check_cycle()
+    db.claim_check_cycle('checker-a', datetime.now() - timedelta(minutes=5))
+    assert db.claim_check_cycle('checker-b', datetime.now() + timedelta(minutes=5))['id'] is not None
+
+
+def test_url_lease_is_held_by_one_checker(db):
+    add_products(db, 2)
+    url = canonicalize_url('https://shop.com/p/1')
+    later = datetime.now() + timedelta(minutes=5)
+    assert db.claim_url_lease('checker-a/cycle', url, later)
+    assert not db.claim_url_lease('checker-b/cycle', url, later)
+    due = db.claim_due_urls('checker-b', later + timedelta(days=365), 10, later)
+    assert due == [(canonicalize_url('https://shop.com/p/2'), ANY)]  # The due queue skips it too
+    
+    db.release_leases('checker-b', [url])  # Not its lease
+    assert not db.claim_url_lease('checker-b/cycle', url, later)
+    db.release_leases('checker-a/cycle', [url])
+    assert db.claim_url_lease('checker-b/cycle', url, later)
+
+
+def test_cancelled_write_does_not_stop_the_writer(db):
+    """A caller cancelled while its write is applied must not kill the writer thread"""
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        add_user = db.add_user
+        
+        def slow_add_user(*args):
+            time.sleep(0.2)
+            return add_user(*args)
+        
+        db.add_user = slow_add_user
+        write = asyncio.create_task(async_db.add_user(1, 'user1', 'Test', 'australia'))
+        await asyncio.sleep(0.05)
+        write.cancel()
+        await asyncio.gather(write, return_exceptions=True)
+        db.add_user = add_user
+        
+        await asyncio.wait_for(async_db.add_user(2, 'user2', 'Test', 'australia'), 5)
+        assert async_db._writer_thread.is_alive()
+        assert (await async_db.get_user(1)) is not None  # The cancelled write was still applied
+        await async_db.close()
+    
+    asyncio.run(scenario())
+
+
+def test_write_cancelled_while_being_resolved_does_not_strand_the_batch(db):
+    """A cancel landing between the writer's checks and set_result must not skip later futures"""
+    class CancelledOnResolve(Future):
+        def set_result(self, result):
+            self.cancel()
+            super().set_result(result)
+    
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        cancelled, waiting = CancelledOnResolve(), Future()
+        async_db._apply([[db.add_user, (1, 'user1', 'Test', 'australia'), [cancelled]],
+                         [db.add_user, (2, 'user2', 'Test', 'australia'), [waiting]]])
+        assert cancelled.cancelled()
+        assert waiting.result(timeout=0) is None
+        await async_db.close()
+    
+    asyncio.run(scenario())
+
+
+def test_failed_write_reaches_its_caller_only(db):
+    async def scenario():
+        async_db = AsyncPriceTrackerDB(db)
+        with pytest.raises(sqlite3.OperationalError):
+            await async_db._write(lambda: db._write_conn.execute('SELECT * FROM no_such_table'))
+        await async_db.add_user(1, 'user1', 'Test', 'australia')
+        assert (await async_db.get_user(1))['username'] == 'user1'
+        await async_db.close()
+    
+    asyncio.run(scenario())
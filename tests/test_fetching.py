@@ -0,0 +1,97 @@
+"""Pages are only fetched from public addresses, on every redirect and connection"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from telegram_price_tracker_mvp import HttpFetcher, is_public_address
+
+DNS = {'shop.com': ['93.184.216.34'], 'intranet.shop.com': ['10.0.0.5'], 'mixed.shop.com': ['93.184.216.34', '127.0.0.1']}
+
+
+class FakeDNSFetcher(HttpFetcher):
+    """HttpFetcher that resolves hosts from DNS and serves pages from routes in-process"""
+    
+    def __init__(self, routes=None):
+        super().__init__()
+        self.routes = routes
+        self.requested = []
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            transport = httpx.MockTransport(self._serve) if self.routes is not None else None
+            self._client = httpx.AsyncClient(transport=transport)
+        return self._client
+    
+    async def resolve(self, host: str, port: int) -> list:
+        return DNS.get(host, ['93.184.216.34'])
+    
+    def _serve(self, request: httpx.Request) -> httpx.Response:
+        self.requested.append(str(request.url))
+        location = self.routes.get(str(request.url))
+        if location:
+            return httpx.Response(302, headers={'Location': location})
+        return httpx.Response(200, text='<html></html>')
+
+
+@pytest.mark.parametrize('address, public', [
+    ('93.184.216.34', True),
+    ('10.0.0.5', False),
+    ('127.0.0.1', False),
+    ('169.254.169.254', False),
+    ('::1', False),
+    ('::ffff:127.0.0.1', False),
+    ('2606:4700:4700::1111', True),
+])
+def test_is_public_address(address, public):
+    assert is_public_address(address) is public
+
+
+@pytest.mark.parametrize('url', [
+    'http://intranet.shop.com/admin',
+    'http://mixed.shop.com/p',
+    'file:///etc/passwd',
+    'ftp://shop.com/p',
+])
+def test_non_public_urls_are_not_requested(url):
+    fetcher = FakeDNSFetcher(routes={})
+    assert asyncio.run(fetcher.fetch(url)) is None
+    assert fetcher.requested == []
+
+
+def test_every_redirect_is_checked():
+    fetcher = FakeDNSFetcher(routes={
+        'https://shop.com/p/1': 'https://shop.com/p/2',
+        'https://shop.com/p/2': 'http://intranet.shop.com/admin',
+    })
+    assert asyncio.run(fetcher.fetch('https://shop.com/p/1')) is None
+    assert fetcher.requested == ['https://shop.com/p/1', 'https://shop.com/p/2']
+    
+    fetcher = FakeDNSFetcher(routes={'https://shop.com/p/1': 'https://shop.com/p/2'})
+    assert asyncio.run(fetcher.fetch('https://shop.com/p/1', etag='"v1"')).status_code == 200
+
+
+def test_connection_to_a_rebound_internal_address_is_refused():
+    """DNS said public when checked, but the connection lands on loopback: nothing is sent"""
+    async def scenario():
+        received = []
+        
+        async def handle(reader, writer):
+            received.append(await reader.read(100))
+            writer.close()
+        
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        fetcher = FakeDNSFetcher()
+        try:
+            with pytest.raises(httpx.ConnectError):
+                await fetcher.fetch(f'http://127.0.0.1:{port}/p')
+        finally:
+            await fetcher.aclose()
+            server.close()
+            await server.wait_closed()
+        return received
+    
+    assert not any(asyncio.run(scenario()))
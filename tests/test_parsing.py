@@ -0,0 +1,85 @@
+"""Price parsing, URL canonicalization and page fingerprints"""
+
+import pytest
+
+from telegram_price_tracker_mvp import canonicalize_url, page_fingerprint, parse_price_text
+
+
+@pytest.mark.parametrize('value, expected', [
+    (1299, 1299.0),
+    (19.99, 19.99),
+    ('$1,299.00', 1299.0),
+    ('1.299,00 €', 1299.0),
+    ('1 299,00', 1299.0),
+    ('1\u00a0299,00', 1299.0),
+    ('AU$ 24.95', 24.95),
+    ('1,299', 1299.0),
+    ('12,50', 12.5),
+    ('19.99', 19.99),
+    ('1.299', 1299.0),
+    ('1.299 €', 1299.0),
+    ('€ 12.500', 12500.0),
+    ('1.299.000', 1299000.0),
+    ('1.5', 1.5),
+    ('0.999', 0.999),
+    ('1234.567', 1234.567),
+])
+def test_parse_price_text(value, expected):
+    assert parse_price_text(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('value', [True, None, '', 'free', ['19.99']])
+def test_parse_price_text_rejects_non_prices(value):
+    assert parse_price_text(value) is None
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTPS://www.Shop.com:443/p/1/?utm_source=x&b=2&a=1&gclid=z#frag', 'https://shop.com/p/1?a=1&b=2'),
+    ('http://shop.com:80/p', 'http://shop.com/p'),
+    ('http://shop.com:8080/p', 'http://shop.com:8080/p'),
+    ('https://shop.com', 'https://shop.com/'),
+    ('https://shop.com/p?ref=abc&id=7', 'https://shop.com/p?id=7'),
+])
+def test_canonicalize_url(url, expected):
+    assert canonicalize_url(url) == expected
+
+
+def test_canonicalize_url_is_idempotent():
+    url = canonicalize_url('https://www.shop.com/p/1/?b=2&a=1&utm_campaign=sale')
+    assert canonicalize_url(url) == url
+
+
+def product_page(price: str, noise: str = '', footer: str = 'Free shipping') -> str:
+    return (
+        f'<html><head><script>var t = "{noise}";</script>'
+        f'<meta name="csrf-token" content="{noise}"><!-- rendered {noise} --></head>'
+        f'<body><h1>Kettle</h1><span class="price">${price}</span>'
+        f'<p>Updated 2026-10-{noise or "01"}T10:00:00Z</p><footer>{footer}</footer></body></html>'
+    )
+
+
+def test_page_fingerprint_ignores_dynamic_noise():
+    first = page_fingerprint(product_page('49.95', '01'), 49.95)
+    assert first is not None
+    assert page_fingerprint(product_page('49.95', '17'), 49.95) == first
+
+
+def test_page_fingerprint_changes_with_the_page():
+    first = page_fingerprint(product_page('49.95'), 49.95)
+    assert page_fingerprint(product_page('44.95'), 44.95) != first
+    assert page_fingerprint(product_page('49.95', footer='Sold out'), 49.95) != first
+
+
+def test_page_fingerprint_needs_the_price_on_the_page():
+    # A price rendered by a script is stripped with the script: no fingerprint
+    assert page_fingerprint(product_page('49.95'), 39.95) is None
+    assert page_fingerprint(product_page('49.95'), None) is None
+    assert page_fingerprint(product_page('49.95'), 49.95, scope='off') is None
+
+
+def test_page_fingerprint_price_scope_ignores_distant_changes(monkeypatch):
+    monkeypatch.setattr('telegram_price_tracker_mvp.FINGERPRINT_WINDOW', 40)
+    padding = 'x' * 200
+    first = page_fingerprint(product_page('49.95', footer=padding + 'a'), 49.95, scope='price')
+    assert page_fingerprint(product_page('49.95', footer=padding + 'b'), 49.95, scope='price') == first
+    assert page_fingerprint(product_page('49.95', footer=padding + 'b'), 49.95, scope='page') != first
@@ -0,0 +1,93 @@
+"""Change-only price history, rollups and retention"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+START = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def product_id(db):
+    db.add_user(1, 'user1', 'Test', 'australia')
+    return db.add_tracked_product(1, 'https://shop.com/p/1', 'Kettle', 50.0)
+
+
+def history(db):
+    with db._reader() as conn:
+        return conn.execute(
+            'SELECT price, checked_at, last_seen_at FROM price_history ORDER BY checked_at'
+        ).fetchall()
+
+
+def test_unchanged_price_extends_the_latest_row(db, product_id):
+    assert db.update_product_prices([(product_id, 50.0, START)]) == {product_id: (False, 50.0)}
+    db.update_product_prices([(product_id, 50.0, START + timedelta(hours=2))])
+    assert history(db) == [(50.0, '2026-01-01 10:00:00', '2026-01-01 12:00:00')]
+
+
+def test_changed_price_adds_a_row(db, product_id):
+    db.update_product_prices([(product_id, 50.0, START)])
+    assert db.update_product_prices([(product_id, 45.0, START + timedelta(hours=3))]) == {product_id: (True, 50.0)}
+    assert history(db) == [
+        (50.0, '2026-01-01 10:00:00', '2026-01-01 10:00:00'),
+        (45.0, '2026-01-01 13:00:00', '2026-01-01 13:00:00'),
+    ]
+    assert db.get_tracked_products(1)[0]['current_price'] == 45.0
+
+
+def test_all_mode_keeps_a_row_per_check(db, product_id, monkeypatch):
+    monkeypatch.setattr('telegram_price_tracker_mvp.PRICE_HISTORY_MODE', 'all')
+    for hours in range(3):
+        db.update_product_prices([(product_id, 50.0, START + timedelta(hours=hours))])
+    assert len(history(db)) == 3
+
+
+def test_rollup_weights_prices_by_time_and_runs_once(db, product_id):
+    db.update_product_prices([(product_id, 50.0, START)])
+    db.update_product_prices([(product_id, 50.0, START + timedelta(hours=2))])
+    db.update_product_prices([(product_id, 45.0, START + timedelta(hours=3))])
+    
+    assert db.rollup_price_history() == 2
+    assert db.rollup_price_history() == 0
+    with db._reader() as conn:
+        hourly = conn.execute('''
+            SELECT bucket_start, min_price, max_price, seconds FROM price_history_hourly ORDER BY bucket_start
+        ''').fetchall()
+        daily = conn.execute('SELECT min_price, max_price, avg_price FROM price_history_daily').fetchall()
+    assert hourly == [
+        ('2026-01-01 10:00:00', 50.0, 50.0, 3600.0),
+        ('2026-01-01 11:00:00', 50.0, 50.0, 3600.0),
+        ('2026-01-01 13:00:00', 45.0, 45.0, 1.0),
+    ]
+    assert daily == [(45.0, 50.0, pytest.approx((50.0 * 7200 + 45.0) / 7201))]
+
+
+def test_rollup_only_adds_newly_seen_time(db, product_id):
+    db.update_product_prices([(product_id, 50.0, START)])
+    db.rollup_price_history()
+    db.update_product_prices([(product_id, 50.0, START + timedelta(hours=1))])
+    assert db.rollup_price_history() == 1
+    with db._reader() as conn:
+        assert conn.execute('SELECT SUM(seconds) FROM price_history_hourly').fetchone()[0] == 3601.0
+
+
+def test_retention_deletes_only_rolled_up_history(db, product_id, monkeypatch):
+    monkeypatch.setattr('telegram_price_tracker_mvp.PRICE_HISTORY_RETENTION_DAYS', 30)
+    monkeypatch.setattr('telegram_price_tracker_mvp.PRICE_HOURLY_RETENTION_DAYS', 30)
+    old = datetime.now(timezone.utc) - timedelta(days=60)
+    db.update_product_prices([(product_id, 50.0, old)])
+    
+    assert db.apply_price_history_retention()['price_history'] == 0  # Not rolled up yet
+    db.rollup_price_history()
+    deleted = db.apply_price_history_retention()
+    assert deleted['price_history'] == 1
+    assert deleted['price_history_hourly'] == 1
+    assert 'price_history_daily' not in deleted  # Kept forever by default
+    assert history(db) == []
+    
+    # The current price row survives while the product keeps being checked
+    db.update_product_prices([(product_id, 50.0, datetime.now(timezone.utc))])
+    db.rollup_price_history()
+    assert db.apply_price_history_retention()['price_history'] == 0
+    assert len(history(db)) == 1
@@ -0,0 +1,228 @@
+"""/history statistics, sparklines, the statistics cache and the /history replies"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import telegram_price_tracker_mvp as tracker
+from telegram_price_tracker_mvp import (
+    SPARKLINE_BLOCKS, AsyncPriceTrackerDB, PriceStatsCache, PriceTrackerBot, price_history_stats, sparkline,
+)
+
+needs_numpy = pytest.mark.skipif(not tracker.NUMPY_AVAILABLE, reason="numpy is not installed")
+
+# Change-only rows: 100 for two days, 80 for half a day, then 90 until the last check
+ROWS = [
+    ('2026-01-01 00:00:00', '2026-01-02 12:00:00', 100.0),
+    ('2026-01-03 00:00:00', '2026-01-03 06:00:00', 80.0),
+    ('2026-01-03 12:00:00', '2026-01-04 00:00:00', 90.0),
+]
+
+
+def daily_rows(prices):
+    """One row per day, each price holding until the next day's change"""
+    start = datetime(2026, 1, 1)
+    return [((start + timedelta(days=day)).strftime('%Y-%m-%d %H:%M:%S'),
+             (start + timedelta(days=day)).strftime('%Y-%m-%d %H:%M:%S'), price)
+            for day, price in enumerate(prices)]
+
+
+@needs_numpy
+def test_stats_weight_each_price_by_how_long_it_held():
+    stats = price_history_stats(ROWS, None)
+    assert stats['mean'] == pytest.approx((100.0 * 4 + 80.0 + 90.0) / 6)
+    assert (stats['low'], stats['low_at'], stats['high'], stats['current']) == (80.0, '2026-01-03', 100.0, 90.0)
+    assert stats['observed_days'] == pytest.approx(3.0)
+    assert list(stats['daily']) == [100.0, 100.0, 80.0, 90.0]
+
+
+@needs_numpy
+def test_stats_only_cover_the_window():
+    # The 100 row was in effect when the two day window opened, so it counts from then
+    stats = price_history_stats(ROWS, None, days=2)
+    assert stats['mean'] == pytest.approx((100.0 * 2 + 80.0 + 90.0) / 4)
+    assert stats['high'] == 100.0
+    assert stats['observed_days'] == pytest.approx(2.0)
+
+
+@needs_numpy
+def test_moving_averages_need_enough_days():
+    stats = price_history_stats(daily_rows([100.0 + day for day in range(40)]), None)
+    assert stats['moving_averages'] == {7: pytest.approx(136.0), 30: pytest.approx(124.5)}
+    
+    stats = price_history_stats(daily_rows([100.0 + day for day in range(10)]), None)
+    assert stats['moving_averages'] == {7: pytest.approx(106.0)}
+
+
+@needs_numpy
+def test_stable_price_has_no_volatility():
+    stats = price_history_stats(daily_rows([50.0] * 10), 50.0)
+    assert stats['volatility'] == 0.0
+    assert stats['drop_from_high'] == 0.0
+
+
+@needs_numpy
+def test_volatility_skips_days_after_a_zero_price():
+    # 10 -> 0 is -100%, 0 -> 10 has no percentage, 10 -> 11 is +10%
+    stats = price_history_stats(daily_rows([10.0, 0.0, 10.0, 11.0]), None)
+    assert stats['volatility'] == pytest.approx(55.0)
+    assert price_history_stats(daily_rows([0.0, 0.0, 5.0]), None)['volatility'] is None
+
+
+def test_no_history_has_no_stats():
+    assert price_history_stats([], None) is None
+
+
+@needs_numpy
+def test_all_time_high_includes_the_daily_rollup(db):
+    db.add_user(1, 'user1', 'Test', 'australia')
+    product_id = db.add_tracked_product(1, 'https://shop.com/p/1', 'Kettle', 150.0)
+    old = datetime.now(timezone.utc) - timedelta(days=400)
+    db.update_product_prices([(product_id, 150.0, old)])
+    db.update_product_prices([(product_id, 100.0, old + timedelta(hours=1))])
+    db.update_product_prices([(product_id, 100.0, datetime.now(timezone.utc))])
+    db.rollup_price_history()
+    db.apply_price_history_retention()  # The 150 row is only in the daily rollup now
+    
+    rows, all_time_high = db.get_price_history(product_id, 90)
+    assert [price for _, _, price in rows] == [100.0]
+    assert all_time_high == 150.0
+    stats = price_history_stats(rows, all_time_high)
+    assert stats['high'] == 100.0
+    assert stats['drop_from_high'] == pytest.approx(100 / 3)
+
+
+@needs_numpy
+def test_sparkline_scales_to_the_blocks():
+    assert sparkline(range(len(SPARKLINE_BLOCKS))) == SPARKLINE_BLOCKS
+    assert sparkline([5.0, 5.0, 5.0]) == SPARKLINE_BLOCKS[len(SPARKLINE_BLOCKS) // 2] * 3
+    line = sparkline(range(100), width=30)
+    assert len(line) == 30
+    assert (line[0], line[-1]) == (SPARKLINE_BLOCKS[0], SPARKLINE_BLOCKS[-1])
+
+
+def test_stats_cache_is_valid_for_one_version():
+    cache = PriceStatsCache(max_size=2)
+    assert cache.get(1, (10, 'a')) is None
+    cache.put(1, (10, 'a'), {'mean': 1.0})
+    assert cache.get(1, (10, 'a')) == {'mean': 1.0}
+    assert cache.get(1, (10, 'b')) is None  # Extended by a price write
+    assert (cache.hits, cache.misses) == (1, 2)
+    
+    cache.put(2, (20, 'a'), {})
+    cache.get(1, (10, 'a'))
+    cache.put(3, (30, 'a'), {})  # Evicts 2, the least recently used
+    assert cache.get(2, (20, 'a')) is None
+    assert cache.get(1, (10, 'a')) is not None
+
+
+class Chat:
+    """Stands in for the Telegram objects a handler replies through"""
+    
+    def __init__(self, user_id: int):
+        self.replies = []
+        self.effective_user = SimpleNamespace(id=user_id)
+        self.message = SimpleNamespace(reply_text=self.reply_text)
+    
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+    
+    def history(self, *args):
+        return self, SimpleNamespace(args=list(args))
+    
+    def press(self, data: str):
+        async def answer():
+            pass
+        
+        update = SimpleNamespace(callback_query=SimpleNamespace(
+            data=data, answer=answer, from_user=self.effective_user, message=self.message
+        ))
+        return update, SimpleNamespace(args=[])
+
+
+@pytest.fixture
+def bot(db):
+    db.add_user(1, 'user1', 'Test', 'australia')
+    for n, price in enumerate([50.0, 80.0], start=1):
+        product_id = db.add_tracked_product(1, f'https://shop.com/p/{n}', f'Product {n}', price)
+        start = datetime.now(timezone.utc) - timedelta(days=10)
+        db.update_product_prices([(product_id, price + 10, start)])
+        db.update_product_prices([(product_id, price, start + timedelta(days=5))])
+    
+    async_db = AsyncPriceTrackerDB(db)
+    bot = PriceTrackerBot('token', run_checker=False, db=async_db)
+    yield bot
+    
+    async def close():
+        await bot.http.aclose()
+        await async_db.close()
+    
+    asyncio.run(close())
+
+
+@needs_numpy
+def test_history_command_summarises_every_product(bot):
+    chat = Chat(1)
+    asyncio.run(bot.history_command(*chat.history()))
+    assert 'Price History' in chat.replies[0]
+    assert '**Product 1**' in chat.replies[0] and '**Product 2**' in chat.replies[0]
+    assert 'Now $50.00' in chat.replies[0] and 'High $60.00' in chat.replies[0]
+
+
+@needs_numpy
+def test_history_command_for_one_product(bot):
+    chat = Chat(1)
+    asyncio.run(bot.history_command(*chat.history('2')))
+    assert chat.replies[0].count('📦') == 1
+    
+    asyncio.run(bot.history_command(*chat.history('3')))
+    assert chat.replies[1] == "Usage: /history [1-2] (the number from /list)"
+
+
+@needs_numpy
+def test_history_stats_are_cached_until_the_next_price_write(bot):
+    chat = Chat(1)
+    asyncio.run(bot.history_command(*chat.history('1')))
+    asyncio.run(bot.history_command(*chat.history('1')))
+    assert (bot.history_cache.hits, bot.history_cache.misses) == (1, 1)
+    assert chat.replies[0] == chat.replies[1]
+    
+    async def write_price():
+        await bot.db.update_product_prices([(1, 40.0, datetime.now(timezone.utc)),
+                                            (2, 40.0, datetime.now(timezone.utc))])
+    
+    asyncio.run(write_price())
+    asyncio.run(bot.history_command(*chat.history('1')))
+    assert (bot.history_cache.hits, bot.history_cache.misses) == (1, 2)
+    assert 'Now $40.00' in chat.replies[2]
+
+
+@needs_numpy
+def test_history_leaves_out_an_undefined_volatility(bot, db):
+    db.add_tracked_product(1, 'https://shop.com/p/3', 'Free sample', 0.0)
+    start = datetime.now(timezone.utc) - timedelta(days=3)
+    db.update_product_prices([(3, 0.0, start), (3, 0.0, start + timedelta(days=3))])
+    chat = Chat(1)
+    asyncio.run(bot.button_callback(*chat.press('history_3')))
+    assert '**Free sample**' in chat.replies[0]
+    assert 'Volatility' not in chat.replies[0] and 'nan' not in chat.replies[0]
+
+
+@needs_numpy
+def test_history_button(bot):
+    chat = Chat(1)
+    asyncio.run(bot.button_callback(*chat.press('history_2')))
+    assert '**Product 2**' in chat.replies[0]
+    
+    asyncio.run(bot.button_callback(*chat.press('history_9')))
+    assert chat.replies[1] == "This product is no longer tracked. Use /list to see your products."
+
+
+def test_history_without_numpy(bot, monkeypatch):
+    monkeypatch.setattr('telegram_price_tracker_mvp.NUMPY_AVAILABLE', False)
+    chat = Chat(1)
+    asyncio.run(bot.history_command(*chat.history()))
+    asyncio.run(bot.button_callback(*chat.press('history_1')))
+    assert chat.replies == ["📈 Price history analytics are not available on this server yet."] * 2
@@ -0,0 +1,24 @@
+"""The hot queries are served by their indexes
+
+The plans are taken for the SQL the PriceTrackerDB methods actually run
+(captured by benchmark_db.query_plans), so they cannot drift from the code.
+"""
+
+import pytest
+
+from benchmark_db import QUERY_PLAN_EXPECTATIONS, query_plans, seed
+
+
+@pytest.fixture
+def plans(db):
+    seed(db, 100, 3)
+    for product_id in range(1, 50):
+        db.update_product_price(product_id, 90.0)
+    return {name: (expected, plan) for name, expected, plan in query_plans(db)}
+
+
+@pytest.mark.parametrize('name', [name for name, *_ in QUERY_PLAN_EXPECTATIONS])
+def test_query_uses_its_index(plans, name):
+    expected, plan = plans[name]
+    assert expected in plan
+    assert 'TEMP B-TREE' not in plan